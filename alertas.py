@@ -0,0 +1,253 @@
+"""
+Motor de alertas por umbrales sobre los rangos del semáforo (sensores.RANGOS).
+
+Se suscribe al bus de deltas y evalúa solo los puntos nuevos de cada serie,
+así que el costo depende de lo que llega y no de la longitud del histórico.
+Por serie guarda el nivel confirmado (Óptimo / Precaución / Crítico), un
+nivel candidato y desde cuándo se mantiene:
+
+- Histéresis: empeorar de nivel usa los rangos tal cual, pero para mejorar
+  el valor debe entrar en la banda mejor con un margen (una fracción del
+  ancho del rango verde), así un valor que oscila en el borde no alterna.
+- Duración mínima: un cambio se confirma solo si el nivel candidato se
+  mantiene `duracion_min` en tiempo de telemetría.
+
+Cada cambio confirmado se guarda en un registro compacto de transiciones
+(arrays NumPy), y las alertas activas se leen del estado sin tocar la
+telemetría cruda.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from deltas import pasos_por_serie
+from instrumentation import span
+from kpis import ESTADOS, estado_semaforo
+from sensores import ALIAS_KEYS, RANGOS
+
+OPTIMO, PRECAUCION, CRITICO, DESCONOCIDO = range(4)
+_MAGNITUDES = list(RANGOS)
+_SIN_RANGO = -1
+
+
+def _contraer(rangos: dict, margen: float) -> dict:
+    """Rangos verde y amarillo estrechados `margen` por ambos lados (para mejorar de nivel)."""
+    verde_min, verde_max = rangos["verde"]
+    return {
+        "verde": (verde_min + margen, verde_max - margen),
+        "amarillo": [(mn + margen, mx - margen) for mn, mx in rangos.get("amarillo", [])],
+        "rojo": rangos.get("rojo", []),
+    }
+
+
+class MotorAlertas:
+    """
+    Estado de alertas de toda la flota, compartido entre sesiones
+    (st.cache_resource). Suscribir `procesar` a un DeltaBus.
+    """
+
+    def __init__(self, histeresis: float = 0.05, duracion_min: pd.Timedelta = pd.Timedelta(minutes=15),
+                 rangos: dict = None, capacidad: int = 1024):
+        self.rangos = rangos or RANGOS
+        self.duracion_min_ms = int(pd.Timedelta(duracion_min).total_seconds() * 1000)
+        self._salida = {
+            m: _contraer(r, histeresis * (r["verde"][1] - r["verde"][0])) for m, r in self.rangos.items()
+        }
+        self._lock = threading.Lock()
+        self._claves = {}
+        self._estado = {
+            "magnitud": np.full(capacidad, _SIN_RANGO, dtype=np.int8),
+            "nivel": np.zeros(capacidad, dtype=np.int8),
+            "candidato": np.zeros(capacidad, dtype=np.int8),
+            "candidato_desde": np.zeros(capacidad, dtype=np.int64),
+            "nivel_desde": np.zeros(capacidad, dtype=np.int64),
+            "ultimo_ts": np.full(capacidad, -1, dtype=np.int64),
+            "ultimo_valor": np.full(capacidad, np.nan, dtype=np.float32),
+        }
+        self._log = {
+            "serie": np.empty(capacidad, dtype=np.int32),
+            "ts": np.empty(capacidad, dtype=np.int64),
+            "anterior": np.empty(capacidad, dtype=np.int8),
+            "nuevo": np.empty(capacidad, dtype=np.int8),
+            "valor": np.empty(capacidad, dtype=np.float32),
+        }
+        self._n_log = 0
+        self._stats = {"puntos": 0, "transiciones": 0}
+
+    # ── Estado por serie ──
+
+    def _registrar(self, delta: pd.DataFrame) -> np.ndarray:
+        """Número de serie de cada punto; las series nuevas toman su magnitud de la key."""
+        series = delta["serie"].to_numpy(dtype=np.int64)
+        capacidad = len(self._estado["nivel"])
+        if series.max() >= capacidad:
+            nueva = max(int(series.max()) + 1, 2 * capacidad)
+            for nombre, arr in self._estado.items():
+                relleno = {"magnitud": _SIN_RANGO, "ultimo_ts": -1, "ultimo_valor": np.nan}.get(nombre, 0)
+                self._estado[nombre] = np.concatenate([arr, np.full(nueva - capacidad, relleno, dtype=arr.dtype)])
+        sin_ver = np.flatnonzero(self._estado["ultimo_ts"][series] < 0)
+        if len(sin_ver):
+            nuevas, primera = np.unique(series[sin_ver], return_index=True)
+            filas = sin_ver[primera]
+            claves = zip(delta["device_id"].to_numpy()[filas].tolist(), delta["key"].to_numpy()[filas].tolist())
+            for serie, clave in zip(nuevas.tolist(), claves):
+                self._claves[serie] = clave
+                magnitud = ALIAS_KEYS.get(clave[1])
+                if magnitud in self.rangos:
+                    self._estado["magnitud"][serie] = _MAGNITUDES.index(magnitud)
+        return series
+
+    def _clasificar(self, series: np.ndarray, x: np.ndarray) -> tuple:
+        """
+        Nivel de cada punto con los rangos tal cual (para empeorar) y con la
+        banda contraída (para mejorar). No depende del estado: se calcula
+        una vez para todo el delta.
+        """
+        entrar = np.full(len(x), DESCONOCIDO, dtype=np.int8)
+        salir = entrar.copy()
+        magnitudes = self._estado["magnitud"][series]
+        for codigo, magnitud in enumerate(_MAGNITUDES):
+            m = magnitudes == codigo
+            if m.any():
+                entrar[m] = estado_semaforo(x[m], self.rangos[magnitud])
+                salir[m] = estado_semaforo(x[m], self._salida[magnitud])
+        return entrar, salir
+
+    def _anotar(self, series: np.ndarray, ts: np.ndarray, anterior: np.ndarray,
+                nuevo: np.ndarray, valores: np.ndarray):
+        n = len(series)
+        fin = self._n_log + n
+        if fin > len(self._log["serie"]):
+            capacidad = max(fin, 2 * len(self._log["serie"]))
+            self._log = {c: np.resize(a, capacidad) for c, a in self._log.items()}
+        for columna, datos in (("serie", series), ("ts", ts), ("anterior", anterior),
+                               ("nuevo", nuevo), ("valor", valores)):
+            self._log[columna][self._n_log:fin] = datos
+        self._n_log = fin
+
+    def _paso(self, f: np.ndarray, ts: np.ndarray, x: np.ndarray, entrar: np.ndarray, salir: np.ndarray):
+        """Un punto nuevo por serie: actualiza candidato y confirma los cambios sostenidos."""
+        e = self._estado
+        e["ultimo_ts"][f] = ts
+        e["ultimo_valor"][f] = x
+        primero = e["nivel_desde"][f] == 0
+        # Primer punto de la serie: el nivel inicial se toma sin duración mínima
+        inicial = np.where(entrar == DESCONOCIDO, OPTIMO, entrar)
+        e["nivel"][f[primero]] = inicial[primero]
+        e["nivel_desde"][f[primero]] = ts[primero]
+
+        actual = e["nivel"][f]
+        # Empeora con los rangos tal cual; mejora solo dentro de la banda contraída.
+        # Valores fuera de todo rango (huecos entre bandas, NaN) no cambian el nivel.
+        propuesto = np.where(entrar > actual, entrar, np.minimum(actual, salir))
+        propuesto = np.where(entrar == DESCONOCIDO, actual, propuesto)
+
+        cambia_candidato = propuesto != e["candidato"][f]
+        e["candidato_desde"][f[cambia_candidato]] = ts[cambia_candidato]
+        e["candidato"][f] = propuesto
+
+        confirmar = (propuesto != actual) & (ts - e["candidato_desde"][f] >= self.duracion_min_ms)
+        if confirmar.any():
+            fc = f[confirmar]
+            self._anotar(fc, e["candidato_desde"][fc], actual[confirmar], propuesto[confirmar], x[confirmar])
+            e["nivel"][fc] = propuesto[confirmar]
+            e["nivel_desde"][fc] = e["candidato_desde"][fc]
+
+    # ── Procesamiento ──
+
+    def procesar(self, delta: pd.DataFrame):
+        """Evalúa un delta del DeltaBus (device_id, key, serie, ts, value)."""
+        if delta.empty:
+            return
+        with self._lock, span("alertas.delta", points=len(delta)) as sp:
+            antes = self._n_log
+            series = self._registrar(delta)
+            ts = delta["ts"].to_numpy(dtype="int64")
+            valores = delta["value"].to_numpy(dtype="float64")
+            # Keys sin rangos (batería, etc.): solo se registra su último valor
+            con_rango = self._estado["magnitud"][series] != _SIN_RANGO
+            sin_rango = np.flatnonzero(~con_rango)
+            if len(sin_rango):
+                self._estado["ultimo_ts"][series[sin_rango]] = ts[sin_rango]
+            series, ts, valores = series[con_rango], ts[con_rango], valores[con_rango]
+            entrar, salir = self._clasificar(series, valores)
+            for sel in pasos_por_serie(series, ts):
+                self._paso(series[sel], ts[sel], valores[sel], entrar[sel], salir[sel])
+            sp["transitions"] = self._n_log - antes
+            self._stats["puntos"] += len(delta)
+            self._stats["transiciones"] += self._n_log - antes
+
+    # ── Consultas ──
+
+    def _marco(self, series: np.ndarray) -> pd.DataFrame:
+        claves = [self._claves[s] for s in series.tolist()]
+        magnitudes = self._estado["magnitud"][series]
+        return pd.DataFrame({
+            "device_id": [c[0] for c in claves],
+            "key": [c[1] for c in claves],
+            "magnitud": np.array(_MAGNITUDES + [None], dtype=object)[magnitudes],
+        })
+
+    def activas(self, nivel_min: int = PRECAUCION) -> pd.DataFrame:
+        """
+        Series cuyo nivel confirmado es al menos `nivel_min`, con nivel,
+        desde cuándo, último valor y su fecha. Más graves y antiguas primero.
+        """
+        with self._lock:
+            n = len(self._estado["nivel"])
+            e = {c: a[:n] for c, a in self._estado.items()}
+            series = np.flatnonzero((e["magnitud"] != _SIN_RANGO) & (e["ultimo_ts"] >= 0) & (e["nivel"] >= nivel_min))
+            df = self._marco(series)
+        df["nivel"] = pd.Categorical.from_codes(e["nivel"][series], categories=ESTADOS, ordered=True)
+        df["desde"] = e["nivel_desde"][series].astype("datetime64[ms]")
+        df["ultimo_valor"] = e["ultimo_valor"][series].astype("float64")
+        df["ultima_fecha"] = e["ultimo_ts"][series].astype("datetime64[ms]")
+        return df.sort_values(["nivel", "desde"], ascending=[False, True], ignore_index=True)
+
+    def resumen(self) -> dict:
+        """Número de series por nivel confirmado: {'Óptimo': n, ...}."""
+        with self._lock:
+            e = self._estado
+            vistas = (e["magnitud"] != _SIN_RANGO) & (e["ultimo_ts"] >= 0)
+            conteo = np.bincount(e["nivel"][vistas], minlength=len(ESTADOS))
+        return dict(zip(ESTADOS, conteo.tolist()))
+
+    def transiciones(self, device_id: str = None, desde=None) -> pd.DataFrame:
+        """Registro de cambios de nivel confirmados (el más reciente primero)."""
+        with self._lock:
+            log = {c: a[:self._n_log].copy() for c, a in self._log.items()}
+            claves = dict(self._claves)
+        mascara = np.ones(len(log["serie"]), dtype=bool)
+        if device_id is not None:
+            propias = [s for s, c in claves.items() if c[0] == device_id]
+            mascara &= np.isin(log["serie"], propias)
+        if desde is not None:
+            mascara &= log["ts"] >= pd.Timestamp(desde).value // 1_000_000
+        filas = np.flatnonzero(mascara)[::-1]
+        series = log["serie"][filas]
+        estados = np.array(ESTADOS, dtype=object)
+        return pd.DataFrame({
+            "device_id": [claves[s][0] for s in series.tolist()],
+            "key": [claves[s][1] for s in series.tolist()],
+            "fecha": log["ts"][filas].astype("datetime64[ms]"),
+            "anterior": estados[log["anterior"][filas]],
+            "nuevo": estados[log["nuevo"][filas]],
+            "valor": log["valor"][filas].astype("float64"),
+        })
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "series": len(self._claves),
+                    "bytes_log": sum(a[:self._n_log].nbytes for a in self._log.values())}
+
+    def metricas(self) -> dict:
+        """Métricas para register_collector."""
+        stats = self.stats()
+        resumen = self.resumen()
+        return {
+            "mvp_alertas_puntos_total": stats["puntos"],
+            "mvp_alertas_transiciones_total": stats["transiciones"],
+            "mvp_alertas_precaucion": resumen["Precaución"],
+            "mvp_alertas_criticas": resumen["Crítico"],
+        }
@@ -0,0 +1,201 @@
+"""
+Detección de anomalías en línea sobre la telemetría que llega por el bus
+de deltas.
+
+Cada serie (dispositivo, key) guarda un estado de tamaño fijo: media y
+varianza exponenciales (EWMA) y una mediana y desviación absoluta
+robustas que se actualizan por pasos de signo, también en O(1) por punto.
+Un punto es anómalo cuando se aleja de la serie tanto en z-score EWMA como
+en z-score robusto; exigir ambos evita marcar el ruido de series muy
+estables y los saltos que la media aún no absorbió.
+
+El estado de todas las series vive en arrays NumPy. Un delta se procesa
+"en paralelo" entre series: el paso k actualiza a la vez el k-ésimo punto
+nuevo de cada serie, así que un delta de flota con pocos puntos por serie
+son unas pocas operaciones vectorizadas, y un relleno histórico cuesta
+tantos pasos como puntos tenga la serie más larga.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from deltas import pasos_por_serie
+from instrumentation import span
+from sensores import ESQUEMAS
+
+# σ ≈ 1.2533 · desviación absoluta media (distribución normal)
+_MAD_A_SIGMA = np.sqrt(np.pi / 2)
+# Un riego sube la humedad de golpe: en humedad solo las caídas son sospechosas
+DIRECCIONES = {esquema["humedad"]: -1 for esquema in ESQUEMAS.values()}
+COLUMNAS_ANOMALIAS = ["device_id", "key", "ts", "fecha", "value", "z", "z_robusto"]
+
+
+class DetectorAnomalias:
+    """
+    Detector compartido entre sesiones (st.cache_resource). Suscribir
+    `procesar` a un DeltaBus; `anomalias()` consulta el registro acotado
+    de los últimos `max_eventos` puntos marcados.
+    """
+
+    def __init__(self, alpha: float = 0.05, eta: float = 0.02, umbral_z: float = 4.0,
+                 umbral_robusto: float = 4.0, min_puntos: int = 30, max_eventos: int = 10_000,
+                 direcciones: dict = None, capacidad: int = 1024):
+        self.alpha = alpha
+        self.eta = eta
+        self.umbral_z = umbral_z
+        self.umbral_robusto = umbral_robusto
+        self.min_puntos = min_puntos
+        self.max_eventos = max_eventos
+        # key → 1 (solo subidas), -1 (solo bajadas); las demás, ambas
+        self.direcciones = DIRECCIONES if direcciones is None else direcciones
+        self._lock = threading.Lock()
+        # (device_id, key) → fila, para consultas puntuales
+        self._indice = {}
+        self._estado = {
+            "media": np.zeros(capacidad),
+            "var": np.zeros(capacidad),
+            "mediana": np.zeros(capacidad),
+            "mad": np.zeros(capacidad),
+            "n": np.zeros(capacidad, dtype=np.int64),
+            "direccion": np.zeros(capacidad, dtype=np.int8),
+        }
+        self._eventos = pd.DataFrame(columns=COLUMNAS_ANOMALIAS)
+        self._stats = {"puntos": 0, "anomalias": 0}
+
+    # ── Estado por serie ──
+
+    def _filas(self, delta: pd.DataFrame) -> np.ndarray:
+        """
+        Fila de estado de cada punto: el número de serie que asigna el
+        DeltaBus. Solo las series vistas por primera vez pasan por Python.
+        """
+        series = delta["serie"].to_numpy(dtype=np.int64)
+        capacidad = len(self._estado["n"])
+        if series.max() >= capacidad:
+            nueva = max(int(series.max()) + 1, 2 * capacidad)
+            for nombre, arr in self._estado.items():
+                self._estado[nombre] = np.concatenate([arr, np.zeros(nueva - capacidad, dtype=arr.dtype)])
+        sin_estado = np.flatnonzero(self._estado["n"][series] == 0)
+        if len(sin_estado):
+            nuevas, primera = np.unique(series[sin_estado], return_index=True)
+            filas = sin_estado[primera]
+            claves = zip(delta["device_id"].to_numpy()[filas].tolist(), delta["key"].to_numpy()[filas].tolist())
+            for serie, clave in zip(nuevas.tolist(), claves):
+                self._indice[clave] = serie
+                self._estado["direccion"][serie] = self.direcciones.get(clave[1], 0)
+        return series
+
+    def _paso(self, f: np.ndarray, x: np.ndarray) -> tuple:
+        """
+        Un punto nuevo por serie (filas `f` sin repetir): puntúa contra el
+        estado previo y lo actualiza. Retorna (z, z_robusto, anómalo).
+        """
+        e = self._estado
+        media, var, mediana, mad, n = e["media"][f], e["var"][f], e["mediana"][f], e["mad"][f], e["n"][f]
+        primero = n == 0
+        calentando = n < self.min_puntos
+
+        std = np.sqrt(var)
+        escala = _MAD_A_SIGMA * mad
+        with np.errstate(divide="ignore", invalid="ignore"):
+            z = np.where(std > 0, (x - media) / std, 0.0)
+            z_robusto = np.where(escala > 0, (x - mediana) / escala, 0.0)
+        anomalo = ~calentando & (np.abs(z) > self.umbral_z) & (np.abs(z_robusto) > self.umbral_robusto)
+        direccion = e["direccion"][f]
+        anomalo &= (direccion == 0) | (np.sign(z) == direccion)
+
+        # Los puntos anómalos entran recortados para no arrastrar el estado
+        d = x - media
+        d = np.where(anomalo, np.clip(d, -self.umbral_z * std, self.umbral_z * std), d)
+        e["media"][f] = np.where(primero, x, media + self.alpha * d)
+        e["var"][f] = np.where(primero, 0.0, (1 - self.alpha) * (var + self.alpha * d * d))
+
+        # Mediana y desviación: EWMA durante el calentamiento, luego pasos de signo
+        desv = x - mediana
+        absoluta = np.where(anomalo, np.minimum(np.abs(desv), self.umbral_robusto * escala), np.abs(desv))
+        paso_mediana = np.where(calentando, self.alpha * desv, self.eta * mad * np.sign(desv))
+        e["mediana"][f] = np.where(primero, x, mediana + paso_mediana)
+        tasa = np.where(calentando, self.alpha, self.eta)
+        e["mad"][f] = np.where(primero, 0.0, mad + tasa * (absoluta - mad))
+        e["n"][f] = n + 1
+        return z, z_robusto, anomalo
+
+    # ── Procesamiento ──
+
+    def procesar(self, delta: pd.DataFrame) -> pd.DataFrame:
+        """
+        Procesa un delta (device_id, key, serie, ts, value) y retorna los puntos
+        anómalos. Los puntos de cada serie deben llegar en orden de ts y
+        posteriores a los ya procesados (lo garantiza el DeltaBus).
+        """
+        if delta.empty:
+            return pd.DataFrame(columns=COLUMNAS_ANOMALIAS)
+
+        with self._lock, span("anomalias.delta", points=len(delta)) as sp:
+            ts = delta["ts"].to_numpy(dtype="int64")
+            valores = delta["value"].to_numpy(dtype="float64")
+            filas = self._filas(delta)
+
+            z = np.empty(len(delta))
+            z_robusto = np.empty(len(delta))
+            anomalo = np.zeros(len(delta), dtype=bool)
+            pasos = 0
+            for sel in pasos_por_serie(filas, ts):
+                z[sel], z_robusto[sel], anomalo[sel] = self._paso(filas[sel], valores[sel])
+                pasos += 1
+            sp["steps"] = pasos
+
+            nuevas = pd.DataFrame({
+                "device_id": delta["device_id"].to_numpy()[anomalo],
+                "key": delta["key"].to_numpy()[anomalo],
+                "ts": ts[anomalo],
+                "fecha": ts[anomalo].astype("datetime64[ms]"),
+                "value": valores[anomalo],
+                "z": z[anomalo],
+                "z_robusto": z_robusto[anomalo],
+            })
+            sp["anomalies"] = len(nuevas)
+            self._stats["puntos"] += len(delta)
+            self._stats["anomalias"] += len(nuevas)
+            if len(nuevas):
+                eventos = pd.concat([self._eventos, nuevas], ignore_index=True) if len(self._eventos) else nuevas
+                self._eventos = eventos.iloc[-self.max_eventos:].reset_index(drop=True)
+            return nuevas
+
+    def anomalias(self, device_id: str = None, desde=None, hasta=None) -> pd.DataFrame:
+        """Anomalías registradas, opcionalmente de un dispositivo y en [desde, hasta)."""
+        with self._lock:
+            eventos = self._eventos
+        if device_id is not None:
+            eventos = eventos[eventos["device_id"] == device_id]
+        if desde is not None:
+            eventos = eventos[eventos["fecha"] >= pd.Timestamp(desde)]
+        if hasta is not None:
+            eventos = eventos[eventos["fecha"] < pd.Timestamp(hasta)]
+        return eventos
+
+    def estado(self, device_id: str, key: str) -> dict:
+        """Estado actual de una serie (media, std, mediana, mad, n), o None."""
+        with self._lock:
+            fila = self._indice.get((device_id, key))
+            if fila is None:
+                return None
+            e = {nombre: arr[fila].item() for nombre, arr in self._estado.items()}
+        e["std"] = float(np.sqrt(e.pop("var")))
+        return e
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "series": len(self._indice),
+                    "bytes_estado": sum(a.nbytes for a in self._estado.values())}
+
+
+    def metricas(self) -> dict:
+        """Métricas para register_collector."""
+        stats = self.stats()
+        return {
+            "mvp_anomalias_puntos_total": stats["puntos"],
+            "mvp_anomalias_total": stats["anomalias"],
+            "mvp_anomalias_series": stats["series"],
+        }
@@ -6,6 +6,8 @@ import seaborn as sns
 from adjustText import adjust_text
 import matplotlib.ticker as mticker
 import datetime
+from synthetic_fleet import ultimos_reportes_bateria
+from eventos import TIPOS_EVENTOS, anotar_eventos, cargar_eventos_csv, generar_eventos_recurrentes
 
 # =========================
 # Dashboard Permacultura Tech
@@ -112,23 +114,27 @@ df_filtered = df_show[
 # =========================
 # Generar eventos recurrentes (~cada 2 semanas)
 # =========================
-tipos_eventos = ["Riego", "Fertilización", "Planificación de riego"]
 markers = {"Riego": "o", "Fertilización": "s", "Planificación de riego": "^"}
 colors = {"Riego": "blue", "Fertilización": "green", "Planificación de riego": "purple"}
 
-# Crear fechas cada 14 días en el rango
-rango_fechas = pd.date_range(start=start_date_input, end=end_date_input, freq="14D")
-
-eventos = []
-for fecha in rango_fechas:
-    for tipo in tipos_eventos:
-        # Buscar la fila de df_filtered más cercana a la fecha
-        fila = df_filtered.iloc[(df_filtered["Fecha"] - fecha).abs().argsort()[:1]]
-        fila = fila.copy()
-        fila["Tipo"] = tipo
-        eventos.append(fila)
-
-df_eventos = pd.concat(eventos).reset_index(drop=True)
+# Eventos reales desde CSV (columnas Fecha, Tipo) o, si no hay, eventos cada 14 días
+archivo_eventos = st.file_uploader("Cargar eventos de riego/fertilización (CSV con columnas Fecha, Tipo)", type="csv")
+if archivo_eventos is not None:
+    try:
+        eventos_fuente = cargar_eventos_csv(archivo_eventos)
+    except ValueError as e:
+        st.error(str(e))
+        eventos_fuente = generar_eventos_recurrentes(start_date_input, end_date_input)
+    eventos_fuente = eventos_fuente[
+        (eventos_fuente["Fecha"] >= start_date_input) &
+        (eventos_fuente["Fecha"] <= end_date_input)
+    ]
+else:
+    eventos_fuente = generar_eventos_recurrentes(start_date_input, end_date_input)
+
+# Cada evento se marca sobre la muestra más cercana (un solo merge_asof)
+df_eventos = anotar_eventos(df_filtered, eventos_fuente)
+tipos_eventos = list(dict.fromkeys(eventos_fuente["Tipo"])) or TIPOS_EVENTOS
 
 # =========================
 # Selector de eventos
@@ -184,8 +190,8 @@ for tipo in selected_eventos:
     subset = df_eventos[df_eventos["Tipo"] == tipo]
     ax.scatter(
         subset["Fecha"], subset[selected_var],
-        color=colors[tipo],
-        marker=markers[tipo],
+        color=colors.get(tipo),
+        marker=markers.get(tipo, "D"),
         s=70,
         label=tipo
     )
@@ -225,34 +231,11 @@ graph_placeholder.pyplot(fig)
 
 # Segundo grafico
 
-# Datos de ejemplo
+# Datos de ejemplo: 95% de reportes en las últimas 24h (sesgo hacia <1h),
+# el resto hasta 7 días atrás (ver synthetic_fleet.ultimos_reportes_bateria)
 n = 100
 now = pd.Timestamp.now()
-
-# --- 90% de puntos en últimas 24h (sesgo hacia <1h) ---
-n_recent = int(n * 0.95)
-deltas_recent = np.random.exponential(scale=3*3600, size=n_recent)  # en segundos
-deltas_recent = np.clip(deltas_recent, 0, 24*3600)
-
-# --- 10% de puntos hasta 7 días atrás ---
-n_old = n - n_recent
-deltas_old = np.random.uniform(24*3600, 7*24*3600, size=n_old)  # entre 1 y 7 días
-
-# Concatenar todos los deltas
-deltas = np.concatenate([deltas_recent, deltas_old])
-
-# Restar esos deltas a "ahora"
-f = now - pd.to_timedelta(deltas, unit="s")
-
-# Batería
-bateria = np.round(np.random.uniform(0, 1, n), 2)
-
-# DataFrame final
-df = pd.DataFrame({
-    'fecha_hora': f,
-    'bateria': bateria
-})
-df["identificador"] = [f"P{i}" for i in range(len(df))]
+df = ultimos_reportes_bateria(n, ahora=now, seed=123)
 
 # --- Clasificación por color ---
 diff = now - df["fecha_hora"]
@@ -0,0 +1,178 @@
+"""
+Pico de memoria (RSS) al descargar y convertir una respuesta de telemetría
+grande: response.json() + parse_telemetry_to_dataframe frente a la
+decodificación incremental (get_telemetry_arrays + arrays_to_dataframe).
+
+Cada variante corre en un proceso propio, porque ru_maxrss es el pico de
+toda la vida del proceso. El payload se genera una vez en disco y lo sirve
+un servidor HTTP local por bloques, así que su tamaño no cuenta en el pico
+de los procesos medidos:
+
+    python -m benchmarks.bench_memory --points 1000000 3000000
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+KEYS = ["soil_temperature", "soil_humidity", "soil_ec"]
+MODOS = ["json", "stream"]
+
+
+def _maxrss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB; macOS, bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def escribir_payload(ruta: str, puntos: int, bloque: int = 200_000, seed: int = 123) -> int:
+    """Respuesta estilo ThingsBoard con `puntos` por key, escrita por bloques."""
+    rng = np.random.default_rng(seed)
+    fin = 1_700_000_000_000
+    with open(ruta, "wb") as f:
+        f.write(b"{")
+        for k, key in enumerate(KEYS):
+            f.write((", " if k else "").encode() + json.dumps(key).encode() + b":[")
+            for i in range(0, puntos, bloque):
+                n = min(bloque, puntos - i)
+                ts = fin - (np.arange(i, i + n, dtype=np.int64) * 60_000)
+                valores = rng.normal(20, 5, n)
+                texto = ",".join(
+                    f'{{"ts":{t},"value":"{v:.2f}"}}' for t, v in zip(ts.tolist(), valores.tolist())
+                )
+                f.write(((", " if i else "") + texto).encode())
+            f.write(b"]")
+        f.write(b"}")
+    return os.path.getsize(ruta)
+
+
+def _servidor(ruta: str) -> ThreadingHTTPServer:
+    """Sirve el payload en cualquier GET, leyéndolo del disco por bloques."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(os.path.getsize(ruta)))
+            self.end_headers()
+            with open(ruta, "rb") as f:
+                while True:
+                    chunk = f.read(1 << 20)
+                    if not chunk:
+                        break
+                    self.wfile.write(chunk)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def worker(modo: str, url: str, limit: int):
+    """Proceso medido: descarga y convierte una vez, imprime el resultado en JSON."""
+    os.environ.setdefault("THINGSBOARD_HOST", url)
+    os.environ.setdefault("THINGSBOARD_USERNAME", "bench")
+    os.environ.setdefault("THINGSBOARD_PASSWORD", "bench")
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    import data_queries
+    from telemetry_stream import arrays_to_dataframe
+
+    data_queries.TB_URL = url
+    base = _maxrss_mb()
+    start = time.perf_counter()
+    kwargs = dict(keys=",".join(KEYS), limit=limit, start_ts=0, end_ts=2**62)
+    if modo == "json":
+        df = data_queries.parse_telemetry_to_dataframe(
+            data_queries.get_telemetry_data("bench-device", "bench", **kwargs)
+        )
+    else:
+        df = arrays_to_dataframe(data_queries.get_telemetry_arrays("bench-device", "bench", **kwargs))
+    seconds = time.perf_counter() - start
+
+    print(json.dumps({
+        "mode": modo,
+        "rows": len(df),
+        "seconds": seconds,
+        "baseline_rss_mb": base,
+        "peak_rss_mb": _maxrss_mb(),
+        "frame_mb": df.memory_usage(deep=False).sum() / 1e6,
+    }))
+
+
+def _medir(modo: str, url: str, limit: int) -> dict:
+    salida = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.bench_memory", "--worker", modo, "--url", url, "--limit", str(limit)],
+        text=True,
+    )
+    return json.loads(salida.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pico de RSS de la decodificación de telemetría")
+    parser.add_argument("--points", type=int, nargs="+", default=[1_000_000, 3_000_000],
+                        help="puntos por key (3 keys por respuesta)")
+    parser.add_argument("--output", help="ruta del JSON de resultados")
+    parser.add_argument("--worker", choices=MODOS, help=argparse.SUPPRESS)
+    parser.add_argument("--url", help=argparse.SUPPRESS)
+    parser.add_argument("--limit", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args.worker, args.url, args.limit)
+        return
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for puntos in args.points:
+            ruta = os.path.join(tmp, f"payload_{puntos}.json")
+            payload = escribir_payload(ruta, puntos)
+            server = _servidor(ruta)
+            url = f"http://127.0.0.1:{server.server_address[1]}"
+            print(f"Payload: {puntos * len(KEYS):,} puntos, {payload / 1e6:.0f} MB")
+            try:
+                for modo in MODOS:
+                    r = _medir(modo, url, puntos)
+                    r.update(points_per_key=puntos, payload_mb=payload / 1e6,
+                             delta_rss_mb=r["peak_rss_mb"] - r["baseline_rss_mb"])
+                    rows.append(r)
+                    print(f"  {modo:<7} pico +{r['delta_rss_mb']:8.0f} MB  "
+                          f"(DataFrame {r['frame_mb']:6.0f} MB)  {r['seconds']:6.2f} s")
+            finally:
+                server.shutdown()
+                server.server_close()
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+        },
+        "results": rows,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"memory_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en {output}")
+
+
+if __name__ == "__main__":
+    main()
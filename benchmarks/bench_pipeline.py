@@ -0,0 +1,213 @@
+"""
+Benchmark del pipeline fetch → parseo → características → render contra un
+stub local de ThingsBoard. Guarda los resultados en JSON para compararlos
+entre versiones:
+
+    python -m benchmarks.bench_pipeline --devices 10 100 1000 --latency-ms 5
+    python -m benchmarks.bench_pipeline --baseline benchmarks/results/anterior.json
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import matplotlib.pyplot as plt  # noqa: E402
+import pandas as pd  # noqa: E402
+
+from benchmarks.tb_stub import StubConfig, ThingsBoardStub  # noqa: E402
+
+# data_queries lee la configuración al importarse: valores ficticios para el stub
+os.environ.setdefault("THINGSBOARD_HOST", "http://127.0.0.1:0")
+os.environ.setdefault("THINGSBOARD_USERNAME", "bench")
+os.environ.setdefault("THINGSBOARD_PASSWORD", "bench")
+
+import data_queries  # noqa: E402
+from charts import ANCHO_HISTORICO_PX, figura_heatmap, figura_historico  # noqa: E402
+from features import agregar_columnas_temporales, pivot_periodo_dia  # noqa: E402
+from pyramid import Piramide  # noqa: E402
+from telemetry_stream import arrays_to_dataframe, decode_stream  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+
+def _timeit(fn, repeat: int):
+    """Ejecuta fn `repeat` veces; retorna (mediana, mínimo, último resultado)."""
+    times = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times), min(times), result
+
+
+def _render_png(fig) -> int:
+    """Renderiza como lo hace st.pyplot (PNG) y retorna el tamaño en bytes."""
+    buf = io.BytesIO()
+    fig.savefig(buf, format="png")
+    plt.close(fig)
+    return buf.tell()
+
+
+def bench_scale(devices: int, points: int, latency_ms: float, repeat: int, processes: int = 0) -> list:
+    config = StubConfig(devices=devices, points_per_key=points, latency_ms=latency_ms)
+    rows = []
+
+    def add(stage, median, best, **extra):
+        rows.append({"devices": devices, "stage": stage, "median_s": median, "min_s": best, **extra})
+        print(f"  {devices:>5} dispositivos  {stage:<22} {median * 1000:10.1f} ms")
+
+    with ThingsBoardStub(config) as stub:
+        data_queries.TB_URL = stub.url
+        jwt_token, _ = data_queries.login("bench", "bench")
+
+        stub.reset_counters()
+        median, best, all_data = _timeit(
+            lambda: data_queries.get_all_devices_data(jwt_token, days_back=60, procesos=0), repeat
+        )
+        add("get_all_devices_data", median, best,
+            requests=stub.total_requests() // repeat, bytes=stub.bytes_sent // repeat)
+
+        if processes:
+            # Incluye parseo y columnas temporales, a diferencia de la etapa serie.
+            # Una carga previa sin medir arranca los procesos del pool
+            data_queries.get_all_devices_data(jwt_token, days_back=60, procesos=processes)
+            stub.reset_counters()
+            median, best, _ = _timeit(
+                lambda: data_queries.get_all_devices_data(jwt_token, days_back=60, procesos=processes), repeat
+            )
+            add("get_all_devices_data_pool", median, best, processes=processes,
+                requests=stub.total_requests() // repeat)
+
+        payload = data_queries.get_telemetry_data(stub.device_ids[0], jwt_token, days_back=60)
+
+    payload_json = json.dumps(payload)
+    median, best, df_device = _timeit(
+        lambda: data_queries.parse_telemetry_to_dataframe(json.loads(payload_json)), repeat
+    )
+    add("parse_telemetry", median, best, points=len(df_device))
+
+    payload_bytes = payload_json.encode("utf-8")
+    median, best, _ = _timeit(
+        lambda: arrays_to_dataframe(decode_stream(
+            payload_bytes[i:i + 65536] for i in range(0, len(payload_bytes), 65536)
+        )[0]), repeat
+    )
+    add("parse_telemetry_stream", median, best, points=len(df_device))
+
+    df_all = pd.concat(all_data.values(), ignore_index=True)
+    median, best, _ = _timeit(lambda: agregar_columnas_temporales(df_all.copy()), repeat)
+    add("features_fleet", median, best, points=len(df_all))
+
+    agregar_columnas_temporales(df_device)
+    df_key = df_device[df_device["key"] == "soil_temperature"].sort_values("fecha")
+    median, best, _ = _timeit(
+        lambda: _render_png(figura_historico(df_key, "Temperatura Histórica", "°C", "tomato")), repeat
+    )
+    add("render_historico", median, best, points=len(df_key))
+
+    median, best, piramide = _timeit(lambda: Piramide.desde_dataframe(df_device), repeat)
+    add("pyramid_build", median, best, points=len(df_device))
+
+    df_nivel = piramide.consultar("soil_temperature", ancho_px=ANCHO_HISTORICO_PX)
+    median, best, _ = _timeit(
+        lambda: _render_png(figura_historico(df_nivel, "Temperatura Histórica", "°C", "tomato")), repeat
+    )
+    add("render_historico_pyramid", median, best, points=len(df_nivel), level=df_nivel.attrs["nivel"])
+
+    df_key_fleet = agregar_columnas_temporales(df_all[df_all["key"] == "soil_temperature"].copy())
+    pivot = pivot_periodo_dia(df_key_fleet)
+    median, best, _ = _timeit(
+        lambda: _render_png(figura_heatmap(pivot, "Temperatura del suelo", "coolwarm")), repeat
+    )
+    add("render_heatmap", median, best, cells=int(pivot.size))
+
+    return rows
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return "desconocido"
+
+
+def compare(results: dict, baseline_path: str):
+    """Imprime la variación de cada etapa respecto a un JSON anterior."""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    previous = {(r["devices"], r["stage"]): r["median_s"] for r in baseline["results"]}
+
+    print(f"\nComparación contra {baseline_path} ({baseline['meta'].get('commit')}):")
+    for row in results["results"]:
+        before = previous.get((row["devices"], row["stage"]))
+        if not before:
+            continue
+        ratio = row["median_s"] / before
+        flag = "  ⚠️ regresión" if ratio > 1.10 else ""
+        print(f"  {row['devices']:>5} {row['stage']:<22} {before * 1000:9.1f} → "
+              f"{row['median_s'] * 1000:9.1f} ms  (x{ratio:.2f}){flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del pipeline del dashboard")
+    parser.add_argument("--devices", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--points", type=int, default=500, help="puntos por key y dispositivo")
+    parser.add_argument("--latency-ms", type=float, default=5.0, help="latencia inyectada por petición")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=0,
+                        help="además, carga de flota con parseo en N procesos")
+    parser.add_argument("--output", help="ruta del JSON de resultados")
+    parser.add_argument("--baseline", help="JSON anterior con el que comparar")
+    args = parser.parse_args()
+
+    # El log por dispositivo de data_queries distorsiona los tiempos
+    logging.getLogger().setLevel(logging.WARNING)
+
+    rows = []
+    for devices in args.devices:
+        print(f"Escala: {devices} dispositivos")
+        rows.extend(bench_scale(devices, args.points, args.latency_ms, args.repeat, args.processes))
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "python": sys.version.split()[0],
+            "pandas": pd.__version__,
+            "platform": platform.platform(),
+            "points_per_key": args.points,
+            "latency_ms": args.latency_ms,
+            "repeat": args.repeat,
+            "processes": args.processes,
+        },
+        "results": rows,
+    }
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"pipeline_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
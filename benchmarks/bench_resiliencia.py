@@ -0,0 +1,248 @@
+"""
+Verificación del cliente resiliente de ThingsBoard contra el stub local con
+fallos inyectados:
+
+- concurrencia: con un servidor que admite N peticiones simultáneas (el
+  resto recibe 429), el límite AIMD debe acercarse a N y casi todas las
+  peticiones deben terminar bien;
+- Retry-After: los 429 con cabecera pausan al cliente y la petición se
+  reintenta hasta completarse;
+- circuito: con el endpoint fallando, el circuito se abre, las llamadas
+  dejan de llegar al servidor y se sirve la última respuesta buena; al
+  recuperarse, la sonda lo vuelve a cerrar;
+- timeouts: un servidor que no responde corta en el timeout de lectura;
+- segmentos: el día en curso caducado se sirve de la copia anterior si la
+  re-descarga falla.
+
+    python -m benchmarks.bench_resiliencia --max-concurrent 6 --threads 32
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+import requests
+
+from benchmarks.tb_stub import StubConfig, ThingsBoardStub
+
+# data_queries lee la configuración al importarse: valores ficticios para el stub
+os.environ.setdefault("THINGSBOARD_HOST", "http://127.0.0.1:0")
+os.environ.setdefault("THINGSBOARD_USERNAME", "bench")
+os.environ.setdefault("THINGSBOARD_PASSWORD", "bench")
+
+import data_queries  # noqa: E402
+from resiliencia import CircuitoAbierto, ClienteTB, LimitadorAIMD  # noqa: E402
+from segmentos import SegmentCache  # noqa: E402
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+HEADERS = {"X-Authorization": "Bearer stub-jwt"}
+
+
+def _url_ultimo(stub: ThingsBoardStub, i: int = 0) -> str:
+    device_id = stub.device_ids[i % len(stub.device_ids)]
+    return f"{stub.url}/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries?keys=battery&limit=1"
+
+
+def _marcar(nombre: str, ok: bool, detalle: str) -> dict:
+    print(f"  [{'OK' if ok else 'FALLO'}] {nombre}: {detalle}")
+    return {"escenario": nombre, "ok": ok, "detalle": detalle}
+
+
+def escenario_concurrencia(stub: ThingsBoardStub, max_concurrent: int, hilos: int, peticiones: int) -> dict:
+    """Muchos hilos contra un servidor con tope de concurrencia."""
+    stub.config.max_concurrent = max_concurrent
+    stub.config.latency_ms = 20
+    stub.reset_counters()
+    cliente = ClienteTB(limitador=LimitadorAIMD(inicial=hilos, maximo=hilos), max_reintentos=5)
+
+    errores = []
+    por_hilo = peticiones // hilos
+
+    def trabajo(h: int):
+        for j in range(por_hilo):
+            try:
+                cliente.obtener_json("latestValue", "GET", _url_ultimo(stub, h * por_hilo + j),
+                                     respaldo=False, headers=HEADERS)
+            except requests.exceptions.RequestException as err:
+                errores.append(err)
+
+    inicio = time.perf_counter()
+    threads = [threading.Thread(target=trabajo, args=(h,)) for h in range(hilos)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    segundos = time.perf_counter() - inicio
+
+    limitador = cliente.limitador.stats()
+    rechazos = stub.responses_by_status.get(429, 0)
+    total = por_hilo * hilos
+    ok = len(errores) <= total * 0.01 and limitador["limite"] <= 2 * max_concurrent
+    stub.config.max_concurrent = None
+    stub.config.latency_ms = 0
+    return _marcar(
+        "concurrencia", ok,
+        f"límite final {limitador['limite']:.1f} tras {limitador['recortes']} recortes "
+        f"(servidor admite {max_concurrent}), "
+        f"429 del servidor {rechazos}, fallidas {len(errores)}/{total}, {total / segundos:.0f} pet/s",
+    )
+
+
+def escenario_retry_after(stub: ThingsBoardStub, retry_after: float) -> dict:
+    """Todas las respuestas 429 con Retry-After durante un rato y luego bien."""
+    stub.config.rate_limit_rate = 1.0
+    stub.config.retry_after_s = retry_after
+    stub.reset_counters()
+    cliente = ClienteTB(max_reintentos=3)
+
+    def recuperar():
+        time.sleep(retry_after * 1.5)
+        stub.config.rate_limit_rate = 0.0
+
+    threading.Thread(target=recuperar, daemon=True).start()
+    inicio = time.perf_counter()
+    try:
+        cliente.obtener_json("latestValue", "GET", _url_ultimo(stub), respaldo=False, headers=HEADERS)
+        completada = True
+    except requests.exceptions.RequestException:
+        completada = False
+    segundos = time.perf_counter() - inicio
+    rechazos = stub.responses_by_status.get(429, 0)
+    stub.config.retry_after_s = None
+    ok = completada and segundos >= retry_after * 1.5 and rechazos <= 3
+    return _marcar(
+        "retry_after", ok,
+        f"completada={completada} en {segundos:.2f}s con {rechazos} respuestas 429 (Retry-After {retry_after:g}s)",
+    )
+
+
+def escenario_circuito(stub: ThingsBoardStub, espera: float) -> dict:
+    """El endpoint empieza a fallar: circuito abierto, respaldo y recuperación."""
+    cliente = ClienteTB(max_reintentos=0, espera=espera, min_llamadas=5, ventana=10)
+    url = _url_ultimo(stub)
+    bueno, _ = cliente.obtener_json("latestValue", "GET", url, headers=HEADERS)
+
+    stub.config.error_rate = 1.0
+    stub.reset_counters()
+    respaldos = 0
+    for _ in range(50):
+        datos, _ = cliente.obtener_json("latestValue", "GET", url, headers=HEADERS)
+        respaldos += datos == bueno
+    llegaron = stub.total_requests()
+    abierto = cliente.circuito("latestValue").estado == "abierto"
+
+    # Sin respaldo, el circuito abierto falla al instante
+    try:
+        cliente.obtener_json("latestValue", "GET", url, respaldo=False, headers=HEADERS)
+        rechazo_inmediato = False
+    except CircuitoAbierto:
+        rechazo_inmediato = True
+
+    stub.config.error_rate = 0.0
+    time.sleep(espera)
+    cliente.obtener_json("latestValue", "GET", url, headers=HEADERS)
+    cerrado = cliente.circuito("latestValue").estado == "cerrado"
+
+    ok = abierto and respaldos == 50 and llegaron <= 10 and rechazo_inmediato and cerrado
+    return _marcar(
+        "circuito", ok,
+        f"abierto={abierto}, respaldos servidos {respaldos}/50, peticiones que llegaron {llegaron}, "
+        f"rechazo inmediato={rechazo_inmediato}, cerrado tras la sonda={cerrado}",
+    )
+
+
+def escenario_timeout(stub: ThingsBoardStub, lectura: float) -> dict:
+    """Servidor colgado: la petición corta en el timeout y se sirve el respaldo."""
+    cliente = ClienteTB(timeout=(1.0, lectura), max_reintentos=1)
+    url = _url_ultimo(stub)
+    bueno, _ = cliente.obtener_json("latestValue", "GET", url, headers=HEADERS)
+
+    stub.config.latency_ms = lectura * 1000 * 4
+    inicio = time.perf_counter()
+    datos, _ = cliente.obtener_json("latestValue", "GET", url, headers=HEADERS)
+    con_respaldo = time.perf_counter() - inicio
+    stub.config.latency_ms = 0
+
+    # Reintento + espera exponencial: dos timeouts y 0.25 s
+    ok = datos == bueno and con_respaldo < 2 * lectura + 1.0
+    return _marcar(
+        "timeout", ok,
+        f"respaldo servido en {con_respaldo:.2f}s con timeout de lectura {lectura:g}s",
+    )
+
+
+def escenario_segmentos(stub: ThingsBoardStub) -> dict:
+    """El día en curso caducado se sirve de la copia anterior si ThingsBoard falla."""
+    data_queries.TB_URL = stub.url
+    cache = SegmentCache(ttl_abierto=0)
+    fin = pd.Timestamp.now(tz="UTC").tz_localize(None).normalize() + pd.Timedelta(days=1)
+    inicio = fin - pd.Timedelta(days=2)
+    device_id = stub.device_ids[0]
+
+    antes = cache.get_window(device_id, "stub-jwt", inicio, fin)
+    stub.config.error_rate = 1.0
+    despues = cache.get_window(device_id, "stub-jwt", inicio, fin)
+    stub.config.error_rate = 0.0
+
+    caducados = cache.stats()["stale"]
+    ok = len(antes) > 0 and len(despues) == len(antes) and caducados > 0
+    return _marcar(
+        "segmentos", ok,
+        f"{len(despues)}/{len(antes)} filas servidas con ThingsBoard caído ({caducados} días caducados)",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Verificación de resiliencia del cliente de ThingsBoard")
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--max-concurrent", type=int, default=6, help="tope de concurrencia del stub")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=640)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--espera", type=float, default=1.0, help="segundos de circuito abierto")
+    parser.add_argument("--timeout", type=float, default=0.5, help="timeout de lectura")
+    parser.add_argument("--output", help="ruta del JSON de resultados")
+    args = parser.parse_args()
+
+    # Los reintentos y respaldos se registran como warning en cada petición
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    config = StubConfig(devices=args.devices, points_per_key=2000, days=3)
+    with ThingsBoardStub(config) as stub:
+        print(f"Stub en {stub.url}")
+        filas = [
+            escenario_concurrencia(stub, args.max_concurrent, args.threads, args.requests),
+            escenario_retry_after(stub, args.retry_after),
+            escenario_circuito(stub, args.espera),
+            escenario_timeout(stub, args.timeout),
+            escenario_segmentos(stub),
+        ]
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            **vars(args),
+        },
+        "results": filas,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"resiliencia_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en {output}")
+    if not all(fila["ok"] for fila in filas):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
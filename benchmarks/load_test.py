@@ -0,0 +1,402 @@
+"""
+Prueba de carga multi-sesión de un dashboard contra el stub de ThingsBoard.
+
+Arranca el stub y `streamlit run <script>` en un proceso propio (una
+réplica) y simula N sesiones de navegador concurrentes por el websocket de
+Streamlit, con el mismo protocolo que el frontend. Cada sesión carga la
+página y repite un recorrido: cambiar de dispositivo, elegir un rango de
+fechas y pulsar Actualizar (si la página tiene el botón), con una pausa
+entre acciones. Se mide:
+
+- tiempo de página por acción (envío del rerun → script_finished) con
+  p50/p95/p99;
+- peticiones a ThingsBoard por ruta y bytes servidos por el stub;
+- RSS del proceso de Streamlit (muestreado durante la prueba, con pico) y
+  del proceso que genera la carga.
+
+Con --max-p95 la prueba falla (exit 1) si el p95 global lo supera, para
+detectar regresiones. Con --casete el servidor reproduce un casete grabado
+(ver casete) en lugar de consultar el stub, para medir con datos reales:
+
+    python -m benchmarks.load_test --script dashboard.py --sessions 10 --iterations 5
+    python -m benchmarks.load_test --script dashboardnew.py --sessions 1 2 5 10 20
+    python -m benchmarks.load_test --casete cassettes/thingsboard.jsonl.gz --casete-latency-ms 30
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+from benchmarks.tb_stub import StubConfig, ThingsBoardStub
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Keys de telemetría de cada script (ver sensores.ESQUEMAS)
+KEYS_SCRIPT = {
+    "dashboard.py": "soil_temperature,soil_humidity,soil_ec",
+    "dashboardnew.py": "temperature,humidity,soil_conductivity",
+}
+WIDGET_DISPOSITIVO = "📱 Selecciona un dispositivo"
+WIDGET_FECHAS = "📅 Rango de fechas"
+WIDGET_ACTUALIZAR = "🔄 Actualizar"
+ACCIONES = ("dispositivo", "fechas", "actualizar")
+PERCENTILES = (50, 95, 99)
+
+
+def _puerto_libre() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_mb(pid: int) -> tuple:
+    """(RSS actual, pico de RSS) en MB de un proceso, leídos de /proc (solo Linux)."""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            campos = dict(linea.split(":", 1) for linea in f if ":" in linea)
+    except OSError:
+        return None, None
+    kib = lambda nombre: int(campos[nombre].split()[0]) / 1024 if nombre in campos else None  # noqa: E731
+    return kib("VmRSS"), kib("VmHWM")
+
+
+def _maxrss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KiB; macOS, bytes
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class ServidorStreamlit:
+    """
+    `streamlit run` del script apuntando al stub. Los secrets se escriben en
+    un secrets.toml temporal: Streamlit los copia al entorno y tienen
+    prioridad sobre las variables del proceso.
+    """
+
+    def __init__(self, script: str, tb_url: str, keys: str, extra_env: dict = None):
+        self.script = script
+        self.port = _puerto_libre()
+        self._tmp = tempfile.TemporaryDirectory()
+        secrets = os.path.join(self._tmp.name, "secrets.toml")
+        with open(secrets, "w", encoding="utf-8") as f:
+            f.write(f'THINGSBOARD_HOST = "{tb_url}"\nTHINGSBOARD_USERNAME = "load"\n'
+                    f'THINGSBOARD_PASSWORD = "load"\nTB_KEYS = "{keys}"\n')
+        self.log = os.path.join(self._tmp.name, "streamlit.log")
+        self._cmd = [
+            sys.executable, "-m", "streamlit", "run", os.path.join(ROOT, script),
+            "--server.headless", "true", "--server.port", str(self.port),
+            "--server.enableXsrfProtection", "false", "--browser.gatherUsageStats", "false",
+            "--secrets.files", secrets,
+        ]
+        self._env = {**os.environ, **(extra_env or {})}
+        self.proc = None
+
+    @property
+    def url_ws(self) -> str:
+        return f"ws://127.0.0.1:{self.port}/_stcore/stream"
+
+    def __enter__(self):
+        self._log = open(self.log, "wb")
+        self.proc = subprocess.Popen(self._cmd, cwd=ROOT, env=self._env, stdout=self._log, stderr=subprocess.STDOUT)
+        limite = time.monotonic() + 60
+        while time.monotonic() < limite:
+            if self.proc.poll() is not None:
+                raise RuntimeError(f"Streamlit terminó al arrancar; ver {self.log}")
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{self.port}/_stcore/health", timeout=1)
+                return self
+            except OSError:
+                time.sleep(0.2)
+        raise TimeoutError("Streamlit no respondió en 60 s")
+
+    def __exit__(self, *exc):
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+        self._log.close()
+        self._tmp.cleanup()
+
+    def rss(self) -> tuple:
+        return _rss_mb(self.proc.pid)
+
+    def ultimas_lineas(self, n: int = 20) -> str:
+        with open(self.log, encoding="utf-8", errors="replace") as f:
+            return "".join(f.readlines()[-n:])
+
+
+class MuestreoRSS:
+    """Muestrea el RSS del servidor cada `intervalo` segundos en un hilo."""
+
+    def __init__(self, servidor: ServidorStreamlit, intervalo: float = 0.5):
+        self.servidor = servidor
+        self.intervalo = intervalo
+        self.muestras = []
+        self._parar = threading.Event()
+        self._hilo = threading.Thread(target=self._bucle, daemon=True)
+
+    def _bucle(self):
+        while not self._parar.wait(self.intervalo):
+            rss, _ = self.servidor.rss()
+            if rss is not None:
+                self.muestras.append(rss)
+
+    def __enter__(self):
+        self._hilo.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._hilo.join()
+
+
+class Sesion:
+    """
+    Una pestaña de navegador: mantiene el estado de los widgets como el
+    frontend y lo envía en cada rerun.
+    """
+
+    def __init__(self, url_ws: str, semilla: int):
+        self.url_ws = url_ws
+        self.random = random.Random(semilla)
+        self.widgets = {}
+        self.estados = {}
+        self._ws = None
+
+    async def __aenter__(self):
+        self._ws = await websockets.connect(self.url_ws, subprotocols=["streamlit"], max_size=None)
+        return self
+
+    async def __aexit__(self, *exc):
+        await self._ws.close()
+
+    async def rerun(self, disparar: WidgetState = None, timeout: float = 300) -> dict:
+        """Envía un rerun con el estado de los widgets y espera a que el script termine."""
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        for estado in self.estados.values():
+            msg.rerun_script.widget_states.widgets.append(estado)
+        if disparar is not None:
+            msg.rerun_script.widget_states.widgets.append(disparar)
+
+        widgets, excepciones, nbytes = {}, 0, 0
+        inicio = time.perf_counter()
+        await self._ws.send(msg.SerializeToString())
+        while True:
+            datos = await asyncio.wait_for(self._ws.recv(), timeout)
+            nbytes += len(datos)
+            fm = ForwardMsg()
+            fm.ParseFromString(datos)
+            tipo = fm.WhichOneof("type")
+            if tipo == "delta" and fm.delta.WhichOneof("type") == "new_element":
+                elemento = fm.delta.new_element
+                tipo_elemento = elemento.WhichOneof("type")
+                if tipo_elemento == "exception":
+                    excepciones += 1
+                elif tipo_elemento in ("selectbox", "date_input", "button"):
+                    proto = getattr(elemento, tipo_elemento)
+                    widgets[proto.label] = proto
+            elif tipo == "script_finished" and fm.script_finished != ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                break
+        self.widgets = widgets
+        return {
+            "segundos": time.perf_counter() - inicio,
+            "ok": excepciones == 0 and fm.script_finished == ForwardMsg.FINISHED_SUCCESSFULLY,
+            "excepciones": excepciones,
+            "kb": nbytes / 1024,
+        }
+
+    # ── Acciones ──
+
+    async def dispositivo(self):
+        proto = self.widgets.get(WIDGET_DISPOSITIVO)
+        if proto is None or len(proto.options) < 2:
+            return None
+        estado = WidgetState(id=proto.id, string_value=self.random.choice(list(proto.options)))
+        self.estados[proto.id] = estado
+        return await self.rerun()
+
+    async def fechas(self):
+        proto = self.widgets.get(WIDGET_FECHAS)
+        if proto is None:
+            return None
+        fin = datetime.strptime(proto.max, "%Y-%m-%d").date() if proto.max else date.today()
+        dias = self.random.choice((7, 14, 30, 59))
+        inicio = fin - timedelta(days=dias + self.random.randint(0, 60 - dias))
+        estado = WidgetState(id=proto.id)
+        estado.string_array_value.data[:] = [inicio.isoformat(), min(fin, inicio + timedelta(days=dias)).isoformat()]
+        self.estados[proto.id] = estado
+        return await self.rerun()
+
+    async def actualizar(self):
+        proto = self.widgets.get(WIDGET_ACTUALIZAR)
+        if proto is None:
+            return None
+        return await self.rerun(disparar=WidgetState(id=proto.id, trigger_value=True))
+
+
+async def _simular(n: int, url_ws: str, iteraciones: int, pausa: float, rampa: float, registros: list):
+    """Una sesión: espera su turno de la rampa, carga la página y recorre las acciones."""
+    await asyncio.sleep(rampa * n)
+    async with Sesion(url_ws, semilla=n) as sesion:
+        registros.append({"sesion": n, "accion": "carga", **await sesion.rerun()})
+        for _ in range(iteraciones):
+            for accion in sesion.random.sample(ACCIONES, len(ACCIONES)):
+                await asyncio.sleep(sesion.random.uniform(0, 2 * pausa))
+                resultado = await getattr(sesion, accion)()
+                if resultado is not None:
+                    registros.append({"sesion": n, "accion": accion, **resultado})
+
+
+def _percentiles(segundos: list) -> dict:
+    valores = np.percentile(segundos, PERCENTILES) if segundos else [float("nan")] * len(PERCENTILES)
+    return {f"p{p}_s": round(float(v), 3) for p, v in zip(PERCENTILES, valores)}
+
+
+def medir(script: str, sesiones: int, args) -> dict:
+    """Una réplica nueva (stub y servidor) con `sesiones` concurrentes."""
+    config = StubConfig(devices=args.devices, points_per_key=args.points, latency_ms=args.latency_ms)
+    with ThingsBoardStub(config) as stub:
+        extra_env = {"CACHE_MAX_MB": str(args.cache_mb)} if args.cache_mb else {}
+        if args.casete:
+            extra_env.update(TB_CASSETTE=os.path.abspath(args.casete), TB_CASSETTE_MODE="replay")
+            if args.casete_latency_ms is not None:
+                extra_env["TB_CASSETTE_LATENCY_MS"] = str(args.casete_latency_ms)
+        with ServidorStreamlit(script, stub.url, KEYS_SCRIPT[script], extra_env) as servidor:
+            rss_inicial, _ = servidor.rss()
+            registros = []
+            inicio = time.perf_counter()
+            with MuestreoRSS(servidor) as muestreo:
+                async def todas():
+                    await asyncio.gather(*(
+                        _simular(n, servidor.url_ws, args.iterations, args.pausa, args.rampa, registros)
+                        for n in range(sesiones)
+                    ))
+                try:
+                    asyncio.run(todas())
+                except Exception:
+                    print(servidor.ultimas_lineas(), file=sys.stderr)
+                    raise
+            duracion = time.perf_counter() - inicio
+            rss_final, rss_pico = servidor.rss()
+
+    por_accion = {}
+    for accion in ("carga",) + ACCIONES:
+        filas = [r for r in registros if r["accion"] == accion]
+        if filas:
+            por_accion[accion] = {
+                "n": len(filas),
+                "fallidas": sum(not r["ok"] for r in filas),
+                "kb_medio": round(float(np.mean([r["kb"] for r in filas])), 1),
+                **_percentiles([r["segundos"] for r in filas]),
+            }
+    peticiones = sum(stub.requests_by_route.values())
+    return {
+        "script": script,
+        "sesiones": sesiones,
+        "paginas": len(registros),
+        "fallidas": sum(not r["ok"] for r in registros),
+        "duracion_s": round(duracion, 2),
+        "paginas_por_s": round(len(registros) / duracion, 2),
+        **_percentiles([r["segundos"] for r in registros]),
+        "por_accion": por_accion,
+        "tb_peticiones": peticiones,
+        "tb_peticiones_por_pagina": round(peticiones / max(len(registros), 1), 2),
+        "tb_por_ruta": dict(stub.requests_by_route),
+        "tb_mb": round(stub.bytes_sent / 1e6, 2),
+        "rss_servidor_inicial_mb": rss_inicial,
+        "rss_servidor_final_mb": rss_final,
+        "rss_servidor_pico_mb": rss_pico if rss_pico is not None else max(muestreo.muestras, default=None),
+        "rss_servidor_muestras_mb": [round(m, 1) for m in muestreo.muestras],
+        "rss_generador_pico_mb": round(_maxrss_mb(), 1),
+    }
+
+
+def _imprimir(fila: dict):
+    print(f"  {fila['sesiones']:>3} sesiones: {fila['paginas']} páginas ({fila['fallidas']} fallidas) "
+          f"en {fila['duracion_s']:.1f}s, {fila['paginas_por_s']:.2f} pág/s")
+    print(f"      {'acción':<12} {'n':>5} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for accion, a in fila["por_accion"].items():
+        print(f"      {accion:<12} {a['n']:>5} {a['p50_s']:>7.2f}s {a['p95_s']:>7.2f}s {a['p99_s']:>7.2f}s")
+    print(f"      {'total':<12} {fila['paginas']:>5} {fila['p50_s']:>7.2f}s {fila['p95_s']:>7.2f}s {fila['p99_s']:>7.2f}s")
+    print(f"      ThingsBoard: {fila['tb_peticiones']} peticiones ({fila['tb_peticiones_por_pagina']}/página), "
+          f"{fila['tb_mb']} MB  {fila['tb_por_ruta']}")
+    if fila["rss_servidor_final_mb"] is not None:
+        print(f"      RSS servidor: {fila['rss_servidor_inicial_mb']:.0f} → {fila['rss_servidor_final_mb']:.0f} MB "
+              f"(pico {fila['rss_servidor_pico_mb']:.0f} MB); generador pico {fila['rss_generador_pico_mb']:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga multi-sesión de los dashboards")
+    parser.add_argument("--script", choices=sorted(KEYS_SCRIPT), default="dashboard.py")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[5], help="sesiones concurrentes (una réplica nueva por valor)")
+    parser.add_argument("--iterations", type=int, default=3, help="recorridos de acciones por sesión")
+    parser.add_argument("--pausa", type=float, default=0.5, help="pausa media entre acciones (s)")
+    parser.add_argument("--rampa", type=float, default=0.2, help="segundos entre el inicio de cada sesión")
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--points", type=int, default=500, help="puntos por key en el stub")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="latencia del stub")
+    parser.add_argument("--cache-mb", type=float, default=None, help="CACHE_MAX_MB del servidor")
+    parser.add_argument("--casete", help="casete grabado que reproduce el servidor (sin stub)")
+    parser.add_argument("--casete-latency-ms", type=float, default=None,
+                        help="latencia fija de la reproducción (por defecto, la grabada)")
+    parser.add_argument("--max-p95", type=float, default=None, help="falla si el p95 global supera estos segundos")
+    parser.add_argument("--output", help="ruta del JSON de resultados")
+    args = parser.parse_args()
+
+    filas = []
+    if args.casete:
+        print(f"{args.script}: reproduciendo el casete {args.casete}")
+    else:
+        print(f"{args.script}: {args.devices} dispositivos, {args.points} puntos/key, latencia {args.latency_ms:g} ms")
+    for sesiones in args.sessions:
+        fila = medir(args.script, sesiones, args)
+        _imprimir(fila)
+        filas.append(fila)
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            **vars(args),
+        },
+        "results": filas,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load_{os.path.splitext(args.script)[0]}_{datetime.now():%Y%m%d_%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResultados guardados en {output}")
+
+    fallos = [f for f in filas if f["fallidas"]]
+    lentas = [f for f in filas if args.max_p95 is not None and f["p95_s"] > args.max_p95]
+    for fila in lentas:
+        print(f"p95 {fila['p95_s']:.2f}s > {args.max_p95:g}s con {fila['sesiones']} sesiones")
+    if fallos or lentas:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,424 @@
+"""
+Servidor HTTP local que emula la API de ThingsBoard usada por data_queries:
+
+    POST /api/auth/login
+    GET  /api/tenant/deviceInfos?pageSize=&page=
+    GET  /api/plugins/telemetry/DEVICE/{id}/values/timeseries?keys=&startTs=&endTs=&limit=
+    POST /api/entitiesQuery/find, /api/entitiesQuery/count (últimos valores, atributos de
+         servidor zone/crop/depth, textSearch, orden por campo o por telemetría y
+         keyFilters NUMERIC/COMPLEX)
+
+Número de dispositivos, puntos por key y latencia inyectada son configurables.
+Para probar la resiliencia del cliente también se pueden inyectar errores 5xx,
+respuestas 429 con Retry-After, un tope de peticiones simultáneas (por encima
+responde 429) y latencia que crece con la carga; la configuración se puede
+cambiar con el stub en marcha.
+La telemetría sale de synthetic_fleet, así que responde a las keys de ambos
+dashboards (soil_* y el esquema corto) y a battery/battery_level.
+Uso independiente:
+
+    python -m benchmarks.tb_stub --devices 100 --points 500 --latency-ms 20 --port 8080
+    python -m benchmarks.tb_stub --error-rate 0.2 --max-concurrent 8 --retry-after 1
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from functools import cached_property
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from sensores import ALIAS_KEYS
+from synthetic_fleet import generar_flota
+
+_COMPARACIONES = {
+    "EQUAL": np.equal,
+    "NOT_EQUAL": np.not_equal,
+    "GREATER": np.greater,
+    "LESS": np.less,
+    "GREATER_OR_EQUAL": np.greater_equal,
+    "LESS_OR_EQUAL": np.less_equal,
+}
+
+
+def _evaluar(predicado: dict, valores: np.ndarray) -> np.ndarray:
+    """Máscara de un predicado NUMERIC o COMPLEX; NaN nunca cumple."""
+    if predicado.get("type") == "COMPLEX":
+        mascaras = [_evaluar(p, valores) for p in predicado.get("predicates", [])]
+        if not mascaras:
+            return np.ones(len(valores), dtype=bool)
+        union = predicado.get("operation") == "OR"
+        return np.logical_or.reduce(mascaras) if union else np.logical_and.reduce(mascaras)
+    referencia = float(predicado["value"]["defaultValue"])
+    with np.errstate(invalid="ignore"):
+        return _COMPARACIONES[predicado["operation"]](valores, referencia)
+
+
+ZONAS = ["Zona Norte", "Zona Sur", "Invernadero", "Huerto"]
+CULTIVOS = {"Zona Norte": "Maíz", "Zona Sur": "Frutales", "Invernadero": "Tomate", "Huerto": "Lechuga"}
+
+
+def _atributos(n: int, seed: int) -> dict:
+    """Atributos de servidor por dispositivo; uno de cada diez queda sin zona."""
+    rng = np.random.default_rng(seed)
+    zonas = rng.choice(ZONAS, n)
+    profundidades = rng.choice([15, 30, 45], n)
+    atributos = {"zone": [], "crop": [], "depth": []}
+    for i in range(n):
+        sin_zona = i % 10 == 9
+        atributos["zone"].append(None if sin_zona else str(zonas[i]))
+        atributos["crop"].append(None if sin_zona else CULTIVOS[zonas[i]])
+        atributos["depth"].append(int(profundidades[i]))
+    return atributos
+
+
+class StubConfig:
+    def __init__(self, devices=10, points_per_key=500, latency_ms=0.0, days=60, seed=123,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after_s=None, max_concurrent=None,
+                 latency_per_inflight_ms=0.0):
+        self.devices = devices
+        self.points_per_key = points_per_key
+        self.latency_ms = latency_ms
+        self.days = days
+        self.seed = seed
+        # Fracción de peticiones que responden 503 / 429 (login nunca falla)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        # Cabecera Retry-After de los 429 (None = sin cabecera)
+        self.retry_after_s = retry_after_s
+        # Peticiones simultáneas admitidas; las que sobran reciben 429
+        self.max_concurrent = max_concurrent
+        # Latencia extra por cada petición en curso (servidor que se satura)
+        self.latency_per_inflight_ms = latency_per_inflight_ms
+
+
+class ThingsBoardStub:
+    """
+    Stub de ThingsBoard en un hilo propio. Usar como context manager:
+
+        with ThingsBoardStub(StubConfig(devices=100)) as stub:
+            data_queries.TB_URL = stub.url
+    """
+
+    def __init__(self, config: StubConfig = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or StubConfig()
+        c = self.config
+        self.fleet = generar_flota(
+            c.devices, c.days, intervalo_min=c.days * 24 * 60 / max(c.points_per_key, 1), seed=c.seed
+        )
+        self.device_ids = self.fleet.device_ids
+        self.device_index = self.fleet.device_index
+        self.names = [f"Sensor {did[-5:]}" for did in self.device_ids]
+        self.attributes = _atributos(len(self.device_ids), c.seed)
+        self.requests_by_route = {}
+        self.responses_by_status = {}
+        self.bytes_sent = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._random = random.Random(c.seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests_by_route = {}
+            self.responses_by_status = {}
+            self.bytes_sent = 0
+            self.max_in_flight = self.in_flight
+
+    def total_requests(self) -> int:
+        with self._lock:
+            return sum(self.requests_by_route.values())
+
+    def _count(self, route: str, nbytes: int, status: int = 200):
+        with self._lock:
+            self.requests_by_route[route] = self.requests_by_route.get(route, 0) + 1
+            self.responses_by_status[status] = self.responses_by_status.get(status, 0) + 1
+            self.bytes_sent += nbytes
+
+    def _entrar(self) -> int:
+        """Registra una petición en curso; retorna cuántas hay (incluida esta)."""
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return self.in_flight
+
+    def _salir(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def _fallo_inyectado(self, en_curso: int):
+        """Código de error a responder (503/429) o None según la configuración."""
+        c = self.config
+        if c.max_concurrent is not None and en_curso > c.max_concurrent:
+            return 429
+        with self._lock:
+            sorteo = self._random.random()
+        if sorteo < c.error_rate:
+            return 503
+        if sorteo < c.error_rate + c.rate_limit_rate:
+            return 429
+        return None
+
+    # ── Respuestas ──
+
+    def device_page(self, page: int, page_size: int, descending: bool = False) -> dict:
+        total = len(self.device_ids)
+        total_pages = (total + page_size - 1) // page_size if page_size else 0
+        order = list(range(total))[::-1] if descending else range(total)
+        chunk = [(i, self.device_ids[i]) for i in order[page * page_size:(page + 1) * page_size]]
+        return {
+            "data": [
+                {
+                    "id": {"entityType": "DEVICE", "id": did},
+                    "name": self.names[i],
+                    "type": "soil_sensor",
+                    "deviceProfileName": "default",
+                    "createdTime": 1_700_000_000_000 + i,
+                }
+                for i, did in chunk
+            ],
+            "totalPages": total_pages,
+            "totalElements": total,
+            "hasNext": page + 1 < total_pages,
+        }
+
+    def timeseries(self, device_id: str, keys: list, start_ts: int, end_ts: int, limit: int) -> bytes:
+        return self.fleet.thingsboard_bytes(device_id, keys, start_ts, end_ts, limit)
+
+    @cached_property
+    def _ultimos(self) -> dict:
+        """Por magnitud, (ts, valor) del último punto de cada dispositivo; 0/NaN si no hay."""
+        ultimos = {}
+        for magnitud, matriz in self.fleet.valores.items():
+            validos = ~np.isnan(matriz)
+            # Índice de la última columna válida de cada fila
+            idx = matriz.shape[1] - 1 - np.argmax(validos[:, ::-1], axis=1)
+            hay = validos.any(axis=1)
+            filas = np.arange(len(matriz))
+            ts = np.where(hay, self.fleet.ts[idx], 0)
+            ultimos[magnitud] = (ts, np.where(hay, matriz[filas, idx], np.nan))
+        return ultimos
+
+    def _ultimo(self, key: str) -> tuple:
+        magnitud = ALIAS_KEYS.get(key)
+        if magnitud is None:
+            n = len(self.device_ids)
+            return np.zeros(n, dtype=np.int64), np.full(n, np.nan)
+        return self._ultimos[magnitud]
+
+    def _filtrar(self, query: dict) -> np.ndarray:
+        """Índices de los dispositivos que cumplen textSearch y keyFilters."""
+        mascara = np.ones(len(self.device_ids), dtype=bool)
+        for filtro in query.get("keyFilters") or []:
+            mascara &= _evaluar(filtro["predicate"], self._ultimo(filtro["key"]["key"])[1])
+        texto = ((query.get("pageLink") or {}).get("textSearch") or "").lower()
+        if texto:
+            mascara &= np.array([texto in nombre.lower() for nombre in self.names])
+        return np.flatnonzero(mascara)
+
+    def entity_count(self, query: dict) -> int:
+        return int(len(self._filtrar(query)))
+
+    def entity_data(self, query: dict) -> dict:
+        page_link = query.get("pageLink") or {}
+        page = int(page_link.get("page", 0))
+        page_size = int(page_link.get("pageSize", 10))
+        indices = self._filtrar(query)
+
+        orden = page_link.get("sortOrder") or {}
+        sort_key = (orden.get("key") or {}).get("key", "name")
+        descendente = orden.get("direction") == "DESC"
+        if (orden.get("key") or {}).get("type") == "TIME_SERIES":
+            v = self._ultimo(sort_key)[1][indices]
+            # Los dispositivos sin valor van al final en ambos sentidos
+            indices = indices[np.lexsort((-v if descendente else v, np.isnan(v)))]
+        else:
+            campo = {"name": self.names}.get(sort_key)
+            if campo is not None:
+                indices = indices[np.argsort(np.array(campo, dtype=object)[indices], kind="stable")]
+            if descendente:
+                indices = indices[::-1]
+
+        total = len(indices)
+        total_pages = (total + page_size - 1) // page_size if page_size else 0
+        pagina = indices[page * page_size:(page + 1) * page_size]
+        keys = [v["key"] for v in query.get("latestValues") or [] if v.get("type") == "TIME_SERIES"]
+        ultimos = {k: self._ultimo(k) for k in keys}
+        atributos = [v["key"] for v in query.get("latestValues") or []
+                     if v.get("type") == "SERVER_ATTRIBUTE" and v["key"] in self.attributes]
+
+        data = []
+        for i in pagina.tolist():
+            series = {}
+            for k, (ts, valores) in ultimos.items():
+                v = valores[i]
+                series[k] = {"ts": int(ts[i]), "value": "" if np.isnan(v) else f"{v:.2f}"}
+            latest = {
+                "ENTITY_FIELD": {"name": {"ts": 0, "value": self.names[i]}},
+                "TIME_SERIES": series,
+            }
+            if atributos:
+                # ThingsBoard devuelve los atributos que faltan como valor vacío
+                latest["SERVER_ATTRIBUTE"] = {
+                    k: {"ts": 0, "value": "" if self.attributes[k][i] is None else str(self.attributes[k][i])}
+                    for k in atributos
+                }
+            data.append({"entityId": {"entityType": "DEVICE", "id": self.device_ids[i]}, "latest": latest})
+        return {"data": data, "totalPages": total_pages, "totalElements": total,
+                "hasNext": page + 1 < total_pages}
+
+
+def _make_handler(stub: ThingsBoardStub):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send_json(self, route: str, payload, status: int = 200, headers: dict = None):
+            latencia = stub.config.latency_ms + stub.config.latency_per_inflight_ms * self._en_curso
+            if latencia:
+                time.sleep(latencia / 1000.0)
+            if isinstance(payload, bytes):
+                body = payload
+            else:
+                body = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for nombre, valor in (headers or {}).items():
+                self.send_header(nombre, valor)
+            self.end_headers()
+            self.wfile.write(body)
+            stub._count(route, len(body), status)
+
+        def _inyectar_fallo(self) -> bool:
+            """Responde el error inyectado, si toca; retorna True si respondió."""
+            status = stub._fallo_inyectado(self._en_curso)
+            if status is None:
+                return False
+            headers = {}
+            if status == 429 and stub.config.retry_after_s is not None:
+                headers["Retry-After"] = f"{stub.config.retry_after_s:g}"
+            mensaje = "Too many requests" if status == 429 else "Service unavailable"
+            self._send_json("injected", {"message": mensaje}, status=status, headers=headers)
+            return True
+
+        def _atender(self, metodo):
+            # Las conexiones keep-alive ociosas no cuentan como peticiones en curso
+            self._en_curso = stub._entrar()
+            try:
+                metodo()
+            except (BrokenPipeError, ConnectionResetError):
+                # El cliente cortó por timeout antes de la respuesta
+                self.close_connection = True
+            finally:
+                stub._salir()
+
+        def do_POST(self):
+            self._atender(self._post)
+
+        def do_GET(self):
+            self._atender(self._get)
+
+        def _post(self):
+            length = int(self.headers.get("Content-Length", 0) or 0)
+            body = self.rfile.read(length)
+            es_login = self.path.startswith("/api/auth/login") or self.path.startswith("/api/auth/token")
+            if not es_login and self._inyectar_fallo():
+                return
+            if es_login:
+                self._send_json("login", {"token": "stub-jwt", "refreshToken": "stub-refresh"})
+            elif self.path == "/api/entitiesQuery/find":
+                self._send_json("entitiesQuery", stub.entity_data(json.loads(body or b"{}")))
+            elif self.path == "/api/entitiesQuery/count":
+                self._send_json("entitiesCount", stub.entity_count(json.loads(body or b"{}")))
+            else:
+                self._send_json("unknown", {"message": "Not found"}, status=404)
+
+        def _get(self):
+            parsed = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+            parts = parsed.path.strip("/").split("/")
+            if self._inyectar_fallo():
+                return
+
+            if parsed.path == "/api/tenant/deviceInfos":
+                page = int(query.get("page", 0))
+                page_size = int(query.get("pageSize", 100))
+                descending = query.get("sortOrder") == "DESC"
+                self._send_json("deviceInfos", stub.device_page(page, page_size, descending))
+            elif parsed.path.startswith("/api/plugins/telemetry/DEVICE/") and parts[-1] == "timeseries":
+                device_id = parts[4]
+                if device_id not in stub.device_index:
+                    self._send_json("timeseries", {}, status=404)
+                    return
+                keys = [k for k in query.get("keys", "").split(",") if k]
+                start_ts = int(query["startTs"]) if "startTs" in query else None
+                end_ts = int(query["endTs"]) if "endTs" in query else None
+                limit = int(query.get("limit", 100))
+                self._send_json("timeseries", stub.timeseries(device_id, keys, start_ts, end_ts, limit))
+            else:
+                self._send_json("unknown", {"message": "Not found"}, status=404)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub local de ThingsBoard")
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--points", type=int, default=500, help="puntos por key")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fracción de respuestas 503")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fracción de respuestas 429")
+    parser.add_argument("--retry-after", type=float, default=None, help="segundos de Retry-After en los 429")
+    parser.add_argument("--max-concurrent", type=int, default=None,
+                        help="peticiones simultáneas admitidas; las demás reciben 429")
+    parser.add_argument("--latency-per-inflight-ms", type=float, default=0.0,
+                        help="latencia extra por cada petición en curso")
+    args = parser.parse_args()
+
+    config = StubConfig(
+        devices=args.devices, points_per_key=args.points, latency_ms=args.latency_ms,
+        error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, retry_after_s=args.retry_after,
+        max_concurrent=args.max_concurrent, latency_per_inflight_ms=args.latency_per_inflight_ms,
+    )
+    stub = ThingsBoardStub(config, host="127.0.0.1", port=args.port)
+    print(f"Stub de ThingsBoard escuchando en {stub.url}")
+    try:
+        stub._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stub._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
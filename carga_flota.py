@@ -0,0 +1,228 @@
+"""
+Carga de flota con parseo y características en un pool de procesos.
+
+Con cientos de dispositivos, decodificar la telemetría y calcular las
+columnas temporales queda limitado por el GIL a un solo núcleo. Aquí los
+hilos del proceso principal solo descargan los bytes. Cada respuesta pasa
+a un proceso del pool por memoria compartida, y el proceso devuelve los
+arrays (ts, value, key, hora, período, día) en otro bloque de memoria
+compartida. Solo se serializan nombres y tamaños, nunca DataFrames.
+
+Los dashboards llegan aquí a través del SegmentCache (get_windows) cuando
+TB_PARSE_PROCESSES > 0; get_all_devices_data usa cargar_flota_procesos.
+"""
+import atexit
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import types
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import pandas as pd
+
+import data_queries
+from features import ORDEN_PERIODOS, periodo_del_dia
+from instrumentation import span
+from telemetry_stream import decode_stream
+
+DIA_MS = 24 * 60 * 60 * 1000
+HORA_MS = 60 * 60 * 1000
+
+# Columnas del bloque de salida, en orden, con su dtype
+_COLUMNAS = [
+    ("ts", np.int64),
+    ("value", np.float64),
+    ("dia", np.int32),
+    ("key", np.int16),
+    ("hora", np.int8),
+    ("periodo", np.int8),
+]
+
+_pool = None
+_pool_procesos = 0
+_pool_lock = threading.Lock()
+_main_lock = threading.Lock()
+
+
+def _procesar(nombre_entrada: str, nbytes: int) -> dict:
+    """
+    Se ejecuta en el proceso hijo: decodifica la respuesta de la memoria
+    compartida de entrada y escribe las columnas en un bloque nuevo.
+    """
+    entrada = SharedMemory(name=nombre_entrada)
+    try:
+        arrays, _ = decode_stream([bytes(entrada.buf[:nbytes])])
+    finally:
+        entrada.close()
+
+    keys = [k for k, (ts, _) in arrays.items() if len(ts)]
+    n = sum(len(arrays[k][0]) for k in keys)
+    if n == 0:
+        return {"keys": keys, "n": 0, "shm": None}
+
+    ts = np.concatenate([arrays[k][0] for k in keys])
+    orden = np.argsort(ts, kind="stable")
+    ts = ts[orden]
+    hora = (ts // HORA_MS) % 24
+    columnas = {
+        "ts": ts,
+        "value": np.concatenate([arrays[k][1] for k in keys])[orden],
+        "dia": ts // DIA_MS,
+        "key": np.repeat(np.arange(len(keys)), [len(arrays[k][0]) for k in keys])[orden],
+        "hora": hora,
+        "periodo": periodo_del_dia(hora).codes,
+    }
+
+    salida = SharedMemory(create=True, size=n * sum(np.dtype(d).itemsize for _, d in _COLUMNAS))
+    try:
+        offset = 0
+        for nombre, dtype in _COLUMNAS:
+            destino = np.ndarray((n,), dtype=dtype, buffer=salida.buf, offset=offset)
+            destino[:] = columnas[nombre]
+            offset += n * np.dtype(dtype).itemsize
+            del destino
+    finally:
+        salida.close()
+    return {"keys": keys, "n": n, "shm": salida.name}
+
+
+def _leer_resultado(meta: dict, derivar: bool) -> pd.DataFrame:
+    """Copia las columnas del bloque compartido a un DataFrame y libera el bloque."""
+    if not meta["n"]:
+        return pd.DataFrame(columns=["ts", "value", "key", "fecha"])
+
+    n = meta["n"]
+    shm = SharedMemory(name=meta["shm"])
+    try:
+        col, offset = {}, 0
+        for nombre, dtype in _COLUMNAS:
+            col[nombre] = np.frombuffer(shm.buf, dtype=dtype, count=n, offset=offset).copy()
+            offset += n * np.dtype(dtype).itemsize
+    finally:
+        shm.close()
+        shm.unlink()
+
+    df = pd.DataFrame({
+        "ts": col["ts"],
+        "value": col["value"],
+        "key": np.array(meta["keys"], dtype=object)[col["key"]],
+        "fecha": col["ts"].astype("datetime64[ms]"),
+    }, copy=False)
+    if derivar:
+        # Mismas columnas que features.agregar_columnas_temporales; Fecha se
+        # construye con un objeto date por día, no uno por fila
+        dias, inverso = np.unique(col["dia"], return_inverse=True)
+        df["Fecha"] = dias.astype("datetime64[D]").astype(object)[inverso]
+        df["Hora_del_Dia"] = col["hora"].astype(np.int32)
+        df["Periodo_Dia"] = pd.Categorical.from_codes(col["periodo"], categories=ORDEN_PERIODOS, ordered=True)
+    return df
+
+
+def _obtener_pool(procesos: int) -> ProcessPoolExecutor:
+    """Pool compartido; 'spawn' evita heredar hilos y sockets del servidor."""
+    global _pool, _pool_procesos
+    with _pool_lock:
+        if _pool is None or _pool_procesos != procesos:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=procesos, mp_context=multiprocessing.get_context("spawn"))
+            _pool_procesos = procesos
+        return _pool
+
+
+@atexit.register
+def _cerrar_pool():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+
+@contextmanager
+def _main_neutro():
+    """
+    Streamlit ejecuta cada página como el módulo __main__, y con 'spawn' el
+    pool arranca sus procesos al enviar tareas: cada proceso nuevo volvería
+    a ejecutar la página. Mientras se envía, __main__ es un módulo vacío.
+    """
+    with _main_lock:
+        main = sys.modules["__main__"]
+        sys.modules["__main__"] = types.ModuleType("__main__")
+        try:
+            yield
+        finally:
+            sys.modules["__main__"] = main
+
+
+def _enviar(pool, payload: bytes):
+    entrada = SharedMemory(create=True, size=max(len(payload), 1))
+    entrada.buf[:len(payload)] = payload
+    try:
+        with _main_neutro():
+            return entrada, pool.submit(_procesar, entrada.name, len(payload))
+    except Exception:
+        entrada.close()
+        entrada.unlink()
+        raise
+
+
+def descargar_procesos(peticiones: dict, jwt_token: str, procesos: int = None,
+                       hilos: int = 8, derivar: bool = False) -> dict:
+    """
+    Descarga y decodifica varias peticiones de telemetría. `peticiones` es
+    {clave: argumentos de data_queries.get_telemetry_bytes}; retorna
+    {clave: DataFrame}, o la excepción para las que fallan, en el orden de
+    `peticiones`.
+    """
+    procesos = procesos or os.cpu_count() or 1
+    pool = _obtener_pool(procesos)
+
+    def descargar(clave):
+        return data_queries.get_telemetry_bytes(jwt_token=jwt_token, **peticiones[clave])
+
+    resultados, pendientes = {}, {}
+    with span("fleet.process_pool", requests=len(peticiones), processes=procesos):
+        with ThreadPoolExecutor(max_workers=max(1, min(hilos, len(peticiones)))) as executor:
+            descargas = {executor.submit(descargar, clave): clave for clave in peticiones}
+            for futuro in as_completed(descargas):
+                clave = descargas[futuro]
+                try:
+                    pendientes[clave] = _enviar(pool, futuro.result())
+                except Exception as err:
+                    resultados[clave] = err
+
+        for clave, (entrada, futuro) in pendientes.items():
+            try:
+                resultados[clave] = _leer_resultado(futuro.result(), derivar)
+            except Exception as err:
+                resultados[clave] = err
+            finally:
+                entrada.close()
+                entrada.unlink()
+
+    return {clave: resultados[clave] for clave in peticiones}
+
+
+def cargar_flota_procesos(device_ids: list, jwt_token: str, days_back: int = None,
+                          start_ts: int = None, end_ts: int = None, procesos: int = None,
+                          hilos: int = 8, derivar: bool = True) -> dict:
+    """
+    Telemetría de varios dispositivos: {device_id: DataFrame}. Los hilos
+    descargan y cada respuesta se decodifica en el pool en cuanto llega.
+    Con `derivar`, los DataFrames traen además Fecha, Hora_del_Dia y
+    Periodo_Dia. Los dispositivos que fallan se registran y se omiten.
+    """
+    peticiones = {
+        did: {"device_id": did, "days_back": days_back, "start_ts": start_ts, "end_ts": end_ts}
+        for did in device_ids
+    }
+    resultados = {}
+    for did, resultado in descargar_procesos(peticiones, jwt_token, procesos, hilos, derivar).items():
+        if isinstance(resultado, Exception):
+            logging.error(f"No se pudieron obtener datos para {did}: {resultado}")
+        else:
+            resultados[did] = resultado
+    return resultados
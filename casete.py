@@ -0,0 +1,247 @@
+"""
+Casetes de respuestas de ThingsBoard: grabar y reproducir.
+
+En modo "record" cada respuesta correcta que pasa por el cliente (ver
+resiliencia.ClienteTB) se añade a un archivo JSON Lines comprimido con
+gzip, con su estado, Content-Type y el tiempo que tardó. En modo "replay"
+no se contacta a ThingsBoard: cada petición se responde desde el casete
+tras una latencia configurable (la grabada, escalada, o una fija), así que
+las regresiones de rendimiento se miden sin red sobre datos con la forma
+real (nulos, valores como texto, keys ausentes).
+
+La clave de una petición es método + ruta + query sin startTs/endTs +
+cuerpo JSON. La ventana [startTs, endTs] se guarda aparte con la hora de
+grabación y se compara relativa a ella, porque las ventanas se calculan
+con la hora actual:
+
+- ventanas por días (segmentos): la grabada desplazada los días de
+  calendario UTC transcurridos desde la grabación debe coincidir exacta;
+- ventanas móviles ("últimos N días"): sus desfases respecto a la hora de
+  la petición deben coincidir con los de la grabación (con tolerancia).
+
+Una petición sin respuesta para su ventana falla en lugar de servir otra.
+Los "ts" de la respuesta reproducida se desplazan lo mismo que la ventana
+(o, sin ventana, el tiempo transcurrido desde la grabación), para que los
+datos caigan en el rango pedido. Si una ventana se grabó varias veces, las
+respuestas se reproducen en orden y en bucle. El host no forma parte de la
+clave, y no se graban credenciales: el cuerpo del login no entra en la
+clave y los tokens de la respuesta se sustituyen.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+MODOS = ("record", "replay")
+DIA_MS = 24 * 60 * 60 * 1000
+# Parámetros de query de la ventana de tiempo: se comparan aparte
+_PARAMS_VENTANA = ("startTs", "endTs")
+# Diferencia admitida entre desfases de ventanas móviles (ms)
+TOLERANCIA_MS = 10 * 60 * 1000
+_RUTAS_AUTH = ("/api/auth/",)
+_CAMPOS_TOKEN = ("token", "refreshToken")
+
+
+def _ahora_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def clave_peticion(metodo: str, url: str, cuerpo=None) -> str:
+    """Clave estable de una petición: sin host, sin ventana de tiempo y sin credenciales."""
+    partes = urlsplit(url)
+    query = urlencode(sorted((k, v) for k, v in parse_qsl(partes.query) if k not in _PARAMS_VENTANA))
+    if partes.path.startswith(_RUTAS_AUTH):
+        cuerpo = None
+    cuerpo = json.dumps(cuerpo, sort_keys=True) if cuerpo is not None else ""
+    return f"{metodo.upper()} {partes.path}?{query} {cuerpo}"
+
+
+def ventana_peticion(url: str):
+    """[startTs, endTs] de la query en ms, o None si la petición no lleva ventana."""
+    params = dict(parse_qsl(urlsplit(url).query))
+    try:
+        return [int(params["startTs"]), int(params["endTs"])]
+    except (KeyError, ValueError):
+        return None
+
+
+def _dias_desde(grabada_ms: int, ahora_ms: int) -> int:
+    """Desplazamiento (ms) de días de calendario UTC completos entre grabación y ahora."""
+    return (ahora_ms // DIA_MS - grabada_ms // DIA_MS) * DIA_MS
+
+
+def _desplazar_ts(datos, ms: int):
+    """Suma `ms` a cada campo "ts" entero del JSON, en cualquier nivel."""
+    if isinstance(datos, dict):
+        for k, v in datos.items():
+            if k == "ts" and isinstance(v, int):
+                datos[k] = v + ms
+            else:
+                _desplazar_ts(v, ms)
+    elif isinstance(datos, list):
+        for v in datos:
+            _desplazar_ts(v, ms)
+    return datos
+
+
+def _sin_tokens(texto: str, ruta: str) -> str:
+    """Sustituye los tokens de las respuestas de autenticación."""
+    if not ruta.startswith(_RUTAS_AUTH):
+        return texto
+    try:
+        datos = json.loads(texto)
+    except ValueError:
+        return texto
+    for campo in _CAMPOS_TOKEN:
+        if campo in datos:
+            datos[campo] = "casete"
+    return json.dumps(datos)
+
+
+class PeticionNoGrabada(requests.exceptions.ConnectionError):
+    """La petición no está en el casete que se reproduce."""
+
+
+class Casete:
+    """
+    Casete en `ruta` (.jsonl.gz). `latencia_ms` fija la latencia de cada
+    respuesta reproducida; sin ella se usa la grabada multiplicada por
+    `escala` (0 = sin espera).
+    """
+
+    def __init__(self, ruta: str, modo: str, latencia_ms: float = None, escala: float = 1.0):
+        if modo not in MODOS:
+            raise ValueError(f"Modo de casete desconocido '{modo}' (record o replay)")
+        self.ruta = ruta
+        self.modo = modo
+        self.latencia_ms = latencia_ms
+        self.escala = escala
+        self._lock = threading.Lock()
+        self._respuestas = None
+        self._turnos = {}
+        self._stats = {"grabadas": 0, "reproducidas": 0, "no_grabadas": 0, "bytes": 0}
+        if self.reproduciendo:
+            self._cargar()
+
+    @property
+    def reproduciendo(self) -> bool:
+        return self.modo == "replay"
+
+    # ── Grabación ──
+
+    def grabar(self, metodo: str, url: str, cuerpo, response: requests.Response, segundos: float):
+        """
+        Añade la respuesta al casete. Lee el cuerpo completo: con stream=True
+        la respuesta se sigue pudiendo iterar desde memoria. Un error al
+        grabar se registra sin afectar a la petición.
+        """
+        if response.status_code >= 400:
+            return
+        try:
+            ruta = urlsplit(url).path
+            texto = _sin_tokens(response.content.decode(response.encoding or "utf-8"), ruta)
+            linea = json.dumps({
+                "clave": clave_peticion(metodo, url, cuerpo),
+                "ventana": ventana_peticion(url),
+                # Hora de envío: la ventana se calculó con ella
+                "grabada_ms": _ahora_ms() - int(segundos * 1000),
+                "status": response.status_code,
+                "content_type": response.headers.get("Content-Type", "application/json"),
+                "segundos": round(segundos, 4),
+                "cuerpo": texto,
+            })
+            with self._lock:
+                # Un miembro gzip por respuesta: el casete sigue siendo legible si el proceso se corta
+                with gzip.open(self.ruta, "at", encoding="utf-8") as f:
+                    f.write(linea + "\n")
+                self._stats["grabadas"] += 1
+                self._stats["bytes"] += len(texto)
+        except Exception as err:
+            logging.warning(f"No se pudo grabar la respuesta en el casete {self.ruta}: {err}")
+
+    # ── Reproducción ──
+
+    def _cargar(self) -> dict:
+        if self._respuestas is None:
+            respuestas = {}
+            if not os.path.exists(self.ruta):
+                raise FileNotFoundError(f"No existe el casete {self.ruta}")
+            with gzip.open(self.ruta, "rt", encoding="utf-8") as f:
+                for linea in f:
+                    if linea.strip():
+                        entrada = json.loads(linea)
+                        respuestas.setdefault(entrada["clave"], []).append(entrada)
+            logging.info(f"Casete {self.ruta}: {sum(map(len, respuestas.values()))} respuestas, "
+                         f"{len(respuestas)} peticiones distintas")
+            self._respuestas = respuestas
+        return self._respuestas
+
+    @staticmethod
+    def _candidatas(grabadas: list, ventana, ahora_ms: int) -> list:
+        """
+        [(entrada, desplazamiento_ms)] que responden a la ventana pedida:
+        coincidencias por días si las hay, si no por desfase respecto a la
+        hora de la petición.
+        """
+        if ventana is None:
+            return [(e, ahora_ms - e["grabada_ms"]) for e in grabadas if e.get("ventana") is None]
+        con_ventana = [e for e in grabadas if e.get("ventana") is not None]
+        por_dias = []
+        for e in con_ventana:
+            dias = _dias_desde(e["grabada_ms"], ahora_ms)
+            if [e["ventana"][0] + dias, e["ventana"][1] + dias] == ventana:
+                por_dias.append((e, dias))
+        if por_dias:
+            return por_dias
+        return [
+            (e, ventana[0] - e["ventana"][0]) for e in con_ventana
+            if abs((ventana[0] - ahora_ms) - (e["ventana"][0] - e["grabada_ms"])) <= TOLERANCIA_MS
+            and abs((ventana[1] - ahora_ms) - (e["ventana"][1] - e["grabada_ms"])) <= TOLERANCIA_MS
+        ]
+
+    def reproducir(self, metodo: str, url: str, cuerpo=None) -> requests.Response:
+        """Respuesta grabada para la petición, tras la latencia configurada."""
+        clave = clave_peticion(metodo, url, cuerpo)
+        ventana = ventana_peticion(url)
+        with self._lock:
+            candidatas = self._candidatas(self._cargar().get(clave, []), ventana, _ahora_ms())
+            if not candidatas:
+                self._stats["no_grabadas"] += 1
+                raise PeticionNoGrabada(f"Petición no grabada en el casete: {clave[:200]} ventana {ventana}")
+            turno_clave = (clave, tuple(ventana or ()))
+            turno = self._turnos.get(turno_clave, 0)
+            self._turnos[turno_clave] = turno + 1
+            entrada, desplazamiento = candidatas[turno % len(candidatas)]
+            self._stats["reproducidas"] += 1
+
+        cuerpo_respuesta = entrada["cuerpo"]
+        if desplazamiento and "json" in entrada["content_type"]:
+            try:
+                cuerpo_respuesta = json.dumps(_desplazar_ts(json.loads(cuerpo_respuesta), desplazamiento))
+            except ValueError:
+                pass
+
+        espera = self.latencia_ms / 1000 if self.latencia_ms is not None else entrada["segundos"] * self.escala
+        if espera > 0:
+            time.sleep(espera)
+
+        response = requests.Response()
+        response.status_code = entrada["status"]
+        response.headers = CaseInsensitiveDict({"Content-Type": entrada["content_type"]})
+        response.encoding = "utf-8"
+        response.url = url
+        response.reason = "OK"
+        response._content = cuerpo_respuesta.encode("utf-8")
+        # iter_content (lecturas en streaming) recorre el cuerpo ya leído
+        response._content_consumed = True
+        return response
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "modo": self.modo, "ruta": self.ruta}
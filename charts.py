@@ -0,0 +1,153 @@
+"""
+Construcción de figuras de matplotlib compartidas por los dashboards.
+Las funciones retornan la figura; el llamador la muestra y la cierra.
+"""
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import seaborn as sns
+
+from kpis import FRESCURA_COLORES, FRESCURA_ETIQUETAS
+
+
+FIGSIZE_HISTORICO = (12, 5)
+# Ancho útil del histórico en píxeles: decide el nivel de la pirámide a consultar
+ANCHO_HISTORICO_PX = int(FIGSIZE_HISTORICO[0] * plt.rcParams["figure.dpi"])
+
+
+def figura_historico(df_key: pd.DataFrame, title: str, ylabel: str, color: str,
+                     anomalias: pd.DataFrame = None, pronostico: pd.DataFrame = None):
+    """
+    Serie temporal de una métrica. Si df_key viene agregado (columnas min y
+    max de la pirámide), se dibuja la banda min–max bajo la media.
+    `anomalias` (fecha, value) se marcan sobre la serie y `pronostico`
+    (fecha, value, inferior, superior) se dibuja a continuación en naranja.
+    """
+    fig, ax = plt.subplots(figsize=FIGSIZE_HISTORICO)
+    if "min" in df_key and "max" in df_key and (df_key["count"] > 1).any():
+        ax.fill_between(df_key["fecha"], df_key["min"], df_key["max"], color=color, alpha=0.2, linewidth=0)
+    ax.plot(df_key["fecha"], df_key["value"], color=color, linewidth=2)
+    if anomalias is not None and not anomalias.empty:
+        ax.scatter(anomalias["fecha"], anomalias["value"], marker="x", color="red", s=40, zorder=3,
+                   label="Anomalía")
+    if pronostico is not None and not pronostico.empty:
+        ax.fill_between(pronostico["fecha"], pronostico["inferior"], pronostico["superior"],
+                        color="orange", alpha=0.15, linewidth=0)
+        ax.plot(pronostico["fecha"], pronostico["value"], color="orange", linestyle="--", linewidth=2,
+                label="Predicción")
+    if ax.get_legend_handles_labels()[0]:
+        ax.legend(loc="upper left")
+    ax.set_title(title)
+    ax.set_xlabel("Fecha")
+    ax.set_ylabel(ylabel)
+    plt.setp(ax.get_xticklabels(), rotation=45)
+    fig.tight_layout()
+    return fig
+
+
+FIGSIZE_HEATMAP = (14, 4)
+# Tamaño mínimo de celda (px) para escribir el valor dentro
+ANOTAR_MIN_PX = (28, 16)
+MAX_ETIQUETAS_X = 40
+
+
+def _celda_px(ax, filas: int, columnas: int) -> tuple:
+    caja = ax.get_window_extent()
+    return caja.width / max(columnas, 1), caja.height / max(filas, 1)
+
+
+def _anotar(ax, imagen, valores: np.ma.MaskedArray, fmt: str = ".2g"):
+    """
+    Escribe el valor de cada celda con color según la luminancia del fondo
+    (como seaborn). Colores y textos se calculan de una vez para toda la
+    matriz.
+    """
+    filas, columnas = np.nonzero(~np.ma.getmaskarray(valores))
+    datos = valores.data[filas, columnas]
+    rgba = imagen.cmap(imagen.norm(datos))
+    luminancia = 0.2126 * rgba[:, 0] + 0.7152 * rgba[:, 1] + 0.0722 * rgba[:, 2]
+    colores = np.where(luminancia > 0.408, ".15", "w")
+    textos = [format(v, fmt) for v in datos.tolist()]
+    for y, x, texto, color in zip(filas.tolist(), columnas.tolist(), textos, colores):
+        ax.text(x, y, texto, ha="center", va="center", color=color, fontsize=8)
+
+
+def figura_heatmap(pivot: pd.DataFrame, label: str, cmap: str, anotar: bool = None):
+    """
+    Heatmap de la métrica por período del día (filas) y fecha (columnas)
+    con una sola imagen (imshow): el coste no crece con el número de celdas.
+    Los valores se anotan solo si las celdas son lo bastante grandes
+    (`anotar` lo fuerza en un sentido u otro).
+    """
+    valores = np.ma.masked_invalid(pivot.to_numpy(dtype=float))
+    filas, columnas = valores.shape
+
+    fig, ax = plt.subplots(figsize=FIGSIZE_HEATMAP)
+    imagen = ax.imshow(
+        valores, aspect="auto", interpolation="nearest",
+        cmap=sns.color_palette(cmap, as_cmap=True)
+    )
+    fig.colorbar(imagen, ax=ax, label="Valor")
+
+    ax.set_yticks(range(filas), labels=[str(i) for i in pivot.index])
+    paso = max(1, -(-columnas // MAX_ETIQUETAS_X))
+    posiciones = range(0, columnas, paso)
+    ax.set_xticks(posiciones, labels=[str(pivot.columns[i]) for i in posiciones], rotation=90)
+    ax.set_xlabel(pivot.columns.name or "")
+    ax.set_ylabel(pivot.index.name or "")
+    ax.set_title(f"Heatmap de {label} por Período del Día")
+    fig.tight_layout()
+
+    if anotar is None:
+        ancho, alto = _celda_px(ax, filas, columnas)
+        anotar = ancho >= ANOTAR_MIN_PX[0] and alto >= ANOTAR_MIN_PX[1]
+    if anotar and valores.count():
+        _anotar(ax, imagen, valores)
+    return fig
+
+
+# Por encima de este número de dispositivos el swarmplot se solapa y su
+# coste crece más que linealmente: la vista de puntos pasa a stripplot
+UMBRAL_SWARM = 200
+
+
+def figura_bateria(df_battery: pd.DataFrame, columna: str = "Porcentaje de bateria",
+                   modo: str = "distribucion", bins: int = 20):
+    """
+    Batería de la flota coloreada por frescura del último reporte
+    (columnas 'frescura' y 'color' de kpis.frescura_bateria).
+
+    modo="distribucion": histograma apilado por clase de frescura; dibuja
+    siempre bins × 4 barras, así que el coste no depende del tamaño de la
+    flota. modo="puntos": un punto por dispositivo (swarmplot hasta
+    UMBRAL_SWARM dispositivos, stripplot por encima).
+    """
+    fig, ax = plt.subplots(figsize=(12, 5))
+    if modo == "puntos":
+        paleta = {c: c for c in FRESCURA_COLORES}
+        if len(df_battery) <= UMBRAL_SWARM:
+            sns.swarmplot(data=df_battery, x=columna, hue="color", palette=paleta, size=8, ax=ax)
+        else:
+            sns.stripplot(data=df_battery, x=columna, hue="color", palette=paleta, size=4,
+                          jitter=0.35, alpha=0.6, ax=ax)
+    else:
+        bordes = np.linspace(0, 100, bins + 1)
+        pct = np.clip(df_battery[columna].to_numpy(dtype=float), 0, 100)
+        clases = df_battery["frescura"].cat.codes.to_numpy()
+        conteos, _, _ = np.histogram2d(
+            clases, pct, bins=[np.arange(len(FRESCURA_ETIQUETAS) + 1) - 0.5, bordes]
+        )
+        base = np.zeros(bins)
+        for fila, etiqueta, color in zip(conteos, FRESCURA_ETIQUETAS, FRESCURA_COLORES):
+            if fila.any():
+                ax.bar(bordes[:-1], fila, width=np.diff(bordes), bottom=base, align="edge",
+                       color=color, edgecolor="black", linewidth=0.5,
+                       label=f"{etiqueta} ({int(fila.sum())})")
+            base += fila
+        ax.set_xlim(0, 100)
+        ax.set_ylabel("Dispositivos")
+        ax.legend(title="Último reporte", loc="upper left", bbox_to_anchor=(1.01, 1))
+    ax.set_title("Estado de Batería de Dispositivos")
+    ax.set_xlabel("Porcentaje de Batería (%)")
+    fig.tight_layout()
+    return fig
@@ -1,9 +1,25 @@
 import streamlit as st
 import pandas as pd
-import seaborn as sns
 import matplotlib.pyplot as plt
-from data_queries import init_connection, list_all_tenant_devices, get_device_data
-import requests
+from data_queries import init_connection, CACHE_MAX_MB
+from device_registry import DeviceRegistry, SIN_ZONA
+from snapshots import SnapshotStore
+from segmentos import SegmentCache, ventana_desde_fechas
+from planificador import PlanDescargas
+from deltas import DeltaBus
+from anomalias import DetectorAnomalias
+from alertas import MotorAlertas
+from estadisticas import EstadisticasFlota
+from pronostico import Pronosticador
+from instrumentation import span, render_debug_panel, register_collector, register_debug_view
+from presupuesto import PresupuestoMemoria, MB
+from features import agregar_columnas_temporales
+from kpis import (
+    nivel_riesgo, recomendacion_ce, color_ce,
+    kpis_desde_promedios, kpis_dispositivo, kpis_por_zona, tabla_zonas, pivots_flota, frescura_bateria,
+)
+from sensores import ESQUEMAS, RANGOS, MAGNITUDES_HISTORICO
+from charts import figura_historico, figura_heatmap, figura_bateria, ANCHO_HISTORICO_PX, UMBRAL_SWARM
 
 # Configuración de página
 st.set_page_config(
@@ -29,124 +45,166 @@ key_mapping = {
 }
 
 # ===== SELECTOR DE DISPOSITIVO =====
-@st.cache_data(ttl=3600)
-def cargar_dispositivos():
-    return list_all_tenant_devices(jwt_token)
+@st.cache_resource
+def obtener_registro():
+    """Registro de dispositivos compartido por todas las sesiones."""
+    return DeviceRegistry()
+
+registro = obtener_registro()
+registro.refresh(jwt_token)
+device_ids = registro.ids
+
+if not device_ids:
+    st.warning("No se encontraron dispositivos en el tenant")
+    st.stop()
 
-dispositivos = cargar_dispositivos()
-device_names = [d.get("name", "N/A") for d in dispositivos]
-device_ids = [d.get("id", {}).get("id") for d in dispositivos]
+opciones_dispositivos = device_ids
+perfiles = registro.profiles()
+if len(perfiles) > 1:
+    perfil = st.sidebar.selectbox("Perfil de dispositivo", ["Todos"] + perfiles)
+    if perfil != "Todos":
+        opciones_dispositivos = registro.ids_by_profile(perfil)
+zonas = registro.zones()
+zona = st.sidebar.selectbox("🌱 Zona", ["Todas"] + zonas) if zonas else "Todas"
+if zona != "Todas":
+    en_zona = set(registro.ids_by_zone(zona))
+    opciones_dispositivos = [did for did in opciones_dispositivos if did in en_zona]
+
+if not opciones_dispositivos:
+    st.warning("No hay dispositivos con el perfil y la zona elegidos")
+    st.stop()
 
-selected_device = st.selectbox("📱 Selecciona un dispositivo", device_names)
-selected_id = device_ids[device_names.index(selected_device)]
+selected_id = st.selectbox("📱 Selecciona un dispositivo", opciones_dispositivos, format_func=registro.label)
 
-dias = 60  # Fijo a 60 días
+# ===== RANGO DE FECHAS (días UTC, ambos incluidos) =====
+hoy = pd.Timestamp.now(tz="UTC").date()
+rango = st.sidebar.date_input(
+    "📅 Rango de fechas",
+    value=(hoy - pd.Timedelta(days=59), hoy),
+    max_value=hoy
+)
+# Mientras se elige la fecha final, el widget retorna una sola fecha
+fecha_inicio, fecha_fin = (rango[0], rango[-1]) if rango else (hoy, hoy)
+inicio, fin = ventana_desde_fechas(fecha_inicio, fecha_fin)
 
 # ===== CARGAR DATOS =====
-@st.cache_data(ttl=300)  # 5 minutos - para gráficos históricos
-def cargar_datos_dispositivo(device_id, days):
-    return get_device_data(device_id, jwt_token, days_back=days)
+@st.cache_resource
+def obtener_presupuesto():
+    """Presupuesto de memoria del proceso para snapshots, KPIs derivados y segmentos."""
+    presupuesto = PresupuestoMemoria(int(CACHE_MAX_MB * MB))
+    register_collector(presupuesto.metricas)
+    register_debug_view("🧠 Cachés", presupuesto.resumen)
+    register_debug_view("📦 Entradas más grandes", presupuesto.entradas)
+    register_debug_view("🗑️ Expulsiones recientes", presupuesto.expulsiones)
+    return presupuesto
+
+@st.cache_resource
+def obtener_snapshots():
+    """Snapshots compartidos entre sesiones: sin copias por rerun."""
+    return SnapshotStore(presupuesto=obtener_presupuesto())
+
+@st.cache_resource
+def obtener_deltas():
+    """
+    Bus de deltas con sus consumidores incrementales: detector de anomalías,
+    alertas y pronóstico (cada punto una sola vez) y estadísticas de flota
+    (históricas).
+    """
+    bus = DeltaBus()
+    detector = DetectorAnomalias()
+    motor = MotorAlertas()
+    estadisticas = EstadisticasFlota()
+    pronosticador = Pronosticador()
+    bus.subscribe(detector.procesar)
+    bus.subscribe(motor.procesar)
+    bus.subscribe(pronosticador.procesar)
+    bus.subscribe(estadisticas.procesar, historico=True)
+    for componente in (bus, detector, motor, estadisticas, pronosticador):
+        register_collector(componente.metricas)
+    return bus, detector, motor, estadisticas, pronosticador
+
+@st.cache_resource
+def obtener_segmentos():
+    """Telemetría por día UTC compartida entre sesiones y rangos de fechas."""
+    return SegmentCache(bus=obtener_deltas()[0], presupuesto=obtener_presupuesto())
+
+snapshots = obtener_snapshots()
+bus_deltas, detector, motor_alertas, estadisticas, pronosticador = obtener_deltas()
+segmentos = obtener_segmentos()
+# Los cubos de zona siguen a los atributos del registro (se reconstruyen solo si cambian)
+estadisticas.asignar_zonas(registro.zone_map())
+
+# ===== PLAN DE DESCARGAS: lo que necesitan las secciones, en el mínimo de peticiones =====
+plan = PlanDescargas(ESQUEMAS["clasico"], segmentos, jwt_token)
+# Históricos, heatmaps, tabla de detalle y KPIs de flota
+plan.ventana(device_ids, MAGNITUDES_HISTORICO, inicio, fin)
+# Batería de la flota y valores actuales del dispositivo (botón de actualizar)
+plan.ultimos(device_ids, ["bateria"])
+plan.ultimos([selected_id], MAGNITUDES_HISTORICO)
+
+def cargar_datos_dispositivo(device_id, inicio, fin):
+    # 5 minutos - para gráficos históricos; columnas derivadas una vez por snapshot
+    return snapshots.get(
+        ("dispositivo", device_id, inicio, fin),
+        lambda: plan.telemetria(device_id, inicio, fin),
+        ttl=300,
+        derive=agregar_columnas_temporales
+    )
 
 # Función SIN caché para valores actuales (botón de actualizar)
-def cargar_datos_actuales(device_id):
-    """Obtiene solo los últimos valores sin caché"""
-    return get_device_data(device_id, jwt_token, days_back=1)  # Solo último día
+def cargar_valores_actuales(device_id):
+    """Últimos valores del dispositivo (en el orden del esquema), sin caché"""
+    df_actual = plan.ultimos_valores(MAGNITUDES_HISTORICO, [device_id])
+    return dict(zip(df_actual["key"], df_actual["value"].astype(float)))
 
-df = cargar_datos_dispositivo(selected_id, dias)
+snap_dispositivo = cargar_datos_dispositivo(selected_id, inicio, fin)
+df = snap_dispositivo.view()
 
 if df.empty:
     st.warning("No hay datos disponibles para este dispositivo")
     st.stop()
 
 # ===== CARGAR DATOS DE TODOS LOS DISPOSITIVOS =====
-@st.cache_data(ttl=300)  # 5 minutos
-def cargar_datos_todos_dispositivos(device_ids, dias):
+def _cargar_flota(device_ids, inicio, fin):
+    # Con TB_PARSE_PROCESSES, descarga en paralelo y decodifica en un pool de procesos
+    plan.precargar(device_ids)
     all_data = []
     for did in device_ids:
         try:
-            df_device = get_device_data(did, jwt_token, days_back=dias)
+            df_device = plan.telemetria(did, inicio, fin)
             if not df_device.empty:
                 all_data.append(df_device)
         except:
             continue
     return pd.concat(all_data, ignore_index=True) if all_data else pd.DataFrame()
 
-# Cargar datos de todos los dispositivos
-df_all = cargar_datos_todos_dispositivos(device_ids, dias)
-
-# ===== INGENIERÍA DE CARACTERÍSTICAS =====
-df["Fecha"] = df["fecha"].dt.date
-df["Hora_del_Dia"] = df["fecha"].dt.hour
-
-def clasificar_periodo(hora):
-    if 6 <= hora < 12:
-        return "Mañana"
-    elif 12 <= hora < 18:
-        return "Tarde"
-    else:
-        return "Noche"
-
-df["Periodo_Dia"] = df["Hora_del_Dia"].apply(clasificar_periodo)
-
-# Ordenar período del día
-orden_periodos = ["Mañana", "Tarde", "Noche"]
-df["Periodo_Dia"] = pd.Categorical(
-    df["Periodo_Dia"],
-    categories=orden_periodos,
-    ordered=True
-)
+def cargar_datos_todos_dispositivos(device_ids, inicio, fin):
+    return snapshots.get(
+        ("flota", hash(device_ids), inicio, fin),
+        lambda: _cargar_flota(device_ids, inicio, fin),
+        ttl=300  # 5 minutos
+    )
 
-# ===== FUNCIÓN PARA OBTENER BATERÍA =====
-def get_last_battery(device_id, jwt_token, url_thingsboard):
-    url = f"{url_thingsboard}/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries?keys=battery_level&limit=1"
-    headers = {"X-Authorization": f"Bearer {jwt_token}"}
-    try:
-        r = requests.get(url, headers=headers)
-        data = r.json()
-
-        # Verificar que exista la key 'battery_level' y tenga datos
-        if "battery_level" not in data or not data["battery_level"]:
-            return None
-
-        entry = data["battery_level"][0]
-        
-        # Verificar que el valor no sea None
-        if entry.get("value") is None:
-            return None
-            
-        ts = pd.to_datetime(entry["ts"], unit="ms")
-        value = float(entry["value"])
-        
-        # El valor ya viene en porcentaje (0-100), no necesita conversión
-        return {"device_id": device_id, "timestamp": ts, "battery": value}
-    except Exception as e:
-        # Solo loggear en el servidor, no mostrar warning al usuario
-        import logging
-        logging.warning(f"No se pudo obtener batería para {device_id}: {e}")
-        return None
+# Cargar datos de todos los dispositivos
+snap_flota = cargar_datos_todos_dispositivos(tuple(device_ids), inicio, fin)
+df_all = snap_flota.view()
 
-# ===== PARÁMETROS POR TIPO DE SENSOR =====
+# ===== PARÁMETROS POR TIPO DE SENSOR (rangos compartidos con el motor de alertas) =====
 parametros = {
     "soil_humidity": {
         "label": "Humedad Volumétrica del Suelo (VWC %)",
         "unit": "%",
-        "verde": (25, 40),
-        "amarillo": [(18, 24), (41, 45)],
-        "rojo": [(0, 18), (45, 100)]
+        **RANGOS["humedad"]
     },
     "soil_temperature": {
         "label": "Temperatura del Suelo",
         "unit": "°C",
-        "verde": (18, 28),
-        "amarillo": [(12, 17), (29, 32)],
-        "rojo": [(0, 12), (32, 100)]
+        **RANGOS["temperatura"]
     },
     "soil_ec": {
         "label": "Conductividad Eléctrica (CE aparente)",
         "unit": "dS/m",
-        "verde": (0.2, 1.2),
-        "amarillo": [(1.3, 2.0)],
-        "rojo": [(2.0, 4.0), (4.0, 100)]
+        **RANGOS["ce"]
     }
 }
 
@@ -184,70 +242,43 @@ def determinar_estado(valor, key):
 
     return "Desconocido", '#95a5a6'
 
-def clamp(x, a=0.0, b=1.0):
-    return max(a, min(b, x))
-
-def riesgo_bloqueo(hum, temp, ec,
-                   w_h=0.35, w_t=0.15, w_e=0.50,
-                   t_low=15, t_high=25):
-    H_risk = clamp((100.0 - hum) / 100.0)
-    if t_low <= temp <= t_high:
-        T_risk = 0.0
-    elif temp > t_high:
-        T_risk = clamp((temp - t_high) / 15.0)
-    else:
-        T_risk = clamp((t_low - temp) / 15.0)
-    EC_risk = clamp((ec - 1.0) / (4.0 - 1.0))
-    R_raw = w_h * H_risk + w_t * T_risk + w_e * EC_risk
-    R = round(R_raw * 10.0, 1)
-    return {
-        'H_risk': H_risk,
-        'T_risk': T_risk,
-        'EC_risk': EC_risk,
-        'R_raw': R_raw,
-        'R_0_10': R
-    }
+# KPIs del dispositivo: calculados una vez por snapshot y compartidos entre sesiones
+kpis_dev = snap_dispositivo.derived("kpis_dispositivo", kpis_dispositivo)
 
 # Cargar datos: usar datos actuales si se presionó refresh, sino usar caché
 if st.session_state.refresh_sensores:
-    df_sensores = cargar_datos_actuales(selected_id)
+    ultimos = cargar_valores_actuales(selected_id)
     st.session_state.refresh_sensores = False  # Reset flag
     st.success("✅ Sensores actualizados")
 else:
-    df_sensores = df
+    ultimos = kpis_dev["ultimos"]
 
-if df_sensores.empty:
+if not ultimos:
     st.warning("No hay datos disponibles para los sensores")
 else:
     st.write("**Valores:**")
     value_cols = st.columns(3)
-    for idx, key in enumerate(df_sensores["key"].unique()):
-        df_key = df_sensores[df_sensores["key"] == key]
-        if not df_key.empty:
-            valor = float(df_key.sort_values("fecha", ascending=False).iloc[0]["value"])
-            unit = parametros.get(key, {}).get("unit", "")
-            label = parametros.get(key, {}).get("label", key).split("(")[0].strip()
+    for idx, (key, valor) in enumerate(ultimos.items()):
+        unit = parametros.get(key, {}).get("unit", "")
+        label = parametros.get(key, {}).get("label", key).split("(")[0].strip()
 
-            with value_cols[idx]:
-                st.metric(label, f"{valor:.2f} {unit}")
+        with value_cols[idx]:
+            st.metric(label, f"{valor:.2f} {unit}")
 
     # Mostrar gráficos en línea
     st.write("**Indicadores:**")
     circles = st.columns(3)
 
-    for idx, key in enumerate(df_sensores["key"].unique()):
-        df_key = df_sensores[df_sensores["key"] == key]
-        if not df_key.empty:
-            valor = float(df_key.sort_values("fecha", ascending=False).iloc[0]["value"])
-            estado_text, color = determinar_estado(valor, key)
-
-            with circles[idx]:
-                fig, ax = plt.subplots(figsize=(1, 1))
-                ax.pie([1], colors=[color], startangle=90)
-                ax.axis('off')
-                ax.text(0, -1.3, estado_text, ha='center', fontsize=9, fontweight='bold')
-                st.pyplot(fig)
-                plt.close(fig)
+    for idx, (key, valor) in enumerate(ultimos.items()):
+        estado_text, color = determinar_estado(valor, key)
+
+        with circles[idx], span("render.semaforo", key=key):
+            fig, ax = plt.subplots(figsize=(1, 1))
+            ax.pie([1], colors=[color], startangle=90)
+            ax.axis('off')
+            ax.text(0, -1.3, estado_text, ha='center', fontsize=9, fontweight='bold')
+            st.pyplot(fig)
+            plt.close(fig)
 
 # ===== REGLAS DE REFERENCIA =====
 st.subheader("📋 Parámetros de Referencia")
@@ -297,8 +328,6 @@ with col3:
 # ===== MÉTRICAS HISTÓRICAS =====
 st.subheader("📊 Métricas Históricas")
 
-df_sorted = df.sort_values("fecha")
-
 tabs = st.tabs(["Temperatura", "Humedad", "Conductividad"])
 
 historico_config = {
@@ -309,25 +338,118 @@ historico_config = {
 
 keys_list = ["soil_temperature", "soil_humidity", "soil_ec"]
 
+# Anomalías del detector en línea para el dispositivo y la ventana elegidos
+anomalias_dev = detector.anomalias(selected_id, desde=inicio, hasta=fin)
+# Pronóstico de las próximas 24 h: solo si la ventana llega hasta los últimos datos
+pronostico_dev = pronosticador.pronosticar(selected_id, horizonte=24)
+if not pronostico_dev.empty:
+    pronostico_dev = pronostico_dev[pronostico_dev.groupby("key")["fecha"].transform("min") < fin]
+
 for tab, key in zip(tabs, keys_list):
     with tab:
-        df_key = df_sorted[df_sorted["key"] == key]
+        # Nivel de la pirámide según la ventana y el ancho del gráfico
+        df_key = kpis_dev["piramide"].consultar(key, inicio, fin, ancho_px=ANCHO_HISTORICO_PX)
 
         if not df_key.empty:
             _, title, ylabel, color = historico_config[key]
 
-            fig, ax = plt.subplots(figsize=(12, 5))
-            ax.plot(df_key["fecha"], df_key["value"], color=color, linewidth=2)
-            ax.set_title(title)
-            ax.set_xlabel("Fecha")
-            ax.set_ylabel(ylabel)
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            st.pyplot(fig)
-            plt.close(fig)
+            anomalias_key = anomalias_dev[anomalias_dev["key"] == key]
+            with span("render.historico", key=key, points=len(df_key), nivel=df_key.attrs.get("nivel")):
+                fig = figura_historico(df_key, title, ylabel, color, anomalias=anomalias_key,
+                                       pronostico=pronostico_dev[pronostico_dev["key"] == key])
+                st.pyplot(fig)
+                plt.close(fig)
         else:
             st.info(f"No hay datos disponibles")
 
+# ===== ANOMALÍAS =====
+st.subheader("🚨 Anomalías Detectadas")
+
+anomalias_flota = detector.anomalias(desde=pd.Timestamp.now(tz="UTC").tz_localize(None) - pd.Timedelta(days=1))
+col_dev, col_flota = st.columns(2)
+col_dev.metric("En este dispositivo (rango elegido)", len(anomalias_dev))
+col_flota.metric("En la flota (últimas 24 h)", len(anomalias_flota))
+
+if anomalias_dev.empty:
+    st.info("Sin anomalías en este dispositivo para el rango elegido")
+else:
+    st.dataframe(
+        anomalias_dev.sort_values("fecha", ascending=False).head(20).assign(
+            key=lambda d: d["key"].map(key_mapping).fillna(d["key"])
+        )[["fecha", "key", "value", "z", "z_robusto"]].rename(columns={
+            "fecha": "Fecha", "key": "Métrica", "value": "Valor", "z": "z EWMA", "z_robusto": "z robusto"
+        }),
+        hide_index=True,
+        width="stretch"
+    )
+
+# ===== ALERTAS =====
+st.subheader("🔔 Alertas")
+# Estado del motor de alertas: no descarga ni recorre telemetría cruda
+resumen_alertas = motor_alertas.resumen()
+col_crit, col_prec, col_ok = st.columns(3)
+col_crit.metric("🔴 Series en estado crítico", resumen_alertas["Crítico"])
+col_prec.metric("🟡 Series en precaución", resumen_alertas["Precaución"])
+col_ok.metric("🟢 Series óptimas", resumen_alertas["Óptimo"])
+
+activas = motor_alertas.activas()
+col_activas, col_historial = st.columns(2)
+with col_activas:
+    st.markdown("**Alertas activas en la flota**")
+    if activas.empty:
+        st.info("Sin alertas activas")
+    else:
+        st.dataframe(
+            activas.head(50).assign(
+                device_id=lambda d: d["device_id"].map(registro.label),
+                nivel=lambda d: d["nivel"].astype(str)
+            )[["device_id", "magnitud", "nivel", "desde", "ultimo_valor"]].rename(columns={
+                "device_id": "Dispositivo", "magnitud": "Magnitud", "nivel": "Nivel",
+                "desde": "Desde", "ultimo_valor": "Último valor"
+            }),
+            hide_index=True,
+            width="stretch"
+        )
+with col_historial:
+    st.markdown("**Cambios de estado de este dispositivo**")
+    transiciones_dev = motor_alertas.transiciones(selected_id)
+    if transiciones_dev.empty:
+        st.info("Sin cambios de estado registrados")
+    else:
+        st.dataframe(
+            transiciones_dev.head(20).assign(
+                key=lambda d: d["key"].map(key_mapping).fillna(d["key"])
+            )[["fecha", "key", "anterior", "nuevo", "valor"]].rename(columns={
+                "fecha": "Fecha", "key": "Métrica", "anterior": "Antes", "nuevo": "Después", "valor": "Valor"
+            }),
+            hide_index=True,
+            width="stretch"
+        )
+
+# ===== NECESIDADES HÍDRICAS PREVISTAS =====
+st.subheader("💧 Necesidades Hídricas Previstas (24 h)")
+# Pronóstico de toda la flota en una pasada, desde el estado de los modelos
+extremos_humedad = pronosticador.extremos("humedad", horizonte=24)
+umbral_riego = RANGOS["humedad"]["verde"][0]
+if extremos_humedad.empty:
+    st.info("Aún no hay historia horaria suficiente para pronosticar (mínimo 48 h por dispositivo)")
+else:
+    riego = extremos_humedad[extremos_humedad["minimo"] < umbral_riego].sort_values("minimo")
+    col_riego, col_modelos = st.columns(2)
+    col_riego.metric(f"Bajarán de {umbral_riego}% en las próximas 24 h", len(riego))
+    col_modelos.metric("Dispositivos con pronóstico", len(extremos_humedad))
+    if not riego.empty:
+        st.dataframe(
+            pd.DataFrame({
+                "Dispositivo": riego["device_id"].map(registro.label),
+                "Humedad actual (%)": riego["actual"].round(1),
+                "Mínimo previsto (%)": riego["minimo"].round(1),
+                "Hora del mínimo": riego["hora_minimo"],
+            }).head(50),
+            hide_index=True,
+            width="stretch"
+        )
+
 # ===== HEATMAPS =====
 st.subheader("🕒 Variación de métrica por periodo del día")
 
@@ -341,32 +463,35 @@ heatmap_config = {
 
 keys_list = ["soil_temperature", "soil_humidity", "soil_ec"]
 
+alcance_heatmap = st.radio(
+    "Alcance del heatmap", ["Dispositivo", "Flota"], horizontal=True, key="alcance_heatmap"
+)
+if alcance_heatmap == "Flota":
+    # Media de toda la flota: calculada una vez por snapshot de flota
+    pivots_heatmap = snap_flota.derived("pivots_flota", pivots_flota)
+else:
+    pivots_heatmap = kpis_dev["pivots"]
+
 for tab, key in zip(tabs, keys_list):
     with tab:
-        df_key = df[df["key"] == key]
-
-        if not df_key.empty:
-            df_agg = df_key.groupby(["Fecha", "Periodo_Dia"])["value"].mean().reset_index()
-            pivot = df_agg.pivot(index="Periodo_Dia", columns="Fecha", values="value")
+        pivot = pivots_heatmap.get(key)
 
+        if pivot is not None:
             label, cmap = heatmap_config[key]
 
-            fig_heat, ax_heat = plt.subplots(figsize=(14, 4))
-            sns.heatmap(pivot, annot=True, cmap=cmap, ax=ax_heat, cbar_kws={'label': 'Valor'})
-            ax_heat.set_title(f"Heatmap de {label} por Período del Día")
-            plt.tight_layout()
-            st.pyplot(fig_heat)
-            plt.close(fig_heat)
+            with span("render.heatmap", key=key, points=pivot.size, scope=alcance_heatmap):
+                fig_heat = figura_heatmap(pivot, label, cmap)
+                st.pyplot(fig_heat)
+                plt.close(fig_heat)
         else:
             st.info(f"No hay datos disponibles para {heatmap_config[key][0]}")
 
 # ===== TABLA DE DATOS =====
 st.subheader("📋 Datos Detallados")
 
-fechas_disponibles = sorted(df["Fecha"].unique(), reverse=True)
 selected_date = st.selectbox(
     "Seleccione una fecha:",
-    fechas_disponibles,
+    kpis_dev["fechas"],
     format_func=lambda x: x.strftime("%d-%m-%Y")
 )
 
@@ -376,122 +501,111 @@ st.dataframe(df_filtered, width="stretch")
 # ===== SECCIÓN DE BATERÍA =====
 st.subheader("🔋 Estado de Batería de Dispositivos")
 
-@st.cache_data(ttl=300)  # 5 minutos
-def cargar_bateria_dispositivos(device_ids, jwt_token):
-    url_thingsboard = st.secrets.get("THINGSBOARD_HOST", "https://tb.permaculturatech.com")
-    resultados = []
-    for did in device_ids:
-        info = get_last_battery(did, jwt_token, url_thingsboard)
-        if info:
-            resultados.append(info)
-    return pd.DataFrame(resultados) if resultados else pd.DataFrame()
-
-df_battery = cargar_bateria_dispositivos(device_ids, jwt_token)
-
-if not df_battery.empty:
-    now = pd.Timestamp.now()
-    df_battery["diff"] = now - df_battery["timestamp"]
-
-    def asignar_color(td):
-        if td >= pd.Timedelta(days=1):
-            return "red"
-        elif td >= pd.Timedelta(hours=12):
-            return "orange"
-        elif td >= pd.Timedelta(hours=1):
-            return "yellow"
-        else:
-            return "green"
+def _cargar_bateria(device_ids):
+    # Últimos valores de toda la flota en una petición por página de dispositivos
+    try:
+        df_ultimos = plan.ultimos_valores(["bateria"], device_ids)
+    except Exception as e:
+        # Solo loggear en el servidor, no mostrar warning al usuario
+        import logging
+        logging.warning(f"No se pudo obtener la batería de la flota: {e}")
+        return pd.DataFrame()
+    # El valor ya viene en porcentaje (0-100), no necesita conversión
+    return pd.DataFrame({
+        "device_id": df_ultimos["device_id"],
+        "timestamp": df_ultimos["fecha"],
+        "battery": df_ultimos["value"],
+    })
+
+def cargar_bateria_dispositivos(device_ids):
+    return snapshots.get(
+        ("bateria", hash(device_ids)),
+        lambda: _cargar_bateria(device_ids),
+        ttl=300  # 5 minutos
+    )
+
+snap_bateria = cargar_bateria_dispositivos(tuple(device_ids))
 
-    df_battery["color"] = df_battery["diff"].apply(asignar_color)
+if not snap_bateria.empty:
+    # Frescura calculada una vez por snapshot y minuto, compartida entre sesiones
+    now = pd.Timestamp.now().floor("min")
+    df_battery = snap_bateria.derived(
+        ("frescura", now), lambda d: frescura_bateria(d, now)
+    ).copy(deep=False)
     # Ya viene en porcentaje, no multiplicar por 100
     df_battery["Porcentaje de bateria"] = df_battery["battery"]
 
-    fig_battery, ax_battery = plt.subplots(figsize=(12, 5))
-    sns.swarmplot(
-        data=df_battery,
-        x="Porcentaje de bateria",
-        hue="color",
-        palette={
-            "red": "red",
-            "orange": "orange",
-            "yellow": "yellow",
-            "green": "green"
-        },
-        size=8,
-        ax=ax_battery
+    modo_bateria = st.radio(
+        "Vista de batería",
+        ["Distribución", "Puntos"],
+        index=0 if len(df_battery) > UMBRAL_SWARM else 1,
+        horizontal=True,
+        key="modo_bateria"
     )
-    ax_battery.set_title("Estado de Batería de Dispositivos")
-    ax_battery.set_xlabel("Porcentaje de Batería (%)")
-    plt.tight_layout()
-    st.pyplot(fig_battery)
-    plt.close(fig_battery)
-
-    device_id_to_name = {did: name for did, name in zip(device_ids, device_names)}
-    df_battery["nombre_dispositivo"] = df_battery["device_id"].map(device_id_to_name)
-    df_battery = df_battery.sort_values("battery", ascending=True)
-    # Ya está en porcentaje, solo redondear
-    df_battery["battery_display"] = df_battery["battery"].round()
 
-    st.dataframe(
-        df_battery[["nombre_dispositivo", "battery_display", "timestamp"]].rename(columns={
-            "nombre_dispositivo": "Dispositivo",
-            "battery_display": "Batería (%)",
-            "timestamp": "Última actualización"
-        }),
-        width="stretch"
-    )
+    with span("render.bateria", points=len(df_battery), mode=modo_bateria):
+        fig_battery = figura_bateria(
+            df_battery, "Porcentaje de bateria",
+            modo="puntos" if modo_bateria == "Puntos" else "distribucion"
+        )
+        st.pyplot(fig_battery)
+        plt.close(fig_battery)
+
+    # ── Tabla de batería baja (ordenable por columna) ──
+    umbral_bateria = st.slider("Umbral de batería baja (%)", 0, 100, 30, key="umbral_bateria")
+    df_baja = df_battery[df_battery["battery"] <= umbral_bateria].sort_values("battery", ascending=True)
+    st.caption(f"{len(df_baja)} de {len(df_battery)} dispositivos con batería ≤ {umbral_bateria}%")
+
+    if not df_baja.empty:
+        # Ya está en porcentaje, solo redondear
+        st.dataframe(
+            pd.DataFrame({
+                "Dispositivo": df_baja["device_id"].map(registro.label),
+                "Batería (%)": df_baja["battery"].round(),
+                "Último reporte": df_baja["frescura"],
+                "Última actualización": df_baja["timestamp"],
+            }),
+            width="stretch",
+            hide_index=True
+        )
 else:
     st.info("No hay datos de batería disponibles")
 
 # ===== ÍNDICE DE RIESGO DE BLOQUEO (PROMEDIO DE TODOS LOS DISPOSITIVOS) =====
 st.subheader("⚠️ Índice de Riesgo de Bloqueo Nutricional")
 
+# KPIs de flota: promedios de los acumuladores incrementales (una fila por key y día)
+kpis = kpis_desde_promedios(estadisticas.promedios(inicio, fin), ESQUEMAS["clasico"])
+
 if not df_all.empty:
-    valores_promedio = {}
-    for key in df_all["key"].unique():
-        df_key = df_all[df_all["key"] == key]
-        if not df_key.empty:
-            valor = float(df_key["value"].mean())
-            valores_promedio[key] = valor
-
-    if "soil_humidity" in valores_promedio and "soil_temperature" in valores_promedio and "soil_ec" in valores_promedio:
-        riesgo = riesgo_bloqueo(
-            hum=valores_promedio["soil_humidity"],
-            temp=valores_promedio["soil_temperature"],
-            ec=valores_promedio["soil_ec"]
-        )
+    valores_promedio = kpis["promedios"]
+    riesgo = kpis["riesgo"]
 
+    if riesgo is not None:
         col_riesgo_main, col_riesgo_details = st.columns([2, 1])
 
         with col_riesgo_main:
             R_score = riesgo['R_0_10']
-            if R_score < 3:
-                color_riesgo = '#2ecc71'
-                nivel = "🟩 Bajo"
-            elif R_score < 6:
-                color_riesgo = '#f39c12'
-                nivel = "🟨 Moderado"
-            else:
-                color_riesgo = '#e74c3c'
-                nivel = "🟥 Alto"
-
-            fig_riesgo, ax_riesgo = plt.subplots(figsize=(6, 4))
-
-            riesgos = ['Humedad', 'Temperatura', 'Conductividad']
-            valores_riesgo = [riesgo['H_risk'], riesgo['T_risk'], riesgo['EC_risk']]
-            colores = ['#3498db', '#e67e22', '#9b59b6']
-
-            ax_riesgo.barh(riesgos, valores_riesgo, color=colores)
-            ax_riesgo.set_xlim(0, 1)
-            ax_riesgo.set_xlabel('Nivel de Riesgo')
-            ax_riesgo.set_title('Componentes de Riesgo de Bloqueo')
-
-            for i, v in enumerate(valores_riesgo):
-                ax_riesgo.text(v + 0.02, i, f'{v:.2f}', va='center', fontweight='bold')
-
-            plt.tight_layout()
-            st.pyplot(fig_riesgo)
-            plt.close(fig_riesgo)
+            nivel, color_riesgo = nivel_riesgo(R_score)
+
+            with span("render.riesgo"):
+                fig_riesgo, ax_riesgo = plt.subplots(figsize=(6, 4))
+
+                riesgos = ['Humedad', 'Temperatura', 'Conductividad']
+                valores_riesgo = [riesgo['H_risk'], riesgo['T_risk'], riesgo['EC_risk']]
+                colores = ['#3498db', '#e67e22', '#9b59b6']
+
+                ax_riesgo.barh(riesgos, valores_riesgo, color=colores)
+                ax_riesgo.set_xlim(0, 1)
+                ax_riesgo.set_xlabel('Nivel de Riesgo')
+                ax_riesgo.set_title('Componentes de Riesgo de Bloqueo')
+
+                for i, v in enumerate(valores_riesgo):
+                    ax_riesgo.text(v + 0.02, i, f'{v:.2f}', va='center', fontweight='bold')
+
+                plt.tight_layout()
+                st.pyplot(fig_riesgo)
+                plt.close(fig_riesgo)
 
         with col_riesgo_details:
             st.metric("Riesgo General", f"{R_score}/10", delta=nivel)
@@ -506,43 +620,48 @@ if not df_all.empty:
 else:
     st.info("No se pudieron cargar datos de los dispositivos")
 
+# ===== RESUMEN POR ZONA =====
+st.subheader("🌱 Resumen por Zona")
+
+# Cubos de zona de las estadísticas incrementales: no se recorren históricos
+kpis_zonas = kpis_por_zona(estadisticas.promedios_zonas(inicio, fin), ESQUEMAS["clasico"])
+if kpis_zonas.empty:
+    st.info("Aún no hay datos agregados por zona para el rango elegido")
+else:
+    zonas_tabla = tabla_zonas(kpis_zonas, registro.zone_map(), registro.attributes(), motor_alertas.activas(), SIN_ZONA)
+    if zona != "Todas":
+        fila_zona = zonas_tabla[zonas_tabla["zona"] == zona]
+        if not fila_zona.empty:
+            fila_zona = fila_zona.iloc[0]
+            col_h, col_t, col_c, col_r = st.columns(4)
+            col_h.metric(f"Humedad media · {zona}", f"{fila_zona['humedad']:.1f} %")
+            col_t.metric("Temperatura media", f"{fila_zona['temperatura']:.1f} °C")
+            col_c.metric("CE media", f"{fila_zona['ce']:.2f} dS/m")
+            col_r.metric("Riesgo de bloqueo", f"{fila_zona['riesgo']}/10", delta=fila_zona["nivel"])
+    st.dataframe(
+        zonas_tabla.rename(columns={
+            "zona": "Zona", "dispositivos": "Dispositivos", "cultivo": "Cultivo",
+            "humedad": "Humedad (%)", "temperatura": "Temperatura (°C)", "ce": "CE (dS/m)",
+            "riesgo": "Riesgo (0-10)", "nivel": "Nivel", "Crítico": "🔴 Críticas", "Precaución": "🟡 Precaución",
+        })[["Zona", "Dispositivos", "Cultivo", "Humedad (%)", "Temperatura (°C)", "CE (dS/m)",
+            "Riesgo (0-10)", "Nivel", "🔴 Críticas", "🟡 Precaución"]],
+        hide_index=True,
+        width="stretch",
+        column_config={
+            "Humedad (%)": st.column_config.NumberColumn(format="%.1f"),
+            "Temperatura (°C)": st.column_config.NumberColumn(format="%.1f"),
+            "CE (dS/m)": st.column_config.NumberColumn(format="%.2f"),
+        }
+    )
+
 # ===== RECOMENDACIONES DE CONDUCTIVIDAD =====
 st.subheader("💡 Recomendaciones de Conductividad Eléctrica")
 
-def clasificar_ce(ce):
-    if ce < 1.0:
-        return "Bajo"
-    elif ce < 2.5:
-        return "Medio"
-    elif ce < 4.0:
-        return "Alto"
-    else:
-        return "Muy alto"
-
-def recomendacion_ce(categoria):
-    recomendaciones = {
-        "Bajo": "Suelo sano. Mantén riegos normales.",
-        "Medio": "Acumulación leve. Aumenta ligeramente el riego y revisa fertilización.",
-        "Alto": "Riesgo de estrés. Aplica riegos largos y evita fertilizantes salinos.",
-        "Muy alto": "Salinidad peligrosa. Realiza lavado de sales y revisa calidad del agua."
-    }
-    return recomendaciones[categoria]
-
-def color_ce(categoria):
-    colores = {
-        "Bajo": '#2ecc71',
-        "Medio": '#f39c12',
-        "Alto": '#e67e22',
-        "Muy alto": '#e74c3c'
-    }
-    return colores[categoria]
-
 # Obtener CE promedio de TODOS los dispositivos
-df_ce = df_all[df_all["key"] == "soil_ec"] if not df_all.empty else pd.DataFrame()
+ce_actual = kpis["ce_actual"]
 
-if not df_ce.empty:
-    ce_actual = float(df_ce["value"].mean())
-    categoria_ce = clasificar_ce(ce_actual)
+if ce_actual is not None:
+    categoria_ce = kpis["categoria_ce"]
     recom = recomendacion_ce(categoria_ce)
     color = color_ce(categoria_ce)
 
@@ -553,7 +672,7 @@ if not df_ce.empty:
         st.write(f"**Categoría:** {categoria_ce}")
         st.info(f"📌 {recom}")
 
-    with col_ce_visual:
+    with col_ce_visual, span("render.ce"):
         fig_ce, ax_ce = plt.subplots(figsize=(6, 4))
 
         rangos = [(0, 1.0), (1.0, 2.5), (2.5, 4.0), (4.0, 5.0)]
@@ -577,3 +696,6 @@ if not df_ce.empty:
         plt.close(fig_ce)
 else:
     st.info("No hay datos de conductividad disponibles")
+
+# ===== PANEL DE DEPURACIÓN =====
+render_debug_panel()
@@ -1,10 +1,25 @@
 import streamlit as st
 import pandas as pd
-import seaborn as sns
 import matplotlib.pyplot as plt
-import requests
-from concurrent.futures import ThreadPoolExecutor
-from data_queries import init_connection, list_all_tenant_devices, get_device_data
+from data_queries import init_connection, CACHE_MAX_MB
+from device_registry import DeviceRegistry, SIN_ZONA
+from snapshots import SnapshotStore
+from segmentos import SegmentCache, ventana_desde_fechas
+from planificador import PlanDescargas
+from deltas import DeltaBus
+from anomalias import DetectorAnomalias
+from alertas import MotorAlertas
+from estadisticas import EstadisticasFlota
+from pronostico import Pronosticador
+from instrumentation import span, render_debug_panel, register_collector, register_debug_view
+from presupuesto import PresupuestoMemoria, MB
+from features import agregar_columnas_temporales
+from kpis import (
+    nivel_riesgo, recomendacion_ce,
+    kpis_desde_promedios, kpis_dispositivo, kpis_por_zona, tabla_zonas, pivots_flota, frescura_bateria,
+)
+from sensores import ESQUEMAS, RANGOS, MAGNITUDES_HISTORICO
+from charts import figura_historico, figura_heatmap, figura_bateria, ANCHO_HISTORICO_PX, UMBRAL_SWARM
 
 st.set_page_config(
     page_title="Dashboard Permacultura Tech",
@@ -14,8 +29,6 @@ st.set_page_config(
 
 st.title("📊 Dashboard Permacultura Tech")
 
-TB_URL = st.secrets["TB_URL"]  # centralizado aquí
-
 # ===== CONSTANTES (fuera del flujo de render) =====
 KEY_MAPPING = {
     "temperature": "Temperatura del suelo",
@@ -23,32 +36,25 @@ KEY_MAPPING = {
     "soil_conductivity": "Conductividad aparente"
 }
 
+# Rangos del semáforo: los mismos que evalúa el motor de alertas
 PARAMETROS = {
     "humidity": {
         "label": "Humedad Volumétrica del Suelo (VWC %)",
         "unit": "%",
-        "verde": (25, 40),
-        "amarillo": [(18, 24), (41, 45)],
-        "rojo": [(0, 18), (45, 100)]
+        **RANGOS["humedad"]
     },
     "temperature": {
         "label": "Temperatura del Suelo",
         "unit": "°C",
-        "verde": (18, 28),
-        "amarillo": [(12, 17), (29, 32)],
-        "rojo": [(0, 12), (32, 100)]
+        **RANGOS["temperatura"]
     },
     "soil_conductivity": {
         "label": "Conductividad Eléctrica (CE aparente)",
         "unit": "dS/m",
-        "verde": (0.2, 1.2),
-        "amarillo": [(1.3, 2.0)],
-        "rojo": [(2.0, 4.0), (4.0, 100)]
+        **RANGOS["ce"]
     }
 }
 
-ORDEN_PERIODOS = ["Mañana", "Tarde", "Noche"]
-
 # ===== CONEXIÓN: JWT en session_state, no como argumento cacheado =====
 if "jwt_token" not in st.session_state:
     try:
@@ -61,13 +67,6 @@ if "jwt_token" not in st.session_state:
 jwt_token = st.session_state["jwt_token"]
 
 # ===== FUNCIONES PURAS (sin jwt_token como argumento cacheado) =====
-def clasificar_periodo(hora):
-    if 6 <= hora < 12:
-        return "Mañana"
-    elif 12 <= hora < 18:
-        return "Tarde"
-    return "Noche"
-
 def determinar_estado(valor, key):
     config = PARAMETROS.get(key, {})
     verde_min, verde_max = config.get("verde", (0, 0))
@@ -81,109 +80,141 @@ def determinar_estado(valor, key):
             return "Crítico", "#e74c3c"
     return "Desconocido", "#95a5a6"
 
-def clamp(x, a=0.0, b=1.0):
-    return max(a, min(b, x))
+# ===== CARGA DE DISPOSITIVOS =====
+@st.cache_resource
+def obtener_registro():
+    """Registro de dispositivos compartido por todas las sesiones."""
+    return DeviceRegistry()
 
-def riesgo_bloqueo(hum, temp, ec, w_h=0.35, w_t=0.15, w_e=0.50, t_low=15, t_high=25):
-    H_risk = clamp((100.0 - hum) / 100.0)
-    if t_low <= temp <= t_high:
-        T_risk = 0.0
-    elif temp > t_high:
-        T_risk = clamp((temp - t_high) / 15.0)
-    else:
-        T_risk = clamp((t_low - temp) / 15.0)
-    EC_risk = clamp((ec - 1.0) / (4.0 - 1.0))
-    R_raw = w_h * H_risk + w_t * T_risk + w_e * EC_risk
-    return {"H_risk": H_risk, "T_risk": T_risk, "EC_risk": EC_risk, "R_raw": R_raw, "R_0_10": round(R_raw * 10.0, 1)}
-
-def clasificar_ce(ce):
-    if ce < 1.0: return "Bajo"
-    elif ce < 2.5: return "Medio"
-    elif ce < 4.0: return "Alto"
-    return "Muy alto"
-
-def recomendacion_ce(cat):
-    return {
-        "Bajo": "Suelo sano. Mantén riegos normales.",
-        "Medio": "Acumulación leve. Aumenta ligeramente el riego y revisa fertilización.",
-        "Alto": "Riesgo de estrés. Aplica riegos largos y evita fertilizantes salinos.",
-        "Muy alto": "Salinidad peligrosa. Realiza lavado de sales y revisa calidad del agua."
-    }[cat]
-
-def color_ce(cat):
-    return {"Bajo": "#2ecc71", "Medio": "#f39c12", "Alto": "#e67e22", "Muy alto": "#e74c3c"}[cat]
+registro = obtener_registro()
+registro.refresh(st.session_state["jwt_token"])
+device_ids = registro.ids
 
-# ===== CARGA DE DISPOSITIVOS =====
-@st.cache_data(ttl=3600)
-def cargar_dispositivos():
-    return list_all_tenant_devices(st.session_state["jwt_token"])
+if not device_ids:
+    st.warning("No se encontraron dispositivos en el tenant")
+    st.stop()
 
-dispositivos = cargar_dispositivos()
-device_names = [d.get("name", "N/A") for d in dispositivos]
-device_ids = [d.get("id", {}).get("id") for d in dispositivos]
+opciones_dispositivos = device_ids
+perfiles = registro.profiles()
+if len(perfiles) > 1:
+    perfil = st.sidebar.selectbox("Perfil de dispositivo", ["Todos"] + perfiles)
+    if perfil != "Todos":
+        opciones_dispositivos = registro.ids_by_profile(perfil)
+zonas = registro.zones()
+zona = st.sidebar.selectbox("🌱 Zona", ["Todas"] + zonas) if zonas else "Todas"
+if zona != "Todas":
+    en_zona = set(registro.ids_by_zone(zona))
+    opciones_dispositivos = [did for did in opciones_dispositivos if did in en_zona]
+
+if not opciones_dispositivos:
+    st.warning("No hay dispositivos con el perfil y la zona elegidos")
+    st.stop()
 
-selected_device = st.selectbox("📱 Selecciona un dispositivo", device_names)
-selected_id = device_ids[device_names.index(selected_device)]
-DIAS = 60
+selected_id = st.selectbox("📱 Selecciona un dispositivo", opciones_dispositivos, format_func=registro.label)
+
+# ===== RANGO DE FECHAS (días UTC, ambos incluidos) =====
+hoy = pd.Timestamp.now(tz="UTC").date()
+rango = st.sidebar.date_input("📅 Rango de fechas", value=(hoy - pd.Timedelta(days=59), hoy), max_value=hoy)
+# Mientras se elige la fecha final, el widget retorna una sola fecha
+INICIO, FIN = ventana_desde_fechas(rango[0], rango[-1]) if rango else ventana_desde_fechas(hoy, hoy)
+
+# ===== CARGA DE DATOS: snapshots compartidos, device_id como clave (no jwt) =====
+@st.cache_resource
+def obtener_presupuesto():
+    """Presupuesto de memoria del proceso para snapshots, KPIs derivados y segmentos."""
+    presupuesto = PresupuestoMemoria(int(CACHE_MAX_MB * MB))
+    register_collector(presupuesto.metricas)
+    register_debug_view("🧠 Cachés", presupuesto.resumen)
+    register_debug_view("📦 Entradas más grandes", presupuesto.entradas)
+    register_debug_view("🗑️ Expulsiones recientes", presupuesto.expulsiones)
+    return presupuesto
+
+@st.cache_resource
+def obtener_snapshots():
+    return SnapshotStore(presupuesto=obtener_presupuesto())
+
+@st.cache_resource
+def obtener_deltas():
+    """
+    Bus de deltas con sus consumidores incrementales: detector de anomalías,
+    alertas y pronóstico (cada punto una sola vez) y estadísticas de flota
+    (históricas).
+    """
+    bus = DeltaBus()
+    detector = DetectorAnomalias()
+    motor = MotorAlertas()
+    estadisticas = EstadisticasFlota()
+    pronosticador = Pronosticador()
+    bus.subscribe(detector.procesar)
+    bus.subscribe(motor.procesar)
+    bus.subscribe(pronosticador.procesar)
+    bus.subscribe(estadisticas.procesar, historico=True)
+    for componente in (bus, detector, motor, estadisticas, pronosticador):
+        register_collector(componente.metricas)
+    return bus, detector, motor, estadisticas, pronosticador
+
+@st.cache_resource
+def obtener_segmentos():
+    """Telemetría por día UTC: rangos que se solapan reutilizan los días ya descargados."""
+    return SegmentCache(bus=obtener_deltas()[0], presupuesto=obtener_presupuesto())
+
+snapshots = obtener_snapshots()
+bus_deltas, detector, motor_alertas, estadisticas, pronosticador = obtener_deltas()
+segmentos = obtener_segmentos()
+# Los cubos de zona siguen a los atributos del registro (se reconstruyen solo si cambian)
+estadisticas.asignar_zonas(registro.zone_map())
+
+# ===== PLAN DE DESCARGAS: keys del esquema nuevo, mínimo de peticiones por página =====
+plan = PlanDescargas(ESQUEMAS["nuevo"], segmentos, st.session_state["jwt_token"])
+plan.ventana(device_ids, MAGNITUDES_HISTORICO, INICIO, FIN)
+plan.ultimos(device_ids, ["bateria"])
 
-# ===== CARGA DE DATOS: device_id como único argumento (no jwt) =====
-@st.cache_data(ttl=1800)
 def cargar_datos_dispositivo(device_id):
-    return get_device_data(device_id, st.session_state["jwt_token"], days_back=DIAS)
+    return snapshots.get(
+        ("dispositivo", device_id, INICIO, FIN),
+        lambda: plan.telemetria(device_id),
+        ttl=1800,
+        derive=agregar_columnas_temporales
+    )
 
-@st.cache_data(ttl=1800)
-def cargar_datos_todos(ids_tuple):  # tuple para que sea hasheable
+def _cargar_flota(ids_tuple):
+    # Con TB_PARSE_PROCESSES, descarga en paralelo y decodifica en un pool de procesos
+    plan.precargar(ids_tuple)
     frames = []
     for did in ids_tuple:
         try:
-            df_dev = get_device_data(did, st.session_state["jwt_token"], days_back=DIAS)
+            df_dev = plan.telemetria(did)
             frames.append(df_dev)
         except Exception as e:
             st.warning(f"No se pudieron cargar datos del dispositivo {did}: {e}")
     return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
 
-df = cargar_datos_dispositivo(selected_id)
+def cargar_datos_todos(ids_tuple):
+    return snapshots.get(("flota", hash(ids_tuple), INICIO, FIN), lambda: _cargar_flota(ids_tuple), ttl=1800)
+
+snap_dispositivo = cargar_datos_dispositivo(selected_id)
+df = snap_dispositivo.view()
 if df.empty:
     st.warning("No hay datos disponibles para este dispositivo")
     st.stop()
 
-df_all = cargar_datos_todos(tuple(device_ids))  # tuple = hasheable por cache
+snap_flota = cargar_datos_todos(tuple(device_ids))
+df_all = snap_flota.view()
 
-# ===== INGENIERÍA DE CARACTERÍSTICAS =====
-df["Fecha"] = df["fecha"].dt.date
-df["Hora_del_Dia"] = df["fecha"].dt.hour
-df["Periodo_Dia"] = pd.Categorical(
-    df["Hora_del_Dia"].apply(clasificar_periodo),
-    categories=ORDEN_PERIODOS,
-    ordered=True
-)
-
-# ===== BATERÍA: peticiones en paralelo con ThreadPoolExecutor =====
-def _fetch_battery_single(device_id):
-    """Petición individual de batería — se llama en threads paralelos."""
-    url = f"{TB_URL}/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries?keys=battery&limit=1"
-    headers = {"X-Authorization": f"Bearer {jwt_token}"}
+# ===== BATERÍA: últimos valores de la flota en una petición por página =====
+def _cargar_bateria(ids_tuple):
     try:
-        r = requests.get(url, headers=headers, timeout=5)
-        data = r.json()
-        if "battery" not in data:
-            return None
-        entry = data["battery"][0]
-        return {
-            "device_id": device_id,
-            "timestamp": pd.to_datetime(entry["ts"], unit="ms"),
-            "battery": float(entry["value"])
-        }
-    except Exception as e:
-        return None  # fallo silencioso por dispositivo individual
-
-@st.cache_data(ttl=1800)
-def cargar_bateria_paralelo(ids_tuple):
-    """Lanza todas las peticiones de batería en paralelo."""
-    with ThreadPoolExecutor(max_workers=min(len(ids_tuple), 10)) as executor:
-        results = list(executor.map(_fetch_battery_single, ids_tuple))
-    validos = [r for r in results if r is not None]
-    return pd.DataFrame(validos) if validos else pd.DataFrame()
+        df_ultimos = plan.ultimos_valores(["bateria"], ids_tuple)
+    except Exception:
+        return pd.DataFrame()  # sin batería: la sección muestra el aviso
+    return pd.DataFrame({
+        "device_id": df_ultimos["device_id"],
+        "timestamp": df_ultimos["fecha"],
+        "battery": df_ultimos["value"],
+    })
+
+def cargar_bateria(ids_tuple):
+    return snapshots.get(("bateria", hash(ids_tuple)), lambda: _cargar_bateria(ids_tuple), ttl=1800)
 
 # ===== SEMÁFORO: CSS puro en lugar de matplotlib =====
 def render_semaforo_css(estado_text, color_hex):
@@ -204,26 +235,23 @@ def render_semaforo_css(estado_text, color_hex):
 # ===== SECCIÓN: ESTADO DE SENSORES =====
 st.subheader("🎯 Estado de Sensores")
 
+# KPIs del dispositivo: calculados una vez por snapshot y compartidos entre sesiones
+kpis_dev = snap_dispositivo.derived("kpis_dispositivo", kpis_dispositivo)
+
 st.write("**Valores:**")
 value_cols = st.columns(3)
-for idx, key in enumerate(df["key"].unique()):
-    df_key = df[df["key"] == key]
-    if not df_key.empty:
-        valor = float(df_key.sort_values("fecha", ascending=False).iloc[0]["value"])
-        unit = PARAMETROS.get(key, {}).get("unit", "")
-        label = PARAMETROS.get(key, {}).get("label", key).split("(")[0].strip()
-        with value_cols[idx]:
-            st.metric(label, f"{valor:.2f} {unit}")
+for idx, (key, valor) in enumerate(kpis_dev["ultimos"].items()):
+    unit = PARAMETROS.get(key, {}).get("unit", "")
+    label = PARAMETROS.get(key, {}).get("label", key).split("(")[0].strip()
+    with value_cols[idx]:
+        st.metric(label, f"{valor:.2f} {unit}")
 
 st.write("**Indicadores:**")
 circles = st.columns(3)
-for idx, key in enumerate(df["key"].unique()):
-    df_key = df[df["key"] == key]
-    if not df_key.empty:
-        valor = float(df_key.sort_values("fecha", ascending=False).iloc[0]["value"])
-        estado_text, color = determinar_estado(valor, key)
-        with circles[idx]:
-            st.markdown(render_semaforo_css(estado_text, color), unsafe_allow_html=True)
+for idx, (key, valor) in enumerate(kpis_dev["ultimos"].items()):
+    estado_text, color = determinar_estado(valor, key)
+    with circles[idx]:
+        st.markdown(render_semaforo_css(estado_text, color), unsafe_allow_html=True)
 
 # ===== SECCIÓN: PARÁMETROS DE REFERENCIA =====
 st.subheader("📋 Parámetros de Referencia")
@@ -240,30 +268,118 @@ with col3:
 
 # ===== SECCIÓN: MÉTRICAS HISTÓRICAS =====
 st.subheader("📊 Métricas Históricas")
-df_sorted = df.sort_values("fecha")
 tabs = st.tabs(["Temperatura", "Humedad", "Conductividad"])
 historico_config = {
     "temperature": ("Temperatura Histórica", "°C", "tomato"),
     "humidity": ("Humedad Histórica", "Valor", "steelblue"),
     "soil_conductivity": ("Conductividad Histórica", "Valor", "green")
 }
+# Anomalías del detector en línea para el dispositivo y la ventana elegidos
+anomalias_dev = detector.anomalias(selected_id, desde=INICIO, hasta=FIN)
+# Pronóstico de las próximas 24 h: solo si la ventana llega hasta los últimos datos
+pronostico_dev = pronosticador.pronosticar(selected_id, horizonte=24)
+if not pronostico_dev.empty:
+    pronostico_dev = pronostico_dev[pronostico_dev.groupby("key")["fecha"].transform("min") < FIN]
 for tab, key in zip(tabs, ["temperature", "humidity", "soil_conductivity"]):
     with tab:
-        df_key = df_sorted[df_sorted["key"] == key]
+        # Nivel de la pirámide según la ventana y el ancho del gráfico
+        df_key = kpis_dev["piramide"].consultar(key, INICIO, FIN, ancho_px=ANCHO_HISTORICO_PX)
         if not df_key.empty:
             title, ylabel, color = historico_config[key]
-            fig, ax = plt.subplots(figsize=(12, 5))
-            ax.plot(df_key["fecha"], df_key["value"], color=color, linewidth=2)
-            ax.set_title(title)
-            ax.set_xlabel("Fecha")
-            ax.set_ylabel(ylabel)
-            plt.xticks(rotation=45)
-            plt.tight_layout()
-            st.pyplot(fig)
-            plt.close(fig)
+            with span("render.historico", key=key, points=len(df_key), nivel=df_key.attrs.get("nivel")):
+                fig = figura_historico(df_key, title, ylabel, color, anomalias=anomalias_dev[anomalias_dev["key"] == key],
+                                       pronostico=pronostico_dev[pronostico_dev["key"] == key])
+                st.pyplot(fig)
+                plt.close(fig)
         else:
             st.info("No hay datos disponibles")
 
+# ===== SECCIÓN: ANOMALÍAS =====
+st.subheader("🚨 Anomalías Detectadas")
+anomalias_flota = detector.anomalias(desde=pd.Timestamp.now(tz="UTC").tz_localize(None) - pd.Timedelta(days=1))
+col_dev, col_flota = st.columns(2)
+col_dev.metric("En este dispositivo (rango elegido)", len(anomalias_dev))
+col_flota.metric("En la flota (últimas 24 h)", len(anomalias_flota))
+if anomalias_dev.empty:
+    st.info("Sin anomalías en este dispositivo para el rango elegido")
+else:
+    st.dataframe(
+        anomalias_dev.sort_values("fecha", ascending=False).head(20).assign(
+            key=lambda d: d["key"].map(lambda k: historico_config[k][0].replace(" Histórica", "") if k in historico_config else k)
+        )[["fecha", "key", "value", "z", "z_robusto"]].rename(columns={
+            "fecha": "Fecha", "key": "Métrica", "value": "Valor", "z": "z EWMA", "z_robusto": "z robusto"
+        }),
+        hide_index=True,
+        width="stretch"
+    )
+
+# ===== SECCIÓN: ALERTAS =====
+st.subheader("🔔 Alertas")
+# Estado del motor de alertas: no descarga ni recorre telemetría cruda
+resumen_alertas = motor_alertas.resumen()
+col_crit, col_prec, col_ok = st.columns(3)
+col_crit.metric("🔴 Series en estado crítico", resumen_alertas["Crítico"])
+col_prec.metric("🟡 Series en precaución", resumen_alertas["Precaución"])
+col_ok.metric("🟢 Series óptimas", resumen_alertas["Óptimo"])
+
+activas = motor_alertas.activas()
+col_activas, col_historial = st.columns(2)
+with col_activas:
+    st.markdown("**Alertas activas en la flota**")
+    if activas.empty:
+        st.info("Sin alertas activas")
+    else:
+        st.dataframe(
+            activas.head(50).assign(
+                device_id=lambda d: d["device_id"].map(registro.label),
+                nivel=lambda d: d["nivel"].astype(str)
+            )[["device_id", "magnitud", "nivel", "desde", "ultimo_valor"]].rename(columns={
+                "device_id": "Dispositivo", "magnitud": "Magnitud", "nivel": "Nivel",
+                "desde": "Desde", "ultimo_valor": "Último valor"
+            }),
+            hide_index=True,
+            width="stretch"
+        )
+with col_historial:
+    st.markdown("**Cambios de estado de este dispositivo**")
+    transiciones_dev = motor_alertas.transiciones(selected_id)
+    if transiciones_dev.empty:
+        st.info("Sin cambios de estado registrados")
+    else:
+        st.dataframe(
+            transiciones_dev.head(20).assign(
+                key=lambda d: d["key"].map(KEY_MAPPING).fillna(d["key"])
+            )[["fecha", "key", "anterior", "nuevo", "valor"]].rename(columns={
+                "fecha": "Fecha", "key": "Métrica", "anterior": "Antes", "nuevo": "Después", "valor": "Valor"
+            }),
+            hide_index=True,
+            width="stretch"
+        )
+
+# ===== SECCIÓN: NECESIDADES HÍDRICAS PREVISTAS =====
+st.subheader("💧 Necesidades Hídricas Previstas (24 h)")
+# Pronóstico de toda la flota en una pasada, desde el estado de los modelos
+extremos_humedad = pronosticador.extremos("humedad", horizonte=24)
+umbral_riego = RANGOS["humedad"]["verde"][0]
+if extremos_humedad.empty:
+    st.info("Aún no hay historia horaria suficiente para pronosticar (mínimo 48 h por dispositivo)")
+else:
+    riego = extremos_humedad[extremos_humedad["minimo"] < umbral_riego].sort_values("minimo")
+    col_riego, col_modelos = st.columns(2)
+    col_riego.metric(f"Bajarán de {umbral_riego}% en las próximas 24 h", len(riego))
+    col_modelos.metric("Dispositivos con pronóstico", len(extremos_humedad))
+    if not riego.empty:
+        st.dataframe(
+            pd.DataFrame({
+                "Dispositivo": riego["device_id"].map(registro.label),
+                "Humedad actual (%)": riego["actual"].round(1),
+                "Mínimo previsto (%)": riego["minimo"].round(1),
+                "Hora del mínimo": riego["hora_minimo"],
+            }).head(50),
+            hide_index=True,
+            width="stretch"
+        )
+
 # ===== SECCIÓN: HEATMAPS =====
 st.subheader("🕒 Variación de métrica por periodo del día")
 tabs = st.tabs(["Temperatura", "Humedad", "Conductividad"])
@@ -272,97 +388,75 @@ heatmap_config = {
     "humidity": ("Contenido Volumétrico", "mako"),
     "soil_conductivity": ("Conductividad aparente", "rocket_r")
 }
+alcance_heatmap = st.radio("Alcance del heatmap", ["Dispositivo", "Flota"], horizontal=True, key="alcance_heatmap")
+# La versión de flota se calcula una vez por snapshot de flota
+pivots_heatmap = snap_flota.derived("pivots_flota", pivots_flota) if alcance_heatmap == "Flota" else kpis_dev["pivots"]
 for tab, key in zip(tabs, ["temperature", "humidity", "soil_conductivity"]):
     with tab:
-        df_key = df[df["key"] == key]
-        if not df_key.empty:
-            df_agg = df_key.groupby(["Fecha", "Periodo_Dia"])["value"].mean().reset_index()
-            pivot = df_agg.pivot(index="Periodo_Dia", columns="Fecha", values="value")
+        pivot = pivots_heatmap.get(key)
+        if pivot is not None:
             label, cmap = heatmap_config[key]
-            fig_heat, ax_heat = plt.subplots(figsize=(14, 4))
-            sns.heatmap(pivot, annot=True, cmap=cmap, ax=ax_heat, cbar_kws={"label": "Valor"})
-            ax_heat.set_title(f"Heatmap de {label} por Período del Día")
-            plt.tight_layout()
-            st.pyplot(fig_heat)
-            plt.close(fig_heat)
+            with span("render.heatmap", key=key, points=pivot.size, scope=alcance_heatmap):
+                fig_heat = figura_heatmap(pivot, label, cmap)
+                st.pyplot(fig_heat)
+                plt.close(fig_heat)
         else:
             st.info(f"No hay datos disponibles para {heatmap_config[key][0]}")
 
 # ===== SECCIÓN: TABLA DE DATOS =====
 st.subheader("📋 Datos Detallados")
-fechas_disponibles = sorted(df["Fecha"].unique(), reverse=True)
-selected_date = st.selectbox("Seleccione una fecha:", fechas_disponibles, format_func=lambda x: x.strftime("%d-%m-%Y"))
+selected_date = st.selectbox("Seleccione una fecha:", kpis_dev["fechas"], format_func=lambda x: x.strftime("%d-%m-%Y"))
 df_filtered = df[df["Fecha"] == selected_date][["fecha", "key", "value"]].sort_values("fecha")
-st.dataframe(df_filtered, use_container_width=True)
+st.dataframe(df_filtered, width="stretch")
 
 # ===== SECCIÓN: BATERÍA (paralelo) =====
 st.subheader("🔋 Estado de Batería de Dispositivos")
-df_battery = cargar_bateria_paralelo(tuple(device_ids))
-
-if not df_battery.empty:
-    now = pd.Timestamp.now()
-    df_battery["diff"] = now - df_battery["timestamp"]
-
-    def asignar_color(td):
-        if td >= pd.Timedelta(days=1): return "red"
-        elif td >= pd.Timedelta(hours=12): return "orange"
-        elif td >= pd.Timedelta(hours=1): return "yellow"
-        return "green"
+snap_bateria = cargar_bateria(tuple(device_ids))
 
-    df_battery["color"] = df_battery["diff"].apply(asignar_color)
+if not snap_bateria.empty:
+    # Frescura calculada una vez por snapshot y minuto, compartida entre sesiones
+    now = pd.Timestamp.now().floor("min")
+    df_battery = snap_bateria.derived(("frescura", now), lambda d: frescura_bateria(d, now)).copy(deep=False)
     df_battery["Porcentaje de bateria"] = df_battery["battery"] * 100
 
-    fig_battery, ax_battery = plt.subplots(figsize=(12, 5))
-    sns.swarmplot(
-        data=df_battery,
-        x="Porcentaje de bateria",
-        hue="color",
-        palette={"red": "red", "orange": "orange", "yellow": "yellow", "green": "green"},
-        size=8,
-        ax=ax_battery
-    )
-    ax_battery.set_title("Estado de Batería de Dispositivos")
-    ax_battery.set_xlabel("Porcentaje de Batería (%)")
-    plt.tight_layout()
-    st.pyplot(fig_battery)
-    plt.close(fig_battery)
-
-    device_id_to_name = dict(zip(device_ids, device_names))
-    df_battery["nombre_dispositivo"] = df_battery["device_id"].map(device_id_to_name)
-    df_battery = df_battery.sort_values("battery", ascending=True)
-    df_battery["battery"] = (df_battery["battery"] * 100).round()
-
-    st.dataframe(
-        df_battery[["nombre_dispositivo", "battery", "timestamp"]].rename(columns={
-            "nombre_dispositivo": "Dispositivo",
-            "battery": "Batería",
-            "timestamp": "Última actualización"
-        }),
-        use_container_width=True
-    )
+    modo_bateria = st.radio("Vista de batería", ["Distribución", "Puntos"],
+                            index=0 if len(df_battery) > UMBRAL_SWARM else 1, horizontal=True, key="modo_bateria")
+    with span("render.bateria", points=len(df_battery), mode=modo_bateria):
+        fig_battery = figura_bateria(df_battery, "Porcentaje de bateria",
+                                     modo="puntos" if modo_bateria == "Puntos" else "distribucion")
+        st.pyplot(fig_battery)
+        plt.close(fig_battery)
+
+    # Tabla de batería baja, ordenable por columna
+    umbral_bateria = st.slider("Umbral de batería baja (%)", 0, 100, 30, key="umbral_bateria")
+    df_baja = df_battery[df_battery["Porcentaje de bateria"] <= umbral_bateria].sort_values("battery")
+    st.caption(f"{len(df_baja)} de {len(df_battery)} dispositivos con batería ≤ {umbral_bateria}%")
+    if not df_baja.empty:
+        st.dataframe(pd.DataFrame({
+            "Dispositivo": df_baja["device_id"].map(registro.label),
+            "Batería": df_baja["Porcentaje de bateria"].round(),
+            "Último reporte": df_baja["frescura"],
+            "Última actualización": df_baja["timestamp"],
+        }), width="stretch", hide_index=True)
 else:
     st.info("No hay datos de batería disponibles")
 
 # ===== SECCIÓN: ÍNDICE DE RIESGO =====
 st.subheader("⚠️ Índice de Riesgo de Bloqueo Nutricional")
 
+# KPIs de flota: promedios de los acumuladores incrementales (una fila por key y día)
+kpis = kpis_desde_promedios(estadisticas.promedios(INICIO, FIN), ESQUEMAS["nuevo"])
+
 if not df_all.empty:
-    valores_promedio = {
-        key: float(df_all[df_all["key"] == key]["value"].mean())
-        for key in df_all["key"].unique()
-    }
+    valores_promedio = kpis["promedios"]
+    riesgo = kpis["riesgo"]
 
-    if all(k in valores_promedio for k in ("humidity", "temperature", "soil_conductivity")):
-        riesgo = riesgo_bloqueo(
-            hum=valores_promedio["humidity"],
-            temp=valores_promedio["temperature"],
-            ec=valores_promedio["soil_conductivity"]
-        )
+    if riesgo is not None:
         R_score = riesgo["R_0_10"]
-        nivel = "🟩 Bajo" if R_score < 3 else ("🟨 Moderado" if R_score < 6 else "🟥 Alto")
+        nivel, _ = nivel_riesgo(R_score)
 
         col_main, col_details = st.columns([2, 1])
-        with col_main:
+        with col_main, span("render.riesgo"):
             fig_r, ax_r = plt.subplots(figsize=(6, 4))
             riesgos = ["Humedad", "Temperatura", "Conductividad"]
             valores_r = [riesgo["H_risk"], riesgo["T_risk"], riesgo["EC_risk"]]
@@ -389,13 +483,45 @@ if not df_all.empty:
 else:
     st.info("No se pudieron cargar datos de los dispositivos")
 
+# ===== SECCIÓN: RESUMEN POR ZONA =====
+st.subheader("🌱 Resumen por Zona")
+
+# Cubos de zona de las estadísticas incrementales: no se recorren históricos
+kpis_zonas = kpis_por_zona(estadisticas.promedios_zonas(INICIO, FIN), ESQUEMAS["nuevo"])
+if kpis_zonas.empty:
+    st.info("Aún no hay datos agregados por zona para el rango elegido")
+else:
+    zonas_tabla = tabla_zonas(kpis_zonas, registro.zone_map(), registro.attributes(), motor_alertas.activas(), SIN_ZONA)
+    if zona != "Todas":
+        fila_zona = zonas_tabla[zonas_tabla["zona"] == zona]
+        if not fila_zona.empty:
+            fila_zona = fila_zona.iloc[0]
+            col_h, col_t, col_c, col_r = st.columns(4)
+            col_h.metric(f"Humedad media · {zona}", f"{fila_zona['humedad']:.1f} %")
+            col_t.metric("Temperatura media", f"{fila_zona['temperatura']:.1f} °C")
+            col_c.metric("CE media", f"{fila_zona['ce']:.2f} dS/m")
+            col_r.metric("Riesgo de bloqueo", f"{fila_zona['riesgo']}/10", delta=fila_zona["nivel"])
+    st.dataframe(
+        zonas_tabla.rename(columns={
+            "zona": "Zona", "dispositivos": "Dispositivos", "cultivo": "Cultivo",
+            "humedad": "Humedad (%)", "temperatura": "Temperatura (°C)", "ce": "CE (dS/m)",
+            "riesgo": "Riesgo (0-10)", "nivel": "Nivel", "Crítico": "🔴 Críticas", "Precaución": "🟡 Precaución",
+        })[["Zona", "Dispositivos", "Cultivo", "Humedad (%)", "Temperatura (°C)", "CE (dS/m)",
+            "Riesgo (0-10)", "Nivel", "🔴 Críticas", "🟡 Precaución"]],
+        hide_index=True, width="stretch",
+        column_config={
+            "Humedad (%)": st.column_config.NumberColumn(format="%.1f"),
+            "Temperatura (°C)": st.column_config.NumberColumn(format="%.1f"),
+            "CE (dS/m)": st.column_config.NumberColumn(format="%.2f"),
+        }
+    )
+
 # ===== SECCIÓN: RECOMENDACIONES CE =====
 st.subheader("💡 Recomendaciones de Conductividad Eléctrica")
-df_ce = df_all[df_all["key"] == "soil_conductivity"] if not df_all.empty else pd.DataFrame()
+ce_actual = kpis["ce_actual"]
 
-if not df_ce.empty:
-    ce_actual = float(df_ce["value"].mean())
-    cat_ce = clasificar_ce(ce_actual)
+if ce_actual is not None:
+    cat_ce = kpis["categoria_ce"]
     col_info, col_visual = st.columns([1, 1])
 
     with col_info:
@@ -403,7 +529,7 @@ if not df_ce.empty:
         st.write(f"**Categoría:** {cat_ce}")
         st.info(f"📌 {recomendacion_ce(cat_ce)}")
 
-    with col_visual:
+    with col_visual, span("render.ce"):
         fig_ce, ax_ce = plt.subplots(figsize=(6, 4))
         rangos = [(0, 1.0), (1.0, 2.5), (2.5, 4.0), (4.0, 5.0)]
         categorias = ["Bajo\n(<1.0)", "Medio\n(1.0-2.5)", "Alto\n(2.5-4.0)", "Muy alto\n(>4.0)"]
@@ -422,3 +548,6 @@ if not df_ce.empty:
         plt.close(fig_ce)
 else:
     st.info("No hay datos de conductividad disponibles")
+
+# ===== PANEL DE DEPURACIÓN =====
+render_debug_panel()
@@ -1,8 +1,15 @@
 from datetime import datetime, timedelta
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import requests
 import pandas as pd
 import logging
 import streamlit as st
+from instrumentation import span, register_collector, start_metrics_server
+from telemetry_stream import decode_stream, arrays_to_dataframe
+from resiliencia import ClienteTB, LimitadorAIMD
+from casete import Casete
 
 # Configuración de logging
 logging.basicConfig(
@@ -10,18 +17,76 @@ logging.basicConfig(
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 
-# Configuración desde Streamlit Secrets
-TB_URL = st.secrets["THINGSBOARD_HOST"]
-TB_USERNAME = st.secrets["THINGSBOARD_USERNAME"]
-TB_PASSWORD = st.secrets["THINGSBOARD_PASSWORD"]
-TB_KEYS = st.secrets.get("TB_KEYS", "soil_temperature,soil_humidity,soil_ec")
-TB_LIMIT = st.secrets.get("TB_LIMIT", "500")
-TB_DAYS_BACK = int(st.secrets.get("TB_DAYS_BACK", "60"))
+def _config(name: str, default=None):
+    """
+    Lee la configuración de las variables de entorno o, si no existen, de
+    Streamlit Secrets. Permite ejecutar benchmarks sin secrets.toml.
+    """
+    if name in os.environ:
+        return os.environ[name]
+    try:
+        return st.secrets[name]
+    except Exception:
+        if default is None:
+            raise KeyError(f"Falta la configuración '{name}' (secrets.toml o variable de entorno)")
+        return default
+
+
+# Configuración desde Streamlit Secrets (o variables de entorno)
+TB_URL = _config("THINGSBOARD_HOST")
+TB_USERNAME = _config("THINGSBOARD_USERNAME")
+TB_PASSWORD = _config("THINGSBOARD_PASSWORD")
+TB_KEYS = _config("TB_KEYS", "soil_temperature,soil_humidity,soil_ec")
+TB_LIMIT = _config("TB_LIMIT", "500")
+TB_DAYS_BACK = int(_config("TB_DAYS_BACK", "60"))
+METRICS_PORT = _config("METRICS_PORT", "")
+# Procesos para parsear la carga de flota (0 = en el proceso actual)
+TB_PARSE_PROCESSES = int(_config("TB_PARSE_PROCESSES", "0"))
+# Timeout de lectura (s) y tope de peticiones simultáneas a ThingsBoard
+TB_TIMEOUT = float(_config("TB_TIMEOUT", "30"))
+TB_MAX_CONCURRENCY = int(_config("TB_MAX_CONCURRENCY", "32"))
+# Atributos de servidor de los dispositivos (zona, cultivo, profundidad)
+TB_ATTRIBUTES = _config("TB_ATTRIBUTES", "zone,crop,depth")
+# Casete de respuestas: TB_CASSETTE_MODE "record" graba en TB_CASSETTE y
+# "replay" reproduce sin contactar a ThingsBoard, con la latencia grabada
+# (escalada por TB_CASSETTE_SPEED; 0 = sin espera) o una fija en TB_CASSETTE_LATENCY_MS
+TB_CASSETTE = _config("TB_CASSETTE", "cassettes/thingsboard.jsonl.gz")
+TB_CASSETTE_MODE = _config("TB_CASSETTE_MODE", "")
+TB_CASSETTE_LATENCY_MS = _config("TB_CASSETTE_LATENCY_MS", "")
+TB_CASSETTE_SPEED = float(_config("TB_CASSETTE_SPEED", "1"))
+# Presupuesto de memoria (MB) de los cachés compartidos: snapshots, KPIs y segmentos
+CACHE_MAX_MB = float(_config("CACHE_MAX_MB", "512"))
 
 # Variables globales para tokens
 _jwt_token = None
 _refresh_token = None
 
+# Single-flight: peticiones de telemetría en curso, compartidas entre sesiones
+_inflight_lock = threading.Lock()
+_inflight = {}
+_singleflight_stats = {"issued": 0, "coalesced": 0}
+
+# Todas las peticiones pasan por aquí: concurrencia AIMD compartida por el
+# proceso, circuito por endpoint, timeouts y respaldo (ver resiliencia)
+def _crear_casete():
+    if not TB_CASSETTE_MODE:
+        return None
+    if TB_CASSETTE_MODE == "record":
+        os.makedirs(os.path.dirname(os.path.abspath(TB_CASSETTE)), exist_ok=True)
+    latencia = float(TB_CASSETTE_LATENCY_MS) if TB_CASSETTE_LATENCY_MS else None
+    # Velocidad 0 (o negativa): reproducir sin latencia
+    escala = 1 / TB_CASSETTE_SPEED if TB_CASSETTE_SPEED > 0 else 0.0
+    casete = Casete(TB_CASSETTE, TB_CASSETTE_MODE, latencia_ms=latencia, escala=escala)
+    logging.info(f"Casete de ThingsBoard en modo {TB_CASSETTE_MODE}: {TB_CASSETTE}")
+    return casete
+
+
+_cliente = ClienteTB(
+    timeout=(3.05, TB_TIMEOUT),
+    limitador=LimitadorAIMD(inicial=min(8, TB_MAX_CONCURRENCY), maximo=TB_MAX_CONCURRENCY),
+    casete=_crear_casete(),
+)
+
 
 def login(username: str = None, password: str = None) -> tuple[str, str]:
     """
@@ -42,11 +107,13 @@ def login(username: str = None, password: str = None) -> tuple[str, str]:
     }
 
     try:
-        response = requests.post(f"{TB_URL}/api/auth/login", json=payload, headers=headers)
-        response.raise_for_status()
+        with span("tb.login"):
+            data, _ = _cliente.obtener_json(
+                "login", "POST", f"{TB_URL}/api/auth/login", respaldo=False, json=payload, headers=headers
+            )
 
-        _jwt_token = response.json()["token"]
-        _refresh_token = response.json()["refreshToken"]
+        _jwt_token = data["token"]
+        _refresh_token = data["refreshToken"]
 
         logging.info(f"Autenticación exitosa para usuario: {username}")
         return _jwt_token, _refresh_token
@@ -75,15 +142,13 @@ def reauth_token(jwt_token: str, refresh_token: str) -> tuple[str, str]:
     }
 
     try:
-        response = requests.post(
-            f"{TB_URL}/api/auth/token",
-            json=payload,
-            headers=headers
+        data, _ = _cliente.obtener_json(
+            "token", "POST", f"{TB_URL}/api/auth/token",
+            respaldo=False, json=payload, headers=headers
         )
-        response.raise_for_status()
 
-        _jwt_token = response.json()["token"]
-        _refresh_token = response.json()["refreshToken"]
+        _jwt_token = data["token"]
+        _refresh_token = data["refreshToken"]
 
         logging.info("Tokens refrescados exitosamente")
         return _jwt_token, _refresh_token
@@ -93,48 +158,252 @@ def reauth_token(jwt_token: str, refresh_token: str) -> tuple[str, str]:
         raise
 
 
-def list_all_tenant_devices(jwt_token: str, page_size: int = 100) -> list:
+def get_device_page(jwt_token: str, page: int, page_size: int = 100,
+                    sort_property: str = None, sort_order: str = None) -> dict:
     """
-    Lista todos los dispositivos del tenant con paginación.
+    Obtiene una página de /api/tenant/deviceInfos (data, totalPages,
+    totalElements, hasNext).
     """
-    all_devices = []
-    page = 0
-    has_next = True
-
     headers = {
         "Accept": "application/json",
         "X-Authorization": f"Bearer {jwt_token}"
     }
 
-    logging.info("Iniciando obtención de dispositivos...")
+    list_url = f"{TB_URL}/api/tenant/deviceInfos?pageSize={page_size}&page={page}"
+    if sort_property:
+        list_url += f"&sortProperty={sort_property}&sortOrder={sort_order or 'ASC'}"
 
-    while has_next:
-        list_url = f"{TB_URL}/api/tenant/deviceInfos?pageSize={page_size}&page={page}"
+    with span("tb.device_list_page", page=page) as sp:
+        page_data, sp["bytes"] = _cliente.obtener_json("deviceInfos", "GET", list_url, headers=headers)
+        sp["points"] = len(page_data.get("data") or [])
 
-        try:
-            response = requests.get(list_url, headers=headers)
-            response.raise_for_status()
+    return page_data
 
-            page_data = response.json()
 
-            if page_data.get("data"):
-                all_devices.extend(page_data["data"])
-                logging.info(f"Página {page}: {len(page_data['data'])} dispositivos obtenidos")
+def list_all_tenant_devices(jwt_token: str, page_size: int = 100, max_workers: int = 8) -> list:
+    """
+    Lista todos los dispositivos del tenant con paginación.
+    Pide la página 0, lee totalPages y descarga el resto en paralelo.
+    """
+    logging.info("Iniciando obtención de dispositivos...")
 
-            has_next = page_data.get("hasNext", False)
-            page += 1
+    try:
+        first = get_device_page(jwt_token, 0, page_size)
+    except requests.exceptions.HTTPError as http_err:
+        logging.error(f"Error HTTP en página 0: {http_err}")
+        return []
+    except Exception as err:
+        logging.error(f"Error inesperado al listar dispositivos: {err}")
+        return []
 
+    pages = {0: first.get("data") or []}
+    total_pages = int(first.get("totalPages") or (2 if first.get("hasNext") else 1))
+
+    def fetch(page):
+        try:
+            return page, get_device_page(jwt_token, page, page_size).get("data") or []
         except requests.exceptions.HTTPError as http_err:
             logging.error(f"Error HTTP en página {page}: {http_err}")
-            break
         except Exception as err:
             logging.error(f"Error inesperado al listar dispositivos: {err}")
-            break
+        return page, None
+
+    if total_pages > 1:
+        with ThreadPoolExecutor(max_workers=min(max_workers, total_pages - 1)) as executor:
+            for page, data in executor.map(fetch, range(1, total_pages)):
+                if data is not None:
+                    pages[page] = data
+
+    all_devices = []
+    for page in sorted(pages):
+        all_devices.extend(pages[page])
+        logging.info(f"Página {page}: {len(pages[page])} dispositivos obtenidos")
 
     logging.info(f"Total de dispositivos obtenidos: {len(all_devices)}")
     return all_devices
 
 
+# Campos de entidad por los que ThingsBoard puede ordenar; el resto son keys de telemetría
+_ENTITY_FIELDS = ("name", "type", "label", "createdTime")
+
+
+def numeric_key_filter(key: str, *condiciones: tuple, operation: str = "OR") -> dict:
+    """
+    keyFilter NUMERIC de entitiesQuery sobre la telemetría `key`. Cada
+    condición es (operación, valor), p. ej. ("LESS", 18); varias se combinan
+    con `operation` (OR / AND) en un predicado COMPLEX.
+    """
+    predicados = [
+        {"type": "NUMERIC", "operation": op, "value": {"defaultValue": valor}}
+        for op, valor in condiciones
+    ]
+    predicado = predicados[0] if len(predicados) == 1 else {
+        "type": "COMPLEX", "operation": operation, "predicates": predicados
+    }
+    return {"key": {"type": "TIME_SERIES", "key": key}, "valueType": "NUMERIC", "predicate": predicado}
+
+
+def latest_values_query(keys: list, page: int = 0, page_size: int = 100, text_search: str = None,
+                        sort_key: str = None, sort_direction: str = "ASC",
+                        key_filters: list = None, attribute_keys: list = None) -> dict:
+    """
+    Cuerpo de /api/entitiesQuery/find: una página de dispositivos con su
+    nombre, el último valor de cada key y, si se indican, sus atributos de
+    servidor `attribute_keys`. Búsqueda, orden y filtros los resuelve
+    ThingsBoard. `sort_key` puede ser un campo de entidad (name,
+    createdTime, …) o una key de telemetría.
+    """
+    sort_key = sort_key or "name"
+    tipo = "ENTITY_FIELD" if sort_key in _ENTITY_FIELDS else "TIME_SERIES"
+    return {
+        "entityFilter": {"type": "entityType", "entityType": "DEVICE"},
+        "entityFields": [{"type": "ENTITY_FIELD", "key": "name"}],
+        "latestValues": [{"type": "TIME_SERIES", "key": k} for k in keys]
+        + [{"type": "SERVER_ATTRIBUTE", "key": k} for k in attribute_keys or []],
+        "keyFilters": key_filters or [],
+        "pageLink": {
+            "page": page,
+            "pageSize": page_size,
+            "textSearch": text_search or None,
+            "sortOrder": {"key": {"type": tipo, "key": sort_key}, "direction": sort_direction},
+        },
+    }
+
+
+def find_entity_data(jwt_token: str, query: dict) -> dict:
+    """POST /api/entitiesQuery/find (data, totalPages, totalElements, hasNext)."""
+    headers = {
+        "Accept": "application/json",
+        "X-Authorization": f"Bearer {jwt_token}"
+    }
+
+    with span("tb.entities_query", page=query.get("pageLink", {}).get("page")) as sp:
+        page_data, sp["bytes"] = _cliente.obtener_json(
+            "entitiesQuery", "POST", f"{TB_URL}/api/entitiesQuery/find", json=query, headers=headers
+        )
+        sp["points"] = len(page_data.get("data") or [])
+
+    return page_data
+
+
+def count_entities(jwt_token: str, key_filters: list = None) -> int:
+    """POST /api/entitiesQuery/count: dispositivos que cumplen los filtros."""
+    headers = {
+        "Accept": "application/json",
+        "X-Authorization": f"Bearer {jwt_token}"
+    }
+    query = {
+        "entityFilter": {"type": "entityType", "entityType": "DEVICE"},
+        "keyFilters": key_filters or [],
+    }
+
+    with span("tb.entities_count"):
+        total, _ = _cliente.obtener_json(
+            "entitiesCount", "POST", f"{TB_URL}/api/entitiesQuery/count", json=query, headers=headers
+        )
+    return int(total)
+
+
+def _a_float_o_nan(valor) -> float:
+    try:
+        return float(valor)
+    except (TypeError, ValueError):
+        return float("nan")
+
+
+def get_latest_values_page(jwt_token: str, keys: list, **kwargs) -> tuple[pd.DataFrame, int]:
+    """
+    Una página de últimos valores de la flota en una sola petición.
+    Retorna (DataFrame, totalElements); el DataFrame tiene device_id, name,
+    una columna float por key (NaN si nunca reportó) y last_seen, el ts más
+    reciente entre las keys. `kwargs` se pasan a latest_values_query.
+    """
+    page_data = find_entity_data(jwt_token, latest_values_query(keys, **kwargs))
+
+    filas = page_data.get("data") or []
+    valores = {k: [] for k in keys}
+    ids, nombres, vistos = [], [], []
+    for fila in filas:
+        latest = fila.get("latest") or {}
+        series = latest.get("TIME_SERIES") or {}
+        ids.append((fila.get("entityId") or {}).get("id"))
+        nombres.append(((latest.get("ENTITY_FIELD") or {}).get("name") or {}).get("value", "N/A"))
+        ts_max = 0
+        for k in keys:
+            dato = series.get(k) or {}
+            valores[k].append(_a_float_o_nan(dato.get("value")))
+            ts_max = max(ts_max, int(dato.get("ts") or 0))
+        vistos.append(ts_max or None)
+
+    df = pd.DataFrame({"device_id": ids, "name": nombres, **valores})
+    df["last_seen"] = pd.to_datetime(pd.Series(vistos, dtype="float64"), unit="ms")
+    return df, int(page_data.get("totalElements") or 0)
+
+
+def get_latest_values(jwt_token: str, keys: list, device_ids=None, page_size: int = 500) -> pd.DataFrame:
+    """
+    Último valor de cada key para toda la flota, en formato largo
+    (device_id, key, ts, fecha, value), con una petición por página de
+    `page_size` dispositivos en lugar de una por dispositivo. Con
+    `device_ids` se conservan solo esos. Las keys sin datos no aparecen.
+    """
+    columnas = {"device_id": [], "key": [], "ts": [], "value": []}
+    page = 0
+    with span("tb.latest_values", keys=",".join(keys)) as sp:
+        while True:
+            page_data = find_entity_data(jwt_token, latest_values_query(keys, page=page, page_size=page_size))
+            for fila in page_data.get("data") or []:
+                device_id = (fila.get("entityId") or {}).get("id")
+                series = (fila.get("latest") or {}).get("TIME_SERIES") or {}
+                for k in keys:
+                    dato = series.get(k) or {}
+                    if not dato.get("ts"):
+                        continue
+                    columnas["device_id"].append(device_id)
+                    columnas["key"].append(k)
+                    columnas["ts"].append(int(dato["ts"]))
+                    columnas["value"].append(_a_float_o_nan(dato.get("value")))
+            page += 1
+            if not page_data.get("hasNext"):
+                break
+        sp["pages"] = page
+
+    df = pd.DataFrame(columnas).astype({"ts": "int64", "value": "float64"})
+    if device_ids is not None:
+        df = df[df["device_id"].isin(list(device_ids))].reset_index(drop=True)
+    df["fecha"] = pd.to_datetime(df["ts"], unit="ms")
+    return df
+
+
+def get_device_attributes(jwt_token: str, keys: list = None, page_size: int = 500) -> pd.DataFrame:
+    """
+    Atributos de servidor de todos los dispositivos (por defecto
+    TB_ATTRIBUTES) con una petición por página, en lugar de una por
+    dispositivo. Retorna device_id y una columna por atributo (None si el
+    dispositivo no lo tiene).
+    """
+    keys = keys or [k for k in TB_ATTRIBUTES.split(",") if k]
+    columnas = {"device_id": [], **{k: [] for k in keys}}
+    page = 0
+    with span("tb.device_attributes", keys=",".join(keys)) as sp:
+        while True:
+            page_data = find_entity_data(
+                jwt_token, latest_values_query([], page=page, page_size=page_size, attribute_keys=keys)
+            )
+            for fila in page_data.get("data") or []:
+                atributos = (fila.get("latest") or {}).get("SERVER_ATTRIBUTE") or {}
+                columnas["device_id"].append((fila.get("entityId") or {}).get("id"))
+                for k in keys:
+                    valor = (atributos.get(k) or {}).get("value")
+                    columnas[k].append(valor if valor not in (None, "") else None)
+            page += 1
+            if not page_data.get("hasNext"):
+                break
+        sp["pages"] = page
+        sp["points"] = len(columnas["device_id"])
+    return pd.DataFrame(columnas)
+
+
 def get_device_access_token(device_id: str, jwt_token: str) -> dict:
     """
     Obtiene el token de acceso de un dispositivo.
@@ -144,53 +413,157 @@ def get_device_access_token(device_id: str, jwt_token: str) -> dict:
     }
 
     try:
-        response = requests.get(
-            f"{TB_URL}/api/device/{device_id}/credentials",
-            headers=headers
+        data, _ = _cliente.obtener_json(
+            "credentials", "GET", f"{TB_URL}/api/device/{device_id}/credentials",
+            respaldo=False, headers=headers
         )
-        response.raise_for_status()
-        return response.json()
+        return data
 
     except Exception as err:
         logging.error(f"Error al obtener token del dispositivo {device_id}: {err}")
         raise
 
 
+def _telemetry_url(device_id: str, keys: str, days_back: int = None, limit: str = None,
+                   start_ts: int = None, end_ts: int = None) -> str:
+    days_back = days_back or TB_DAYS_BACK
+    limit = limit or TB_LIMIT
+
+    if start_ts is None or end_ts is None:
+        start_date = datetime.now() - timedelta(days=days_back)
+        start_ts = str(int(start_date.timestamp() * 1000))
+        end_date = datetime.now()
+        end_ts = str(int(end_date.timestamp() * 1000))
+
+    return (
+        f"{TB_URL}/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
+        f"?keys={keys}&startTs={start_ts}&endTs={end_ts}&limit={limit}"
+    )
+
+
 def get_telemetry_data(
     device_id: str,
     jwt_token: str,
     keys: str = None,
     days_back: int = None,
-    limit: str = None
+    limit: str = None,
+    start_ts: int = None,
+    end_ts: int = None
 ) -> dict:
     """
-    Obtiene datos de telemetría de un dispositivo.
+    Obtiene datos de telemetría de un dispositivo. Con start_ts/end_ts (ms
+    epoch) consulta esa ventana exacta; si no, los últimos `days_back` días.
     """
     keys = keys or TB_KEYS
-    days_back = days_back or TB_DAYS_BACK
-    limit = limit or TB_LIMIT
+    url = _telemetry_url(device_id, keys, days_back, limit, start_ts, end_ts)
 
-    start_date = datetime.now() - timedelta(days=days_back)
-    start_ts = str(int(start_date.timestamp() * 1000))
-    end_date = datetime.now()
-    end_ts = str(int(end_date.timestamp() * 1000))
+    headers = {
+        "Accept": "application/json",
+        "X-Authorization": f"Bearer {jwt_token}"
+    }
+
+    try:
+        with span("tb.telemetry", device=device_id, keys=keys) as sp:
+            # La URL lleva la ventana calculada al momento: no hay respaldo reutilizable
+            data, sp["bytes"] = _cliente.obtener_json("telemetry", "GET", url, respaldo=False, headers=headers)
+            sp["points"] = sum(len(v) for v in data.values() if v)
+
+        logging.info(
+            f"Telemetría obtenida para dispositivo {device_id}: "
+            f"{sp['points']} puntos, {sp['bytes']} bytes en {sp['seconds'] * 1000:.0f} ms"
+        )
+        return data
+
+    except Exception as err:
+        logging.error(f"Error al obtener telemetría del dispositivo {device_id}: {err}")
+        raise
+
+
+def get_telemetry_bytes(
+    device_id: str,
+    jwt_token: str,
+    keys: str = None,
+    days_back: int = None,
+    limit: str = None,
+    start_ts: int = None,
+    end_ts: int = None
+) -> bytes:
+    """Cuerpo crudo de la respuesta de telemetría, sin decodificar."""
+    keys = keys or TB_KEYS
+    url = _telemetry_url(device_id, keys, days_back, limit, start_ts, end_ts)
 
     headers = {
         "Accept": "application/json",
         "X-Authorization": f"Bearer {jwt_token}"
     }
 
-    url = (
-        f"{TB_URL}/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
-        f"?keys={keys}&startTs={start_ts}&endTs={end_ts}&limit={limit}"
-    )
+    with span("tb.telemetry", device=device_id, keys=keys) as sp:
+        with _cliente.peticion("telemetry", "GET", url, headers=headers) as response:
+            response.raise_for_status()
+            contenido = response.content
+        sp["bytes"] = len(contenido)
+    return contenido
 
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
 
-        logging.info(f"Telemetría obtenida para dispositivo {device_id}")
-        return response.json()
+def get_latest_value(device_id: str, jwt_token: str, key: str) -> dict:
+    """
+    Último valor de una key del dispositivo: {"ts": Timestamp, "value":
+    float}, o None si la key no tiene datos. Sin ventana, ThingsBoard
+    devuelve solo el punto más reciente.
+    """
+    headers = {
+        "Accept": "application/json",
+        "X-Authorization": f"Bearer {jwt_token}"
+    }
+    url = f"{TB_URL}/api/plugins/telemetry/DEVICE/{device_id}/values/timeseries?keys={key}&limit=1"
+
+    with span("tb.latest_value", device=device_id, keys=key) as sp:
+        data, sp["bytes"] = _cliente.obtener_json("latestValue", "GET", url, headers=headers)
+
+    entradas = data.get(key) or []
+    if not entradas or entradas[0].get("value") is None:
+        return None
+    return {"ts": pd.to_datetime(int(entradas[0]["ts"]), unit="ms"), "value": float(entradas[0]["value"])}
+
+
+def get_telemetry_arrays(
+    device_id: str,
+    jwt_token: str,
+    keys: str = None,
+    days_back: int = None,
+    limit: str = None,
+    start_ts: int = None,
+    end_ts: int = None,
+    chunk_size: int = 1 << 16
+) -> dict:
+    """
+    Igual que get_telemetry_data pero decodifica la respuesta por bloques,
+    sin response.json(): retorna {key: (ts, value)} como arrays NumPy
+    (int64 ms y float64) en orden ascendente. Los buffers se preasignan
+    con `limit` puntos por key.
+    """
+    keys = keys or TB_KEYS
+    url = _telemetry_url(device_id, keys, days_back, limit, start_ts, end_ts)
+
+    headers = {
+        "Accept": "application/json",
+        "X-Authorization": f"Bearer {jwt_token}"
+    }
+
+    try:
+        with span("tb.telemetry", device=device_id, keys=keys, streaming=True) as sp:
+            with _cliente.peticion("telemetry", "GET", url, headers=headers, stream=True) as response:
+                response.raise_for_status()
+                arrays, sp["bytes"] = decode_stream(
+                    response.iter_content(chunk_size=chunk_size), capacidad=int(limit or TB_LIMIT)
+                )
+            sp["points"] = sum(len(ts) for ts, _ in arrays.values())
+
+        logging.info(
+            f"Telemetría obtenida para dispositivo {device_id}: "
+            f"{sp['points']} puntos, {sp['bytes']} bytes en {sp['seconds'] * 1000:.0f} ms"
+        )
+        return arrays
 
     except Exception as err:
         logging.error(f"Error al obtener telemetría del dispositivo {device_id}: {err}")
@@ -202,6 +575,13 @@ def parse_telemetry_to_dataframe(data: dict) -> pd.DataFrame:
     Convierte datos de telemetría en un DataFrame de pandas.
     Retorna DataFrame vacío si no hay datos en lugar de lanzar excepción.
     """
+    with span("parse.telemetry") as sp:
+        df = _parse_telemetry(data)
+        sp["points"] = len(df)
+    return df
+
+
+def _parse_telemetry(data: dict) -> pd.DataFrame:
     # ── Guardia 1: respuesta vacía de la API ──
     if not data:
         logging.warning("Telemetría vacía (dict vacío), retornando DataFrame vacío")
@@ -239,29 +619,130 @@ def parse_telemetry_to_dataframe(data: dict) -> pd.DataFrame:
     return df.sort_values("fecha").reset_index(drop=True)
 
 
+class _InflightCall:
+    """Petición en curso: el primer llamador la ejecuta, el resto espera su resultado."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _single_flight(key: tuple, fn):
+    """
+    Ejecuta fn() una sola vez por clave entre llamadores concurrentes.
+    Los llamadores que llegan mientras hay una petición idéntica en curso
+    esperan y reciben una copia del mismo resultado. El resultado compartido
+    es una copia propia, tomada antes de despertar a los que esperan: el
+    primer llamador puede modificar el suyo mientras los demás copian.
+    """
+    with _inflight_lock:
+        call = _inflight.get(key)
+        leader = call is None
+        if leader:
+            call = _InflightCall()
+            _inflight[key] = call
+            _singleflight_stats["issued"] += 1
+        else:
+            _singleflight_stats["coalesced"] += 1
+
+    if not leader:
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result.copy()
+
+    try:
+        resultado = fn()
+        call.result = resultado.copy()
+        return resultado
+    except Exception as err:
+        call.error = err
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+        call.done.set()
+
+
+def get_singleflight_stats() -> dict:
+    """Métricas de coalescencia: peticiones emitidas vs. agrupadas."""
+    with _inflight_lock:
+        stats = dict(_singleflight_stats)
+        stats["in_flight"] = len(_inflight)
+    return stats
+
+
 def get_device_data(device_id: str, jwt_token: str, days_back: int = None) -> pd.DataFrame:
     """
     Función de conveniencia: obtiene telemetría y la convierte en DataFrame.
+    Peticiones concurrentes idénticas (dispositivo, keys, ventana) se agrupan
+    en una sola llamada HTTP.
     """
-    try:
-        telemetry_data = get_telemetry_data(
+    days_back = days_back or TB_DAYS_BACK
+    key = (device_id, TB_KEYS, days_back, TB_LIMIT)
+
+    def fetch():
+        arrays = get_telemetry_arrays(
             device_id=device_id,
             jwt_token=jwt_token,
             days_back=days_back
         )
-        return parse_telemetry_to_dataframe(telemetry_data)
+        with span("parse.telemetry") as sp:
+            df = arrays_to_dataframe(arrays)
+            sp["points"] = len(df)
+        return df
+
+    try:
+        return _single_flight(key, fetch)
     except Exception as err:
         logging.error(f"Error en get_device_data para {device_id}: {err}")
         return pd.DataFrame(columns=["ts", "value", "key", "fecha"])
 
 
-def get_all_devices_data(jwt_token: str, days_back: int = None) -> dict:
+def get_device_range(device_id: str, jwt_token: str, start_ts: int, end_ts: int,
+                     limit: int = None, keys: str = None) -> pd.DataFrame:
     """
-    Obtiene datos de telemetría de TODOS los dispositivos.
+    Telemetría de la ventana [start_ts, end_ts] (ms epoch) como DataFrame.
+    A diferencia de get_device_data, los errores se propagan para que el
+    llamador no confunda un fallo con una ventana sin datos.
+    """
+    limit = limit or TB_LIMIT
+    keys = keys or TB_KEYS
+    key = (device_id, keys, int(start_ts), int(end_ts), str(limit))
+
+    def fetch():
+        arrays = get_telemetry_arrays(
+            device_id=device_id,
+            jwt_token=jwt_token,
+            keys=keys,
+            limit=limit,
+            start_ts=int(start_ts),
+            end_ts=int(end_ts)
+        )
+        with span("parse.telemetry") as sp:
+            df = arrays_to_dataframe(arrays)
+            sp["points"] = len(df)
+        return df
+
+    return _single_flight(key, fetch)
+
+
+def get_all_devices_data(jwt_token: str, days_back: int = None, procesos: int = None) -> dict:
+    """
+    Obtiene datos de telemetría de TODOS los dispositivos. Con `procesos`
+    (o TB_PARSE_PROCESSES) el parseo y las columnas temporales se reparten
+    en un pool de procesos (ver carga_flota).
     """
     devices = list_all_tenant_devices(jwt_token)
     device_ids = [device.get("id", {}).get("id") for device in devices if device.get("id")]
 
+    procesos = TB_PARSE_PROCESSES if procesos is None else procesos
+    if procesos:
+        # Import diferido: carga_flota importa este módulo
+        from carga_flota import cargar_flota_procesos
+        return cargar_flota_procesos(device_ids, jwt_token, days_back=days_back, procesos=procesos)
+
     all_data = {}
 
     for device_id in device_ids:
@@ -276,6 +757,26 @@ def get_all_devices_data(jwt_token: str, days_back: int = None) -> dict:
     return all_data
 
 
+def get_client_status() -> pd.DataFrame:
+    """Estado del cliente de ThingsBoard por endpoint (circuito, llamadas, errores, respaldos)."""
+    return _cliente.estado()
+
+
+def _singleflight_metrics() -> dict:
+    stats = get_singleflight_stats()
+    return {
+        "mvp_singleflight_issued_total": stats["issued"],
+        "mvp_singleflight_coalesced_total": stats["coalesced"],
+        "mvp_singleflight_in_flight": stats["in_flight"],
+    }
+
+
+register_collector(_singleflight_metrics)
+register_collector(_cliente.metricas)
+if METRICS_PORT:
+    start_metrics_server(int(METRICS_PORT))
+
+
 def init_connection():
     """Inicializa la conexión con ThingsBoard."""
     global _jwt_token, _refresh_token
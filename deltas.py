@@ -0,0 +1,193 @@
+"""
+Bus de deltas de telemetría.
+
+Cada vez que se descarga telemetría (segmentos, cargas de flota) se publica
+aquí. El bus guarda una marca de agua por (dispositivo, key) con el ts más
+reciente ya entregado y solo reenvía a los suscriptores los puntos
+posteriores, así que un consumidor incremental (detector de anomalías,
+alertas, acumuladores) ve cada punto una sola vez aunque la misma ventana
+se descargue varias veces. Los puntos anteriores a la marca de agua (p. ej.
+al ampliar el rango de fechas hacia atrás) no se reenvían a ellos.
+
+Los suscriptores históricos (`subscribe(fn, historico=True)`) reciben en
+cambio todo lo publicado, incluidos rellenos hacia atrás y repeticiones, y
+deduplican por su cuenta: sirven para consumidores que no dependen del
+orden, como los acumuladores de estadísticas.
+
+Cada serie recibe un número denso (`serie`) que viaja en el delta: los
+consumidores indexan su estado en arrays NumPy con él, sin buscar tuplas
+(dispositivo, key) punto a punto.
+"""
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+COLUMNAS_DELTA = ["device_id", "key", "serie", "ts", "value"]
+
+
+def pasos_por_serie(series: np.ndarray, ts: np.ndarray):
+    """
+    Índices de un delta agrupados en pasos: el paso k tiene el k-ésimo
+    punto (por ts) de cada serie, así que ninguna serie se repite dentro de
+    un paso. Los consumidores con estado secuencial recorren los pasos en
+    orden y actualizan todas las series de un paso a la vez.
+    """
+    if not len(series):
+        return
+    orden = np.lexsort((ts, series))
+    series_o = series[orden]
+    inicios = np.flatnonzero(np.r_[True, series_o[1:] != series_o[:-1]])
+    rango = np.arange(len(series_o)) - np.repeat(inicios, np.diff(np.r_[inicios, len(series_o)]))
+    por_rango = np.argsort(rango, kind="stable")
+    bordes = np.searchsorted(rango[por_rango], np.arange(rango.max() + 2))
+    for k in range(len(bordes) - 1):
+        yield orden[por_rango[bordes[k]:bordes[k + 1]]]
+
+
+class DeltaBus:
+    """Marcas de agua por serie y suscriptores; compartido entre sesiones (st.cache_resource)."""
+
+    def __init__(self, capacidad: int = 1024):
+        self._lock = threading.Lock()
+        # Serializa publicaciones completas: cada suscriptor recibe los deltas en orden
+        self._publicacion = threading.Lock()
+        self._series = {}
+        self._claves = []
+        self._marcas = np.full(capacidad, -1, dtype=np.int64)
+        self._suscriptores = []
+        self._historicos = []
+        self._stats = {"publicados": 0, "entregados": 0}
+
+    def subscribe(self, fn, historico: bool = False):
+        """
+        fn(delta) recibe un DataFrame con COLUMNAS_DELTA ordenado por serie y
+        ts: solo los puntos posteriores a la marca de agua o, si `historico`,
+        todos los publicados.
+        """
+        with self._lock:
+            (self._historicos if historico else self._suscriptores).append(fn)
+        return fn
+
+    def serie(self, device_id: str, key: str):
+        """Número de la serie, o None si nunca se publicó."""
+        with self._lock:
+            return self._series.get((device_id, key))
+
+    def watermark(self, device_id: str, key: str):
+        """ts (ms) del último punto entregado de la serie, o None."""
+        with self._lock:
+            serie = self._series.get((device_id, key))
+            return None if serie is None else int(self._marcas[serie])
+
+    def _numerar(self, ids: list, nombres: list) -> np.ndarray:
+        """Número de serie de cada combinación (ids × nombres); da de alta las nuevas."""
+        numeros = []
+        for clave in ((did, k) for did in ids for k in nombres):
+            numero = self._series.get(clave)
+            if numero is None:
+                numero = self._series[clave] = len(self._claves)
+                self._claves.append(clave)
+            numeros.append(numero)
+        if len(self._claves) > len(self._marcas):
+            extra = max(len(self._claves), 2 * len(self._marcas)) - len(self._marcas)
+            self._marcas = np.concatenate([self._marcas, np.full(extra, -1, dtype=np.int64)])
+        return np.array(numeros, dtype=np.int64)
+
+    def publish(self, frames: dict) -> int:
+        """
+        Publica {device_id: DataFrame(ts, value, key, ...)} como un solo delta.
+        Retorna el número de puntos nuevos entregados.
+        """
+        frames = {did: df for did, df in frames.items() if df is not None and not df.empty}
+        if not frames:
+            return 0
+        return self._entregar(
+            np.array(list(frames), dtype=object),
+            np.repeat(np.arange(len(frames)), [len(df) for df in frames.values()]),
+            np.concatenate([df["key"].to_numpy(dtype=object) for df in frames.values()]),
+            np.concatenate([df["ts"].to_numpy(dtype="int64") for df in frames.values()]),
+            np.concatenate([df["value"].to_numpy(dtype="float64") for df in frames.values()]),
+        )
+
+    def publish_device(self, device_id: str, df: pd.DataFrame) -> int:
+        return self.publish({device_id: df})
+
+    def publish_frame(self, df: pd.DataFrame) -> int:
+        """
+        Publica un delta de flota en formato largo (device_id, key, ts,
+        value), sin costo por dispositivo: es la vía rápida para cargas de
+        flota y últimos valores.
+        """
+        if df.empty:
+            return 0
+        dispositivos, ids = pd.factorize(df["device_id"].to_numpy(dtype=object))
+        return self._entregar(
+            np.asarray(ids, dtype=object),
+            dispositivos,
+            df["key"].to_numpy(dtype=object),
+            df["ts"].to_numpy(dtype="int64"),
+            df["value"].to_numpy(dtype="float64"),
+        )
+
+    def _entregar(self, ids: np.ndarray, dispositivos: np.ndarray, keys: np.ndarray,
+                  ts: np.ndarray, valores: np.ndarray) -> int:
+        """Filtra por marca de agua, actualiza las marcas y llama a los suscriptores."""
+        codigos_key, nombres_key = pd.factorize(keys)
+        nombres_key = np.asarray(nombres_key, dtype=object)
+
+        with self._publicacion:
+            with self._lock:
+                numeros = self._numerar(ids.tolist(), nombres_key.tolist())
+                series = numeros[dispositivos * len(nombres_key) + codigos_key]
+                nuevos = ts > self._marcas[series]
+                np.maximum.at(self._marcas, series[nuevos], ts[nuevos])
+                self._stats["publicados"] += len(ts)
+                self._stats["entregados"] += int(nuevos.sum())
+                suscriptores = list(self._suscriptores)
+                historicos = list(self._historicos)
+
+            def armar(sel):
+                sel = sel[np.lexsort((ts[sel], series[sel]))]
+                return pd.DataFrame({
+                    "device_id": ids[dispositivos[sel]],
+                    "key": keys[sel],
+                    "serie": series[sel],
+                    "ts": ts[sel],
+                    "value": valores[sel],
+                })
+
+            if historicos:
+                self._llamar(historicos, armar(np.arange(len(ts))))
+            if not nuevos.any():
+                return 0
+            delta = armar(np.flatnonzero(nuevos))
+            self._llamar(suscriptores, delta)
+            return len(delta)
+
+    @staticmethod
+    def _llamar(suscriptores: list, delta: pd.DataFrame):
+        for fn in suscriptores:
+            try:
+                fn(delta)
+            except Exception as err:
+                logging.error(f"Error en suscriptor de deltas {getattr(fn, '__qualname__', fn)}: {err}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                **self._stats,
+                "descartados": self._stats["publicados"] - self._stats["entregados"],
+                "series": len(self._claves),
+                "suscriptores": len(self._suscriptores) + len(self._historicos),
+            }
+
+    def metricas(self) -> dict:
+        """Métricas para register_collector."""
+        stats = self.stats()
+        return {
+            "mvp_deltas_publicados_total": stats["publicados"],
+            "mvp_deltas_entregados_total": stats["entregados"],
+            "mvp_deltas_series": stats["series"],
+        }
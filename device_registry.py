@@ -0,0 +1,240 @@
+"""
+Registro de dispositivos del tenant con índices por id, nombre, tipo,
+perfil y zona. Se comparte entre sesiones (st.cache_resource) y solo vuelve
+a listar todo el tenant cuando cambia el número de dispositivos o el
+createdTime más reciente. Los atributos de servidor (zona, cultivo,
+profundidad) se piden en bloque con entitiesQuery junto con el listado y,
+como pueden cambiar sin altas ni bajas, también cada `attributes_interval`.
+Las descargas no bloquean a las sesiones que consultan el registro, y un
+sondeo fallido no provoca un listado completo: el siguiente se aplaza con
+espera exponencial.
+"""
+import logging
+import threading
+import time
+
+import pandas as pd
+
+from data_queries import get_device_attributes, get_device_page, list_all_tenant_devices
+
+SIN_ZONA = "Sin zona"
+# Atributos que ThingsBoard entrega como texto pero son numéricos
+ATRIBUTOS_NUMERICOS = ("depth",)
+# Espera máxima (s) entre sondeos fallidos mientras el registro está vacío
+REINTENTO_SIN_REGISTRO = 30
+
+
+class DeviceRegistry:
+    """
+    Índices en memoria sobre la lista de deviceInfos. Las búsquedas por id,
+    tipo o perfil son O(1); los nombres duplicados se distinguen en la
+    etiqueta mostrada con un sufijo del id.
+    """
+
+    def __init__(self, probe_interval: float = 300, full_refresh_interval: float = 3600,
+                 attributes_interval: float = 900):
+        self.probe_interval = probe_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.attributes_interval = attributes_interval
+        # _lock protege el estado y el cambio de índices; _refresh_lock deja
+        # actualizar a un solo hilo, sin bloquear a los que solo consultan
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._fingerprint = None
+        self._next_probe = 0.0
+        self._probe_failures = 0
+        self._last_full = 0.0
+        self._last_attributes = 0.0
+        self._set_devices([])
+        self._set_attributes(pd.DataFrame(columns=["device_id"]))
+
+    # ── Construcción de índices ──
+
+    def _set_devices(self, devices: list):
+        by_id, by_name, by_type, by_profile = {}, {}, {}, {}
+        ids = []
+        for d in devices:
+            did = (d.get("id") or {}).get("id")
+            if not did or did in by_id:
+                continue
+            ids.append(did)
+            by_id[did] = d
+            by_name.setdefault(d.get("name", "N/A"), []).append(did)
+            by_type.setdefault(d.get("type"), []).append(did)
+            by_profile.setdefault(d.get("deviceProfileName"), []).append(did)
+
+        labels = {}
+        for name, same in by_name.items():
+            for did in same:
+                labels[did] = name if len(same) == 1 else f"{name} ({did[:8]})"
+
+        # Un único reemplazo para que los lectores nunca vean índices a medias
+        self._index = (ids, by_id, by_name, by_type, by_profile, labels)
+
+    def _set_attributes(self, atributos: pd.DataFrame):
+        atributos = atributos.set_index("device_id")
+        for columna in ATRIBUTOS_NUMERICOS:
+            if columna in atributos:
+                atributos[columna] = pd.to_numeric(atributos[columna], errors="coerce")
+        zonas = {}
+        if "zone" in atributos:
+            zonas = atributos["zone"].astype(object).where(atributos["zone"].notna(), SIN_ZONA).to_dict()
+        by_zone = {}
+        for did, zona in zonas.items():
+            by_zone.setdefault(zona, []).append(did)
+        self._attributes = (atributos, zonas, by_zone)
+
+    def _refresh_attributes(self, jwt_token: str, now: float):
+        try:
+            atributos = get_device_attributes(jwt_token)
+        except Exception as err:
+            # Sin atributos el registro sigue funcionando: se conservan los anteriores
+            logging.warning(f"No se pudieron obtener los atributos de los dispositivos: {err}")
+        else:
+            with self._lock:
+                self._set_attributes(atributos)
+        with self._lock:
+            self._last_attributes = now
+
+    @staticmethod
+    def _fingerprint_of(page: dict):
+        data = page.get("data") or []
+        newest = data[0].get("createdTime") if data else None
+        return page.get("totalElements"), newest
+
+    def _probe(self, jwt_token: str):
+        """Página de 1 elemento ordenada por createdTime: total y alta más reciente."""
+        page = get_device_page(jwt_token, 0, 1, sort_property="createdTime", sort_order="DESC")
+        return self._fingerprint_of(page)
+
+    def _aplazar_sondeo(self, now: float, err: Exception):
+        """Tras un sondeo fallido, espera cada vez más antes del siguiente."""
+        self._probe_failures += 1
+        tope = max(self.probe_interval, self.full_refresh_interval)
+        espera = min(self.probe_interval * 2 ** (self._probe_failures - 1), tope)
+        if not self._index[0]:
+            # Sin registro las páginas no tienen dispositivos: se reintenta antes
+            espera = min(espera, REINTENTO_SIN_REGISTRO)
+        with self._lock:
+            self._next_probe = now + espera
+        logging.warning(f"No se pudo comprobar cambios en dispositivos: {err}; "
+                        f"siguiente intento en {espera:.0f} s")
+
+    def refresh(self, jwt_token: str, force: bool = False) -> bool:
+        """
+        Actualiza el registro si es necesario. Retorna True si se volvió a
+        listar el tenant completo. Las peticiones a ThingsBoard se hacen
+        fuera de `_lock`: las sesiones que llegan mientras otra actualiza
+        siguen con los índices actuales (salvo que el registro esté vacío,
+        en cuyo caso esperan al listado).
+        """
+        with self._lock:
+            now = time.monotonic()
+            if (not force and now < self._next_probe
+                    and now - self._last_attributes < self.attributes_interval):
+                return False
+        if not self._refresh_lock.acquire(blocking=force or not self._index[0]):
+            return False
+        try:
+            return self._refresh(jwt_token, force)
+        finally:
+            self._refresh_lock.release()
+
+    def _refresh(self, jwt_token: str, force: bool) -> bool:
+        now = time.monotonic()
+        if force or now - self._last_attributes >= self.attributes_interval:
+            self._refresh_attributes(jwt_token, now)
+        # Otro hilo pudo actualizar mientras se esperaba el turno
+        if not force and now < self._next_probe:
+            return False
+
+        full_due = now - self._last_full >= self.full_refresh_interval
+        try:
+            fingerprint = self._probe(jwt_token)
+        except Exception as err:
+            # ThingsBoard no responde: volver a listar todo el tenant solo lo cargaría más
+            self._aplazar_sondeo(now, err)
+            if not force and self._index[0]:
+                return False
+            fingerprint = None
+        else:
+            self._probe_failures = 0
+            with self._lock:
+                self._next_probe = now + self.probe_interval
+
+        if not force and not full_due and fingerprint and fingerprint == self._fingerprint:
+            return False
+
+        devices = list_all_tenant_devices(jwt_token)
+        if not devices and self._index[0]:
+            logging.warning("Listado de dispositivos vacío; se conserva el registro anterior")
+            return False
+
+        with self._lock:
+            self._set_devices(devices)
+            self._fingerprint = fingerprint
+            self._last_full = now
+        if self._last_attributes != now:
+            self._refresh_attributes(jwt_token, now)
+        logging.info(f"Registro de dispositivos actualizado: {len(self._index[0])} dispositivos")
+        return True
+
+    # ── Consultas ──
+
+    @property
+    def ids(self) -> list:
+        return self._index[0]
+
+    @property
+    def names(self) -> dict:
+        """Mapa id → nombre."""
+        return {did: d.get("name", "N/A") for did, d in self._index[1].items()}
+
+    def __len__(self):
+        return len(self._index[0])
+
+    def __contains__(self, device_id):
+        return device_id in self._index[1]
+
+    def get(self, device_id: str) -> dict:
+        return self._index[1].get(device_id)
+
+    def label(self, device_id: str) -> str:
+        """Nombre para mostrar, único aunque haya nombres repetidos."""
+        return self._index[5].get(device_id, device_id)
+
+    def ids_by_name(self, name: str) -> list:
+        return self._index[2].get(name, [])
+
+    def ids_by_type(self, device_type: str) -> list:
+        return self._index[3].get(device_type, [])
+
+    def ids_by_profile(self, profile: str) -> list:
+        return self._index[4].get(profile, [])
+
+    def types(self) -> list:
+        return sorted(t for t in self._index[3] if t)
+
+    def profiles(self) -> list:
+        return sorted(p for p in self._index[4] if p)
+
+    # ── Atributos ──
+
+    def attributes(self) -> pd.DataFrame:
+        """Atributos de servidor por dispositivo (índice device_id)."""
+        return self._attributes[0]
+
+    def zone(self, device_id: str) -> str:
+        return self._attributes[1].get(device_id, SIN_ZONA)
+
+    def zone_map(self) -> dict:
+        """Mapa id → zona de los dispositivos con atributos."""
+        return self._attributes[1]
+
+    def ids_by_zone(self, zone: str) -> list:
+        return self._attributes[2].get(zone, [])
+
+    def zones(self) -> list:
+        """Zonas con dispositivos; "Sin zona" al final."""
+        zonas = self._attributes[2]
+        return sorted(z for z in zonas if z != SIN_ZONA) + ([SIN_ZONA] if SIN_ZONA in zonas else [])
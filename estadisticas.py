@@ -0,0 +1,339 @@
+"""
+Estadísticas incrementales de la flota con acumuladores de Welford.
+
+Por (serie, día UTC) se guarda conteo, media, M2 (suma de cuadrados de las
+desviaciones a la media), mínimo y máximo, y lo mismo por (key, día) para
+toda la flota y por (zona, key, día) para cada zona. Los lotes nuevos se
+fusionan con los acumulados (fórmula paralela de Chan), así que un delta
+cuesta lo que sus puntos, y el promedio de flota o de zona de una ventana
+se lee combinando una fila por día y key, sin recorrer la telemetría.
+Cuando cambia la zona de algún dispositivo, los cubos de zona se
+reconstruyen combinando los cubos por serie.
+
+Se suscribe al DeltaBus como histórico: recibe también los rellenos hacia
+atrás, las re-descargas de días abiertos y las subidas diferidas. Cada cubo
+por serie guarda los ts que ya acumuló (desfase en ms dentro del día, int32:
+4 bytes por punto) y de cada publicación solo se suman los puntos no vistos,
+tenga la publicación la forma que tenga.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import span
+
+DIA_MS = 24 * 60 * 60 * 1000
+COLUMNAS_ESTADISTICAS = ["n", "media", "var", "std", "min", "max"]
+
+
+def reducir(ids: np.ndarray, n: np.ndarray, media: np.ndarray, m2: np.ndarray,
+            minimo: np.ndarray, maximo: np.ndarray) -> tuple:
+    """
+    Combina los acumuladores (n, media, M2, min, max) que comparten id en
+    uno por id. Retorna (ids_unicos, n, media, m2, min, max).
+    """
+    unicos, inv = np.unique(ids, return_inverse=True)
+    n_t = np.bincount(inv, weights=n)
+    media_t = np.bincount(inv, weights=n * media) / n_t
+    m2_t = np.bincount(inv, weights=m2 + n * (media - media_t[inv]) ** 2)
+    min_t = np.full(len(unicos), np.inf)
+    max_t = np.full(len(unicos), -np.inf)
+    np.minimum.at(min_t, inv, minimo)
+    np.maximum.at(max_t, inv, maximo)
+    return unicos, n_t, media_t, m2_t, min_t, max_t
+
+
+def _marco(n: np.ndarray, media: np.ndarray, m2: np.ndarray, minimo: np.ndarray,
+           maximo: np.ndarray, indice) -> pd.DataFrame:
+    """DataFrame con COLUMNAS_ESTADISTICAS; varianza muestral como pandas (ddof=1)."""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        var = np.where(n > 1, m2 / (n - 1), np.nan)
+    return pd.DataFrame({
+        "n": n.astype(np.int64), "media": media, "var": var, "std": np.sqrt(var),
+        "min": minimo, "max": maximo,
+    }, index=indice)
+
+
+class _Tabla:
+    """Acumuladores en arrays NumPy, una fila por cubo (id, día)."""
+
+    _RELLENOS = {"n": 0, "media": 0, "m2": 0, "min": np.inf, "max": -np.inf, "id": 0, "dia": 0}
+
+    def __init__(self, capacidad: int):
+        self.filas = {}
+        self.usadas = 0
+        self.arrays = {
+            nombre: np.full(capacidad, relleno, dtype=np.int64 if nombre in ("id", "dia") else float)
+            for nombre, relleno in self._RELLENOS.items()
+        }
+
+    def __getattr__(self, nombre):
+        try:
+            return self.__dict__["arrays"][nombre]
+        except KeyError:
+            raise AttributeError(nombre) from None
+
+    def fila(self, id_: int, dia: int) -> int:
+        fila = self.filas.get((id_, dia))
+        if fila is None:
+            fila = self.filas[(id_, dia)] = self.usadas
+            self.usadas += 1
+            if fila >= len(self.n):
+                extra = len(self.n)
+                for nombre, arr in self.arrays.items():
+                    self.arrays[nombre] = np.concatenate([arr, np.full(extra, self._RELLENOS[nombre], dtype=arr.dtype)])
+            self.id[fila] = id_
+            self.dia[fila] = dia
+        return fila
+
+    def fusionar(self, filas: np.ndarray, n: np.ndarray, media: np.ndarray, m2: np.ndarray,
+                 minimo: np.ndarray, maximo: np.ndarray):
+        """Fusiona un lote por fila (`filas` sin repetir) con lo acumulado."""
+        n_a = self.n[filas]
+        n_t = n_a + n
+        d = media - self.media[filas]
+        self.media[filas] += d * n / n_t
+        self.m2[filas] += m2 + d * d * n_a * n / n_t
+        self.n[filas] = n_t
+        self.min[filas] = np.minimum(self.min[filas], minimo)
+        self.max[filas] = np.maximum(self.max[filas], maximo)
+
+    def seleccionar(self, desde, hasta, ids=None) -> np.ndarray:
+        """Filas con datos cuyo día cae en [desde, hasta) y, si se indica, cuyo id está en `ids`."""
+        dias = self.dia[:self.usadas]
+        mascara = self.n[:self.usadas] > 0
+        if desde is not None:
+            mascara &= dias >= pd.Timestamp(desde).value // 1_000_000
+        if hasta is not None:
+            mascara &= dias < pd.Timestamp(hasta).value // 1_000_000
+        if ids is not None:
+            mascara &= np.isin(self.id[:self.usadas], ids)
+        return np.flatnonzero(mascara)
+
+    def combinar(self, filas: np.ndarray) -> tuple:
+        """Combina las filas por id: (ids, n, media, m2, min, max)."""
+        return reducir(self.id[filas], self.n[filas], self.media[filas], self.m2[filas],
+                       self.min[filas], self.max[filas])
+
+
+class EstadisticasFlota:
+    """
+    Acumuladores por (dispositivo, key, día) y por (key, día), compartidos
+    entre sesiones (st.cache_resource). Suscribir `procesar` a un DeltaBus
+    con `historico=True`.
+    """
+
+    def __init__(self, capacidad: int = 4096, sin_zona: str = "Sin zona"):
+        self.sin_zona = sin_zona
+        self._lock = threading.Lock()
+        # serie → (device_id, key)
+        self._claves = {}
+        self._codigos_key = {}
+        self._series = _Tabla(capacidad)
+        self._keys = _Tabla(64)
+        # device_id → zona, y (zona, key) → código de los cubos de zona
+        self._zonas = {}
+        self._codigos_zona = {}
+        self._por_zona = _Tabla(256)
+        # Fila (serie, día) → fila (key, día) y fila (zona, key, día)
+        self._fila_key = np.zeros(capacidad, dtype=np.int64)
+        self._fila_zona = np.zeros(capacidad, dtype=np.int64)
+        # Último día visto por serie y su fila: los deltas del día en curso no pasan por dicts
+        self._ultimo_dia = np.full(1024, -1, dtype=np.int64)
+        self._ultima_fila = np.zeros(1024, dtype=np.int64)
+        # Fila (serie, día) → desfases (ms en el día, int32 ordenados) ya acumulados
+        self._vistos = []
+        self._stats = {"puntos": 0, "acumulados": 0}
+
+    def _filas(self, delta: pd.DataFrame, series: np.ndarray, dias: np.ndarray) -> np.ndarray:
+        """Fila (serie, día) de cada punto; da de alta las series y cubos nuevos."""
+        if series.max() >= len(self._ultimo_dia):
+            extra = max(int(series.max()) + 1, 2 * len(self._ultimo_dia)) - len(self._ultimo_dia)
+            self._ultimo_dia = np.concatenate([self._ultimo_dia, np.full(extra, -1, dtype=np.int64)])
+            self._ultima_fila = np.concatenate([self._ultima_fila, np.zeros(extra, dtype=np.int64)])
+
+        # El delta viene ordenado por serie y ts: cada cubo es un tramo contiguo
+        cambio = np.r_[True, (series[1:] != series[:-1]) | (dias[1:] != dias[:-1])]
+        inicios = np.flatnonzero(cambio)
+        filas = self._ultima_fila[series[inicios]]
+        otros = np.flatnonzero(self._ultimo_dia[series[inicios]] != dias[inicios])
+        if len(otros):
+            device_ids = delta["device_id"].to_numpy()[inicios[otros]].tolist()
+            keys = delta["key"].to_numpy()[inicios[otros]].tolist()
+            for i, serie, dia, clave in zip(otros.tolist(), series[inicios[otros]].tolist(),
+                                            dias[inicios[otros]].tolist(), zip(device_ids, keys)):
+                self._claves.setdefault(serie, clave)
+                codigo = self._codigos_key.setdefault(clave[1], len(self._codigos_key))
+                fila = self._series.fila(serie, dia)
+                if fila >= len(self._fila_key):
+                    extra = len(self._series.n) - len(self._fila_key)
+                    self._fila_key = np.concatenate([self._fila_key, np.zeros(extra, dtype=np.int64)])
+                    self._fila_zona = np.concatenate([self._fila_zona, np.zeros(extra, dtype=np.int64)])
+                self._fila_key[fila] = self._keys.fila(codigo, dia)
+                self._fila_zona[fila] = self._por_zona.fila(self._codigo_zona(*clave), dia)
+                filas[i] = fila
+                if dia >= self._ultimo_dia[serie]:
+                    self._ultimo_dia[serie] = dia
+                    self._ultima_fila[serie] = fila
+        return np.repeat(filas, np.diff(np.r_[inicios, len(series)]))
+
+    def _codigo_zona(self, device_id: str, key: str) -> int:
+        zona = self._zonas.get(device_id, self.sin_zona)
+        return self._codigos_zona.setdefault((zona, key), len(self._codigos_zona))
+
+    def asignar_zonas(self, zonas: dict) -> bool:
+        """
+        Zona de cada dispositivo ({device_id: zona}; los que falten van a
+        `sin_zona`). Si cambia la de algún dispositivo con datos, los cubos
+        de zona se reconstruyen desde los cubos por serie. Retorna True si
+        hubo reconstrucción.
+        """
+        with self._lock:
+            if zonas == self._zonas:
+                return False
+            con_datos = {clave[0] for clave in self._claves.values()}
+            cambio = any(self._zonas.get(d, self.sin_zona) != zonas.get(d, self.sin_zona) for d in con_datos)
+            self._zonas = dict(zonas)
+            if not cambio:
+                return False
+
+            with span("estadisticas.zonas", series=len(self._claves)) as sp:
+                t = self._series
+                self._codigos_zona = {}
+                codigo_serie = np.zeros(max(self._claves, default=-1) + 1, dtype=np.int64)
+                for serie, clave in self._claves.items():
+                    codigo_serie[serie] = self._codigo_zona(*clave)
+                # Un cubo de zona por (código, día) presente en los cubos por serie
+                pares, inversa = np.unique(
+                    np.stack([codigo_serie[t.id[:t.usadas]], t.dia[:t.usadas]], axis=1),
+                    axis=0, return_inverse=True,
+                )
+                self._por_zona = _Tabla(max(256, len(pares)))
+                for codigo, dia in pares.tolist():
+                    self._por_zona.fila(codigo, dia)
+                self._fila_zona[:t.usadas] = inversa.ravel()
+
+                filas = np.flatnonzero(t.n[:t.usadas] > 0)
+                if len(filas):
+                    self._por_zona.fusionar(*reducir(
+                        self._fila_zona[filas], t.n[filas], t.media[filas], t.m2[filas], t.min[filas], t.max[filas]
+                    ))
+                sp["buckets"] = self._por_zona.usadas
+            return True
+
+    def _no_vistos(self, filas: np.ndarray, desfases: np.ndarray, inicios: np.ndarray) -> np.ndarray:
+        """Máscara de los puntos cuyo ts no se acumuló aún en su cubo (ni antes en el delta)."""
+        # Clave (tramo, desfase): creciente a lo largo del delta, y también en
+        # los vistos concatenados en el orden de los tramos, así que basta searchsorted
+        tramo = np.repeat(np.arange(len(inicios), dtype=np.int64), np.diff(np.r_[inicios, len(filas)]))
+        claves = tramo * DIA_MS + desfases
+        nuevos = np.r_[True, claves[1:] != claves[:-1]]
+        cubos = filas[inicios].tolist()
+        if len(self._vistos) <= max(cubos):
+            self._vistos.extend([None] * (max(cubos) + 1 - len(self._vistos)))
+        previos = [np.int64(i * DIA_MS) + self._vistos[f] for i, f in enumerate(cubos) if self._vistos[f] is not None]
+        if previos:
+            previos = np.concatenate(previos)
+            pos = np.minimum(np.searchsorted(previos, claves), len(previos) - 1)
+            nuevos &= previos[pos] != claves
+        return nuevos
+
+    def _marcar_vistos(self, filas: np.ndarray, desfases: np.ndarray):
+        """Añade los desfases (agrupados por fila) a los vistos de cada cubo."""
+        inicios = np.flatnonzero(np.r_[True, filas[1:] != filas[:-1]])
+        partes = np.split(desfases.astype(np.int32), inicios[1:])
+        for fila, parte in zip(filas[inicios].tolist(), partes):
+            previos = self._vistos[fila]
+            self._vistos[fila] = parte.copy() if previos is None else np.union1d(previos, parte)
+
+    def procesar(self, delta: pd.DataFrame):
+        """Acumula un delta (device_id, key, serie, ts, value) ordenado por serie y ts."""
+        if delta.empty:
+            return
+        with self._lock, span("estadisticas.delta", points=len(delta)) as sp:
+            series = delta["serie"].to_numpy(dtype=np.int64)
+            ts = delta["ts"].to_numpy(dtype="int64")
+            valores = delta["value"].to_numpy(dtype="float64")
+            filas = self._filas(delta, series, ts - ts % DIA_MS)
+            self._stats["puntos"] += len(delta)
+
+            validos = np.isfinite(valores)
+            filas, desfases, x = filas[validos], ts[validos] % DIA_MS, valores[validos]
+            sp["new"] = 0
+            if not len(x):
+                return
+            # Por el orden (serie, ts), cada cubo es un tramo contiguo
+            inicios = np.flatnonzero(np.r_[True, filas[1:] != filas[:-1]])
+            nuevos = self._no_vistos(filas, desfases, inicios)
+            if not nuevos.any():
+                return
+            filas, desfases, x = filas[nuevos], desfases[nuevos], x[nuevos]
+            self._marcar_vistos(filas, desfases)
+
+            inicios = np.flatnonzero(np.r_[True, filas[1:] != filas[:-1]])
+            n = np.diff(np.r_[inicios, len(x)]).astype(float)
+            media = np.add.reduceat(x, inicios) / n
+            m2 = np.add.reduceat((x - np.repeat(media, n.astype(np.int64))) ** 2, inicios)
+            lote = (filas[inicios], n, media, m2, np.minimum.reduceat(x, inicios), np.maximum.reduceat(x, inicios))
+            self._series.fusionar(*lote)
+            self._keys.fusionar(*reducir(self._fila_key[lote[0]], *lote[1:]))
+            self._por_zona.fusionar(*reducir(self._fila_zona[lote[0]], *lote[1:]))
+            sp["new"] = len(x)
+            self._stats["acumulados"] += len(x)
+
+    # ── Consultas ──
+
+    def resumen(self, desde=None, hasta=None, device_id: str = None, por_dispositivo: bool = False) -> pd.DataFrame:
+        """
+        Estadísticas combinadas por key (o por device_id y key) en los días
+        de [desde, hasta). Sin filtro de dispositivo se leen los cubos de
+        flota: una fila por key y día.
+        """
+        with self._lock:
+            if device_id is None and not por_dispositivo:
+                ids, *combinado = self._keys.combinar(self._keys.seleccionar(desde, hasta))
+                nombres = np.array(list(self._codigos_key), dtype=object)
+                indice = pd.Index(nombres[ids], name="key")
+            else:
+                propias = None
+                if device_id is not None:
+                    propias = [s for s, c in self._claves.items() if c[0] == device_id]
+                ids, *combinado = self._series.combinar(self._series.seleccionar(desde, hasta, propias))
+                indice = pd.MultiIndex.from_tuples([self._claves[s] for s in ids.tolist()], names=["device_id", "key"])
+        if not len(ids):
+            return pd.DataFrame(columns=COLUMNAS_ESTADISTICAS)
+        return _marco(*combinado, indice=indice)
+
+    def promedios(self, desde=None, hasta=None) -> dict:
+        """Media de flota por key en [desde, hasta): {key: media}."""
+        return self.resumen(desde, hasta)["media"].astype(float).to_dict()
+
+    def resumen_zonas(self, desde=None, hasta=None) -> pd.DataFrame:
+        """Estadísticas combinadas por zona y key en los días de [desde, hasta), desde los cubos de zona."""
+        with self._lock:
+            ids, *combinado = self._por_zona.combinar(self._por_zona.seleccionar(desde, hasta))
+            claves = list(self._codigos_zona)
+        if not len(ids):
+            return pd.DataFrame(columns=COLUMNAS_ESTADISTICAS)
+        indice = pd.MultiIndex.from_tuples([claves[i] for i in ids.tolist()], names=["zona", "key"])
+        return _marco(*combinado, indice=indice)
+
+    def promedios_zonas(self, desde=None, hasta=None) -> dict:
+        """Media por zona y key en [desde, hasta): {zona: {key: media}}."""
+        medias = self.resumen_zonas(desde, hasta)["media"].astype(float)
+        return {zona: grupo.droplevel("zona").to_dict() for zona, grupo in medias.groupby(level="zona", sort=False)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "cubos": self._series.usadas, "cubos_flota": self._keys.usadas,
+                    "cubos_zona": self._por_zona.usadas}
+
+    def metricas(self) -> dict:
+        """Métricas para register_collector."""
+        stats = self.stats()
+        return {
+            "mvp_estadisticas_puntos_total": stats["puntos"],
+            "mvp_estadisticas_acumulados_total": stats["acumulados"],
+            "mvp_estadisticas_cubos": stats["cubos"],
+        }
@@ -0,0 +1,79 @@
+"""
+Anotación de eventos de manejo (riego, fertilización, ...) sobre series de
+sensores. Cada evento se asocia a la muestra más cercana en el tiempo con un
+único merge_asof sobre datos ordenados, en lugar de ordenar la serie entera
+por cada evento.
+"""
+import logging
+
+import pandas as pd
+
+TIPOS_EVENTOS = ["Riego", "Fertilización", "Planificación de riego"]
+
+
+def generar_eventos_recurrentes(inicio, fin, tipos: list = None, freq: str = "14D") -> pd.DataFrame:
+    """Eventos de ejemplo: cada tipo en cada fecha de un calendario fijo."""
+    tipos = tipos or TIPOS_EVENTOS
+    fechas = pd.date_range(start=inicio, end=fin, freq=freq)
+    return pd.DataFrame({
+        "Fecha": fechas.repeat(len(tipos)),
+        "Tipo": tipos * len(fechas),
+    })
+
+
+def cargar_eventos_csv(fuente, col_fecha: str = "Fecha", col_tipo: str = "Tipo",
+                       formato_fecha: str = None, dayfirst: bool = True) -> pd.DataFrame:
+    """
+    Lee eventos reales desde un CSV (ruta o archivo subido). Se esperan al
+    menos una columna de fecha y una de tipo; el resto (p. ej. volumen de
+    riego o producto aplicado) se conserva. Filas con fecha inválida se
+    descartan.
+    """
+    df = pd.read_csv(fuente)
+    faltantes = {col_fecha, col_tipo} - set(df.columns)
+    if faltantes:
+        raise ValueError(f"El CSV de eventos no tiene las columnas: {', '.join(sorted(faltantes))}")
+
+    df = df.rename(columns={col_fecha: "Fecha", col_tipo: "Tipo"})
+    df["Fecha"] = pd.to_datetime(df["Fecha"], format=formato_fecha, dayfirst=dayfirst, errors="coerce")
+    invalidas = int(df["Fecha"].isna().sum())
+    if invalidas:
+        logging.warning(f"{invalidas} eventos con fecha inválida descartados")
+    df = df.dropna(subset=["Fecha"])
+    df["Tipo"] = df["Tipo"].astype(str).str.strip()
+    return df.sort_values("Fecha", kind="stable").reset_index(drop=True)
+
+
+def anotar_eventos(df_serie: pd.DataFrame, df_eventos: pd.DataFrame, col_fecha: str = "Fecha",
+                   tolerancia: pd.Timedelta = None) -> pd.DataFrame:
+    """
+    Asocia cada evento a la muestra de df_serie más cercana en el tiempo.
+
+    Retorna una fila por evento con las columnas de la muestra encontrada,
+    más 'Tipo' y 'Fecha_evento'. Con `tolerancia`, los eventos sin muestra
+    dentro de ese margen se descartan. Coste O((N + E) log(N + E)).
+    """
+    columnas = list(df_serie.columns) + ["Tipo", "Fecha_evento"]
+    if df_serie.empty or df_eventos.empty:
+        return pd.DataFrame(columns=columnas)
+
+    serie = df_serie.sort_values(col_fecha, kind="stable").reset_index(drop=True)
+    serie["_fecha_muestra"] = serie[col_fecha]
+
+    eventos = df_eventos.rename(columns={"Fecha": "Fecha_evento"})
+    eventos = eventos.sort_values("Fecha_evento", kind="stable")
+    # merge_asof exige la misma resolución temporal en ambas claves
+    eventos["Fecha_evento"] = eventos["Fecha_evento"].astype(serie[col_fecha].dtype)
+    extra = [c for c in eventos.columns if c not in ("Fecha_evento", "Tipo") and c not in serie.columns]
+
+    anotados = pd.merge_asof(
+        eventos[["Fecha_evento", "Tipo"] + extra],
+        serie.drop(columns=[col_fecha]),
+        left_on="Fecha_evento",
+        right_on="_fecha_muestra",
+        direction="nearest",
+        tolerance=tolerancia,
+    )
+    anotados = anotados.dropna(subset=["_fecha_muestra"])
+    anotados = anotados.rename(columns={"_fecha_muestra": col_fecha})
+    return anotados[columnas + extra].reset_index(drop=True)
@@ -0,0 +1,53 @@
+"""
+Ingeniería de características compartida por los dashboards.
+"""
+import numpy as np
+import pandas as pd
+
+ORDEN_PERIODOS = ["Mañana", "Tarde", "Noche"]
+
+
+def clasificar_periodo(hora):
+    if 6 <= hora < 12:
+        return "Mañana"
+    elif 12 <= hora < 18:
+        return "Tarde"
+    return "Noche"
+
+
+def periodo_del_dia(horas) -> pd.Categorical:
+    """Versión vectorizada de clasificar_periodo sobre un array de horas."""
+    horas = np.asarray(horas)
+    codigos = np.where((horas >= 6) & (horas < 12), 0, np.where((horas >= 12) & (horas < 18), 1, 2))
+    return pd.Categorical.from_codes(codigos, categories=ORDEN_PERIODOS, ordered=True)
+
+
+def agregar_columnas_temporales(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Añade Fecha, Hora_del_Dia y Periodo_Dia (categórico ordenado) a partir
+    de la columna 'fecha'. Modifica el DataFrame recibido y lo retorna.
+    """
+    # Un objeto date por día distinto, no uno por fila (.dt.date es O(filas) en Python)
+    dias, fechas = pd.factorize(df["fecha"].to_numpy().astype("datetime64[D]"))
+    df["Fecha"] = np.asarray(fechas.astype(object))[dias]
+    df["Hora_del_Dia"] = df["fecha"].dt.hour
+    df["Periodo_Dia"] = periodo_del_dia(df["Hora_del_Dia"].to_numpy())
+    return df
+
+
+def pivot_periodo_dia(df_key: pd.DataFrame) -> pd.DataFrame:
+    """
+    Media por Periodo_Dia (filas) y Fecha (columnas) para el heatmap. Si
+    df_key trae columna 'count' (buckets agregados de la pirámide), la
+    media se pondera por el número de puntos de cada bucket.
+    """
+    if "count" in df_key:
+        df_agg = (
+            df_key.assign(_suma=df_key["value"] * df_key["count"])
+            .groupby(["Fecha", "Periodo_Dia"], observed=False)[["_suma", "count"]].sum()
+        )
+        df_agg["value"] = df_agg["_suma"] / df_agg["count"].where(df_agg["count"] > 0)
+        df_agg = df_agg.reset_index()
+    else:
+        df_agg = df_key.groupby(["Fecha", "Periodo_Dia"], observed=False)["value"].mean().reset_index()
+    return df_agg.pivot(index="Periodo_Dia", columns="Fecha", values="value")
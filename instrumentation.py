@@ -0,0 +1,213 @@
+"""
+Instrumentación del pipeline: spans de tiempo para fetch, parseo y render,
+panel de depuración en Streamlit y métricas en formato texto de Prometheus.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import streamlit as st
+
+# Límites superiores (segundos) de los buckets del histograma de latencias
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_recent_spans = deque(maxlen=500)
+_durations = {}
+_totals = {}
+_collectors = []
+_debug_views = {}
+_metrics_server = None
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """
+    Mide la duración de un bloque. El dict devuelto admite atributos extra
+    (bytes, points, ...) que se acumulan como contadores del span.
+    """
+    record = {"span": name, **attrs}
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception:
+        record["error"] = True
+        raise
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        record["started_at"] = pd.Timestamp.now()
+        _record(record)
+
+
+def _record(record: dict):
+    name = record["span"]
+    seconds = record["seconds"]
+    with _lock:
+        _recent_spans.append(record)
+        _durations.setdefault(name, deque(maxlen=1000)).append(seconds)
+
+        totals = _totals.setdefault(name, {
+            "count": 0, "sum": 0.0, "errors": 0,
+            "buckets": [0] * len(BUCKETS), "bytes": 0, "points": 0
+        })
+        totals["count"] += 1
+        totals["sum"] += seconds
+        totals["errors"] += int(record.get("error", False))
+        totals["bytes"] += int(record.get("bytes", 0) or 0)
+        totals["points"] += int(record.get("points", 0) or 0)
+        for i, le in enumerate(BUCKETS):
+            if seconds <= le:
+                totals["buckets"][i] += 1
+
+
+def register_collector(fn):
+    """
+    Registra una función que devuelve {nombre_métrica: valor} para añadirla
+    a la salida de Prometheus (p. ej. contadores de single-flight).
+    """
+    with _lock:
+        if fn not in _collectors:
+            _collectors.append(fn)
+
+
+def register_debug_view(titulo: str, fn):
+    """
+    Registra una función sin argumentos que devuelve un DataFrame para
+    mostrarlo en el panel de depuración bajo `titulo` (p. ej. el estado de
+    los cachés). Registrar el mismo título reemplaza la vista.
+    """
+    with _lock:
+        _debug_views[titulo] = fn
+
+
+def get_recent_spans(limit: int = 100) -> pd.DataFrame:
+    """Últimos spans registrados, del más reciente al más antiguo."""
+    with _lock:
+        records = list(_recent_spans)[-limit:]
+    if not records:
+        return pd.DataFrame(columns=["started_at", "span", "seconds"])
+    df = pd.DataFrame(records[::-1])
+    first = ["started_at", "span", "seconds"]
+    return df[first + [c for c in df.columns if c not in first]]
+
+
+def get_span_summary() -> pd.DataFrame:
+    """Resumen por span: llamadas, percentiles de latencia, bytes y puntos."""
+    rows = []
+    with _lock:
+        for name, totals in _totals.items():
+            durs = pd.Series(list(_durations[name]))
+            rows.append({
+                "span": name,
+                "count": totals["count"],
+                "errors": totals["errors"],
+                "p50_ms": durs.quantile(0.50) * 1000,
+                "p95_ms": durs.quantile(0.95) * 1000,
+                "max_ms": durs.max() * 1000,
+                "total_s": totals["sum"],
+                "bytes": totals["bytes"],
+                "points": totals["points"],
+            })
+    if not rows:
+        return pd.DataFrame(columns=["span", "count", "errors", "p50_ms", "p95_ms",
+                                     "max_ms", "total_s", "bytes", "points"])
+    return pd.DataFrame(rows).sort_values("total_s", ascending=False).reset_index(drop=True)
+
+
+def render_prometheus() -> str:
+    """Exporta los spans y colectores registrados en formato texto de Prometheus."""
+    lines = [
+        "# HELP mvp_span_duration_seconds Duración de los spans instrumentados",
+        "# TYPE mvp_span_duration_seconds histogram",
+    ]
+    with _lock:
+        totals = {name: dict(t, buckets=list(t["buckets"])) for name, t in _totals.items()}
+        collectors = list(_collectors)
+
+    for name, t in sorted(totals.items()):
+        for le, n in zip(BUCKETS, t["buckets"]):
+            lines.append(f'mvp_span_duration_seconds_bucket{{span="{name}",le="{le}"}} {n}')
+        lines.append(f'mvp_span_duration_seconds_bucket{{span="{name}",le="+Inf"}} {t["count"]}')
+        lines.append(f'mvp_span_duration_seconds_sum{{span="{name}"}} {t["sum"]:.6f}')
+        lines.append(f'mvp_span_duration_seconds_count{{span="{name}"}} {t["count"]}')
+
+    for metric, field, help_text in (
+        ("mvp_span_errors_total", "errors", "Spans terminados con excepción"),
+        ("mvp_span_bytes_total", "bytes", "Bytes recibidos dentro del span"),
+        ("mvp_span_points_total", "points", "Puntos de telemetría procesados"),
+    ):
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} counter")
+        for name, t in sorted(totals.items()):
+            lines.append(f'{metric}{{span="{name}"}} {t[field]}')
+
+    for fn in collectors:
+        try:
+            for metric, value in fn().items():
+                lines.append(f"{metric} {value}")
+        except Exception as err:
+            logging.warning(f"Colector de métricas falló: {err}")
+
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int):
+    """Sirve /metrics en un hilo aparte (una sola vez por proceso)."""
+    global _metrics_server
+    with _lock:
+        if _metrics_server is not None:
+            return _metrics_server
+        try:
+            _metrics_server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+        except OSError as err:
+            logging.warning(f"No se pudo iniciar el servidor de métricas en {port}: {err}")
+            return None
+    threading.Thread(target=_metrics_server.serve_forever, daemon=True).start()
+    logging.info(f"Métricas Prometheus disponibles en :{port}/metrics")
+    return _metrics_server
+
+
+def render_debug_panel():
+    """Panel de depuración en la barra lateral con tiempos y métricas."""
+    if not st.sidebar.checkbox("🛠 Panel de depuración", value=False, key="debug_panel"):
+        return
+
+    with st.sidebar.expander("⏱️ Tiempos por etapa", expanded=True):
+        st.dataframe(get_span_summary(), width="stretch", hide_index=True)
+
+    with st.sidebar.expander("🧾 Últimos spans"):
+        st.dataframe(get_recent_spans(), width="stretch", hide_index=True)
+
+    with _lock:
+        vistas = list(_debug_views.items())
+    for titulo, fn in vistas:
+        with st.sidebar.expander(titulo):
+            try:
+                st.dataframe(fn(), width="stretch", hide_index=True)
+            except Exception as e:
+                st.caption(f"No disponible: {e}")
+
+    with st.sidebar.expander("📈 Métricas Prometheus"):
+        text = render_prometheus()
+        st.code(text, language="text")
+        st.download_button("Descargar métricas", text, file_name="metrics.txt")
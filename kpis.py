@@ -0,0 +1,238 @@
+"""
+KPIs derivados de un snapshot de datos: promedios de flota y por zona,
+índice de riesgo de bloqueo, categoría de CE, pivots de heatmap, últimos
+valores y frescura de batería. Se calculan una vez por versión de snapshot (Snapshot.derived)
+y se sirven a todas las sesiones.
+"""
+import numpy as np
+import pandas as pd
+
+from features import agregar_columnas_temporales, pivot_periodo_dia
+from pyramid import Piramide
+
+
+def clamp(x, a=0.0, b=1.0):
+    return max(a, min(b, x))
+
+
+def riesgo_bloqueo(hum, temp, ec,
+                   w_h=0.35, w_t=0.15, w_e=0.50,
+                   t_low=15, t_high=25):
+    H_risk = clamp((100.0 - hum) / 100.0)
+    if t_low <= temp <= t_high:
+        T_risk = 0.0
+    elif temp > t_high:
+        T_risk = clamp((temp - t_high) / 15.0)
+    else:
+        T_risk = clamp((t_low - temp) / 15.0)
+    EC_risk = clamp((ec - 1.0) / (4.0 - 1.0))
+    R_raw = w_h * H_risk + w_t * T_risk + w_e * EC_risk
+    R = round(R_raw * 10.0, 1)
+    return {
+        'H_risk': H_risk,
+        'T_risk': T_risk,
+        'EC_risk': EC_risk,
+        'R_raw': R_raw,
+        'R_0_10': R
+    }
+
+
+def nivel_riesgo(R_score):
+    """Nivel y color del índice de riesgo (0–10)."""
+    if R_score < 3:
+        return "🟩 Bajo", '#2ecc71'
+    elif R_score < 6:
+        return "🟨 Moderado", '#f39c12'
+    return "🟥 Alto", '#e74c3c'
+
+
+def clasificar_ce(ce):
+    if ce < 1.0:
+        return "Bajo"
+    elif ce < 2.5:
+        return "Medio"
+    elif ce < 4.0:
+        return "Alto"
+    else:
+        return "Muy alto"
+
+
+def recomendacion_ce(categoria):
+    recomendaciones = {
+        "Bajo": "Suelo sano. Mantén riegos normales.",
+        "Medio": "Acumulación leve. Aumenta ligeramente el riego y revisa fertilización.",
+        "Alto": "Riesgo de estrés. Aplica riegos largos y evita fertilizantes salinos.",
+        "Muy alto": "Salinidad peligrosa. Realiza lavado de sales y revisa calidad del agua."
+    }
+    return recomendaciones[categoria]
+
+
+def color_ce(categoria):
+    colores = {
+        "Bajo": '#2ecc71',
+        "Medio": '#f39c12',
+        "Alto": '#e67e22',
+        "Muy alto": '#e74c3c'
+    }
+    return colores[categoria]
+
+
+def kpis_flota(df_all: pd.DataFrame, esquema: dict) -> dict:
+    """
+    Promedios por key de toda la flota (una sola agregación), índice de
+    riesgo de bloqueo y categoría de CE según el esquema de keys.
+    """
+    promedios = {}
+    if not df_all.empty:
+        promedios = df_all.groupby("key", sort=False)["value"].mean().astype(float).to_dict()
+    return kpis_desde_promedios(promedios, esquema)
+
+
+def kpis_desde_promedios(promedios: dict, esquema: dict) -> dict:
+    """
+    KPIs de flota a partir de promedios por key ya calculados (p. ej. de
+    EstadisticasFlota.promedios), sin recorrer la telemetría.
+    """
+    hum = promedios.get(esquema["humedad"])
+    temp = promedios.get(esquema["temperatura"])
+    ce = promedios.get(esquema["ce"])
+
+    riesgo = None
+    if hum is not None and temp is not None and ce is not None:
+        riesgo = riesgo_bloqueo(hum=hum, temp=temp, ec=ce)
+
+    return {
+        "promedios": promedios,
+        "riesgo": riesgo,
+        "ce_actual": ce,
+        "categoria_ce": clasificar_ce(ce) if ce is not None else None,
+    }
+
+
+def kpis_por_zona(promedios_zonas: dict, esquema: dict) -> pd.DataFrame:
+    """
+    Una fila por zona con las medias de humedad, temperatura y CE, el
+    índice de riesgo (0–10) y la categoría de CE, a partir de los
+    promedios por zona (EstadisticasFlota.promedios_zonas).
+    """
+    filas = []
+    for zona, promedios in promedios_zonas.items():
+        kpis = kpis_desde_promedios(promedios, esquema)
+        filas.append({
+            "zona": zona,
+            "humedad": promedios.get(esquema["humedad"], np.nan),
+            "temperatura": promedios.get(esquema["temperatura"], np.nan),
+            "ce": promedios.get(esquema["ce"], np.nan),
+            "riesgo": kpis["riesgo"]["R_0_10"] if kpis["riesgo"] is not None else np.nan,
+            "categoria_ce": kpis["categoria_ce"],
+        })
+    return pd.DataFrame(filas, columns=["zona", "humedad", "temperatura", "ce", "riesgo", "categoria_ce"])
+
+
+def tabla_zonas(kpis_zonas: pd.DataFrame, zonas: dict, atributos: pd.DataFrame, activas: pd.DataFrame,
+                sin_zona: str = "Sin zona") -> pd.DataFrame:
+    """
+    Resumen por zona para mostrar: los KPIs de kpis_por_zona más número de
+    dispositivos, cultivos (atributo crop) y series con alerta activa por
+    nivel. Las zonas con más riesgo primero.
+    """
+    zona_de = pd.Series(zonas, dtype=object)
+    tabla = kpis_zonas.set_index("zona").reindex(kpis_zonas["zona"].tolist() + [
+        z for z in zona_de.unique() if z not in set(kpis_zonas["zona"])
+    ])
+    tabla["dispositivos"] = zona_de.value_counts().reindex(tabla.index).fillna(0).astype(int)
+
+    tabla["cultivo"] = ""
+    if "crop" in atributos:
+        zona_atributos = zona_de.reindex(atributos.index).fillna(sin_zona)
+        cultivos = atributos["crop"].astype(object).groupby(zona_atributos).agg(
+            lambda c: ", ".join(sorted(c.dropna().unique()))
+        )
+        tabla["cultivo"] = cultivos.reindex(tabla.index).fillna("")
+
+    alertas = activas["device_id"].map(zonas).fillna(sin_zona)
+    for nivel in ("Crítico", "Precaución"):
+        tabla[nivel] = alertas[activas["nivel"] == nivel].value_counts().reindex(tabla.index).fillna(0).astype(int)
+
+    tabla["nivel"] = [nivel_riesgo(r)[0] if pd.notna(r) else "" for r in tabla["riesgo"]]
+    return tabla.sort_values("riesgo", ascending=False, na_position="last").reset_index(names="zona")
+
+
+def pivots_flota(df_all: pd.DataFrame) -> dict:
+    """Pivot período-del-día × fecha por key con la media de toda la flota."""
+    if df_all.empty:
+        return {}
+    df = agregar_columnas_temporales(df_all[["fecha", "key", "value"]].copy())
+    return {key: pivot_periodo_dia(g) for key, g in df.groupby("key", sort=False)}
+
+
+def ultimos_valores(df: pd.DataFrame) -> dict:
+    """Último valor por key, en el orden en que aparecen las keys."""
+    if df.empty:
+        return {}
+    ordenado = df.sort_values("fecha", kind="stable")
+    return ordenado.groupby("key", sort=False)["value"].last().astype(float).to_dict()
+
+
+def kpis_dispositivo(df: pd.DataFrame) -> dict:
+    """
+    Para un snapshot de dispositivo (con columnas temporales): pirámide
+    multirresolución por key, último valor por key, pivot período-del-día ×
+    fecha (desde el nivel horario) y fechas disponibles para la tabla de
+    detalle.
+    """
+    piramide = Piramide.desde_dataframe(df)
+    ultimos = ultimos_valores(df)
+    pivots = {
+        key: pivot_periodo_dia(agregar_columnas_temporales(piramide.consultar(key, nivel="1h")))
+        for key in piramide.keys
+    }
+    fechas = sorted(df["Fecha"].unique(), reverse=True) if "Fecha" in df else []
+    return {"piramide": piramide, "ultimos": ultimos, "pivots": pivots, "fechas": fechas}
+
+
+# Umbrales de antigüedad del último reporte de batería
+FRESCURA_LIMITES = [pd.Timedelta(hours=1), pd.Timedelta(hours=12), pd.Timedelta(days=1)]
+FRESCURA_COLORES = np.array(["green", "yellow", "orange", "red"], dtype=object)
+FRESCURA_ETIQUETAS = ["< 1 h", "1–12 h", "12–24 h", "> 1 día"]
+
+
+def frescura_bateria(df_battery: pd.DataFrame, now: pd.Timestamp) -> pd.DataFrame:
+    """
+    Añade 'diff' (antigüedad del último reporte), 'color' y 'frescura'
+    (categórica ordenada con FRESCURA_ETIQUETAS) de forma vectorizada:
+    verde < 1h ≤ amarillo < 12h ≤ naranja < 1 día ≤ rojo. Sin timestamp
+    queda en verde, como en la clasificación por comparaciones original.
+    """
+    df = df_battery.copy()
+    df["diff"] = now - df["timestamp"]
+    limites = np.array(FRESCURA_LIMITES, dtype="timedelta64[ns]")
+    antiguedad = df["diff"].to_numpy().astype("timedelta64[ns]")
+    clase = np.searchsorted(limites, antiguedad, side="right")
+    # searchsorted ordena NaT al final (rojo); toda comparación con NaT es falsa
+    clase[np.isnat(antiguedad)] = 0
+    df["color"] = FRESCURA_COLORES[clase]
+    df["frescura"] = pd.Categorical.from_codes(clase, categories=FRESCURA_ETIQUETAS, ordered=True)
+    return df
+
+
+# Estados del semáforo, en el orden de prioridad de determinar_estado
+ESTADOS = ["Óptimo", "Precaución", "Crítico", "Desconocido"]
+ESTADO_COLORES = np.array(["#2ecc71", "#f39c12", "#e74c3c", "#95a5a6"], dtype=object)
+ESTADO_ICONOS = np.array(["🟢", "🟡", "🔴", "⚪"], dtype=object)
+
+
+def estado_semaforo(valores, rangos: dict) -> np.ndarray:
+    """
+    Versión vectorizada de determinar_estado: índice en ESTADOS para cada
+    valor. Verde tiene prioridad sobre amarillo y amarillo sobre rojo; NaN
+    y valores fuera de todo rango quedan como 'Desconocido'.
+    """
+    v = np.asarray(valores, dtype="float64")
+    codigos = np.full(v.shape, 3, dtype=np.int8)
+    # Se asigna de menor a mayor prioridad para que la última gane
+    for codigo, tramos in ((2, rangos.get("rojo", [])), (1, rangos.get("amarillo", [])),
+                           (0, [rangos.get("verde", (0, 0))])):
+        for mn, mx in tramos:
+            codigos[(v >= mn) & (v <= mx)] = codigo
+    return codigos
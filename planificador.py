@@ -0,0 +1,142 @@
+"""
+Planificador de descargas de una página del dashboard.
+
+Antes de leer nada, las secciones declaran lo que necesitan en magnitudes
+del esquema (ver sensores): ventanas de telemetría por dispositivo y
+últimos valores. Al leer, el plan emite el mínimo de peticiones:
+
+- ventanas: por dispositivo, una sola lectura del SegmentCache con la unión
+  de keys y la envolvente de las ventanas declaradas; el caché pide solo
+  los días que faltan, agrupados en tramos consecutivos. Cada sección
+  recibe su recorte.
+- últimos valores (batería, estado actual de sensores): todas las
+  declaraciones se resuelven juntas con entitiesQuery, una petición por
+  página de dispositivos en lugar de una por dispositivo.
+
+Con TB_PARSE_PROCESSES > 0, precargar() resuelve las ventanas de la flota
+en una sola pasada: descargas en paralelo y decodificación en un pool de
+procesos (ver carga_flota).
+
+Cada parte se descarga como mucho una vez por plan y solo si alguna
+sección la lee: si los snapshots sirven la página, no se pide nada.
+"""
+import logging
+
+import pandas as pd
+
+import data_queries
+from instrumentation import span
+from segmentos import a_ms
+from sensores import ALIAS_KEYS
+
+
+class PlanDescargas:
+    """Necesidades de telemetría de un rerun de la página, para un esquema de keys."""
+
+    def __init__(self, esquema: dict, segmentos, jwt_token: str):
+        self.esquema = esquema
+        self.segmentos = segmentos
+        self.jwt_token = jwt_token
+        # device_id → [magnitudes, inicio, fin] (envolvente de lo declarado)
+        self._ventanas = {}
+        self._ids_ultimos = set()
+        self._magnitudes_ultimos = set()
+        self._descargadas = {}
+        self._ultimos = None
+
+    def _keys(self, magnitudes) -> list:
+        """Keys de las magnitudes en el orden del esquema: la clave del caché no depende del orden de declaración."""
+        return [key for magnitud, key in self.esquema.items() if magnitud in magnitudes]
+
+    # ── Declaración ──
+
+    def ventana(self, device_ids, magnitudes, inicio, fin) -> "PlanDescargas":
+        """Declara telemetría de `magnitudes` en [inicio, fin) para cada dispositivo."""
+        inicio, fin = pd.Timestamp(inicio), pd.Timestamp(fin)
+        for device_id in device_ids:
+            actual = self._ventanas.get(device_id)
+            if actual is None:
+                self._ventanas[device_id] = [set(magnitudes), inicio, fin]
+            else:
+                actual[0].update(magnitudes)
+                actual[1], actual[2] = min(actual[1], inicio), max(actual[2], fin)
+        return self
+
+    def ultimos(self, device_ids, magnitudes) -> "PlanDescargas":
+        """Declara el último valor de `magnitudes` para cada dispositivo."""
+        self._ids_ultimos.update(device_ids)
+        self._magnitudes_ultimos.update(magnitudes)
+        return self
+
+    # ── Lectura ──
+
+    def precargar(self, device_ids, procesos: int = None) -> "PlanDescargas":
+        """
+        Descarga de una vez las ventanas declaradas de `device_ids` que aún
+        no se leyeron, decodificándolas en un pool de `procesos` (por
+        defecto TB_PARSE_PROCESSES). Con 0 no hace nada: cada telemetria()
+        lee su ventana al pedirla.
+        """
+        procesos = data_queries.TB_PARSE_PROCESSES if procesos is None else procesos
+        if not procesos:
+            return self
+        grupos = {}
+        for device_id in device_ids:
+            if device_id in self._ventanas and device_id not in self._descargadas:
+                declaradas, inicio, fin = self._ventanas[device_id]
+                grupos.setdefault((",".join(self._keys(declaradas)), inicio, fin), []).append(device_id)
+        for (keys, inicio, fin), ids in grupos.items():
+            try:
+                self._descargadas.update(
+                    self.segmentos.get_windows(ids, self.jwt_token, inicio, fin, keys=keys, procesos=procesos)
+                )
+            except Exception as err:
+                # Sin pool, telemetria() descarga cada dispositivo en este proceso
+                logging.error(f"No se pudo precargar la flota en {procesos} procesos: {err}")
+        return self
+
+    def telemetria(self, device_id: str, inicio=None, fin=None, magnitudes=None) -> pd.DataFrame:
+        """
+        Telemetría declarada del dispositivo (ts, value, key, fecha),
+        recortada a [inicio, fin) y a `magnitudes` si se indican.
+        """
+        if device_id not in self._ventanas:
+            raise KeyError(f"Ventana no declarada para el dispositivo {device_id}")
+        declaradas, inicio_plan, fin_plan = self._ventanas[device_id]
+
+        df = self._descargadas.get(device_id)
+        if df is None:
+            keys = ",".join(self._keys(declaradas))
+            df = self._descargadas[device_id] = self.segmentos.get_window(
+                device_id, self.jwt_token, inicio_plan, fin_plan, keys=keys
+            )
+
+        mascara = None
+        if inicio is not None and pd.Timestamp(inicio) > inicio_plan:
+            mascara = df["ts"] >= a_ms(inicio)
+        if fin is not None and pd.Timestamp(fin) < fin_plan:
+            fin_ok = df["ts"] < a_ms(fin)
+            mascara = fin_ok if mascara is None else mascara & fin_ok
+        if magnitudes is not None and set(magnitudes) != declaradas:
+            key_ok = df["key"].isin(self._keys(magnitudes))
+            mascara = key_ok if mascara is None else mascara & key_ok
+        return df if mascara is None else df[mascara].reset_index(drop=True)
+
+    def ultimos_valores(self, magnitudes=None, device_ids=None) -> pd.DataFrame:
+        """
+        Últimos valores declarados (device_id, key, magnitud, ts, fecha,
+        value); todas las declaraciones se descargan juntas la primera vez.
+        """
+        if self._ultimos is None:
+            keys = self._keys(self._magnitudes_ultimos)
+            with span("plan.ultimos", devices=len(self._ids_ultimos), keys=len(keys)):
+                df = data_queries.get_latest_values(self.jwt_token, keys, device_ids=self._ids_ultimos)
+            df["magnitud"] = df["key"].map(ALIAS_KEYS)
+            self._ultimos = df
+
+        df = self._ultimos
+        if magnitudes is not None:
+            df = df[df["magnitud"].isin(list(magnitudes))]
+        if device_ids is not None:
+            df = df[df["device_id"].isin(list(device_ids))]
+        return df.reset_index(drop=True)
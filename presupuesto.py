@@ -0,0 +1,229 @@
+"""
+Presupuesto de memoria compartido por los cachés del proceso.
+
+Los cachés (snapshots de telemetría, KPIs derivados, segmentos de día)
+registran aquí cada entrada con su tamaño estimado en bytes. Si la suma
+supera el presupuesto se expulsan entradas de cualquier caché con la
+política GreedyDual-Size-Frequency: prioridad = reloj + accesos / MB. Las
+entradas grandes y poco usadas salen primero, las pequeñas y calientes se
+quedan, y el reloj (la prioridad de la última expulsada) envejece lo que
+deja de usarse, como un LRU.
+
+Las expulsiones se ejecutan fuera del lock del presupuesto llamando al
+caché dueño, que descarta la entrada solo si sigue siendo la misma (una
+recarga concurrente puede haberla reemplazado).
+"""
+import heapq
+import itertools
+import logging
+import sys
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+MB = 1024 * 1024
+
+
+def tamano_bytes(obj, _vistos: set = None) -> int:
+    """
+    Tamaño aproximado en memoria: buffers de DataFrames, Series y arrays
+    (sin recorrer objetos Python de columnas object) y recorrido de
+    dicts, listas y atributos de objetos. Cada objeto se cuenta una vez.
+    """
+    vistos = set() if _vistos is None else _vistos
+    if id(obj) in vistos:
+        return 0
+    vistos.add(id(obj))
+    if isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        usado = obj.memory_usage(index=True, deep=False)
+        return int(usado.sum() if isinstance(obj, pd.DataFrame) else usado)
+    if isinstance(obj, np.ndarray):
+        return int(obj.nbytes)
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(tamano_bytes(k, vistos) + tamano_bytes(v, vistos) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(tamano_bytes(v, vistos) for v in obj)
+    if hasattr(obj, "__dict__"):
+        return sys.getsizeof(obj) + tamano_bytes(vars(obj), vistos)
+    if hasattr(obj, "__slots__"):
+        return sys.getsizeof(obj) + sum(tamano_bytes(getattr(obj, s, None), vistos) for s in obj.__slots__)
+    return sys.getsizeof(obj)
+
+
+class _Entrada:
+    __slots__ = ("cache", "clave", "nbytes", "accesos", "prioridad", "expulsar", "alta")
+
+    def __init__(self, cache: str, clave, nbytes: int, expulsar):
+        self.cache = cache
+        self.clave = clave
+        self.nbytes = max(int(nbytes), 1)
+        self.accesos = 1
+        self.prioridad = 0.0
+        self.expulsar = expulsar
+        self.alta = time.monotonic()
+
+
+class PresupuestoMemoria:
+    """
+    Presupuesto de `max_bytes` para todas las entradas registradas.
+    Compartido entre sesiones (st.cache_resource); los cachés lo reciben
+    al construirse.
+    """
+
+    def __init__(self, max_bytes: int = 1024 * MB, max_log: int = 200):
+        self.max_bytes = int(max_bytes)
+        self._lock = threading.Lock()
+        self._entradas = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._reloj = 0.0
+        self.bytes = 0
+        self._por_cache = {}
+        self._log = deque(maxlen=max_log)
+
+    def _cache(self, cache: str) -> dict:
+        return self._por_cache.setdefault(cache, {
+            "entradas": 0, "bytes": 0, "aciertos": 0, "fallos": 0, "expulsiones": 0, "bytes_expulsados": 0,
+        })
+
+    def _priorizar(self, e: _Entrada):
+        e.prioridad = self._reloj + e.accesos * MB / e.nbytes
+        heapq.heappush(self._heap, (e.prioridad, next(self._seq), (e.cache, e.clave), e))
+
+    def _quitar(self, e: _Entrada):
+        del self._entradas[(e.cache, e.clave)]
+        self.bytes -= e.nbytes
+        stats = self._cache(e.cache)
+        stats["entradas"] -= 1
+        stats["bytes"] -= e.nbytes
+
+    def _seleccionar_expulsiones(self) -> list:
+        """Saca entradas de menor prioridad hasta quedar dentro del presupuesto."""
+        expulsadas = []
+        while self.bytes > self.max_bytes and self._heap:
+            prioridad, _, ident, e = heapq.heappop(self._heap)
+            if self._entradas.get(ident) is not e or e.prioridad != prioridad:
+                continue  # entrada reemplazada o con prioridad actualizada
+            self._reloj = prioridad
+            self._quitar(e)
+            stats = self._cache(e.cache)
+            stats["expulsiones"] += 1
+            stats["bytes_expulsados"] += e.nbytes
+            self._log.append({"cache": e.cache, "clave": str(e.clave), "bytes": e.nbytes,
+                              "accesos": e.accesos, "expulsada": pd.Timestamp.now()})
+            expulsadas.append(e)
+        # Montículo con demasiadas entradas obsoletas: reconstruir
+        if len(self._heap) > 4 * len(self._entradas) + 64:
+            self._heap = [(e.prioridad, next(self._seq), k, e) for k, e in self._entradas.items()]
+            heapq.heapify(self._heap)
+        return expulsadas
+
+    @staticmethod
+    def _ejecutar(expulsadas: list):
+        for e in expulsadas:
+            try:
+                e.expulsar()
+            except Exception as err:
+                logging.warning(f"Error al expulsar {e.cache}:{e.clave}: {err}")
+
+    # ── API de los cachés ──
+
+    def alta(self, cache: str, clave, nbytes: int, expulsar) -> bool:
+        """
+        Registra (o reemplaza) una entrada y expulsa lo necesario. Una
+        entrada mayor que todo el presupuesto no se admite: se llama a
+        `expulsar` y se retorna False.
+        """
+        if nbytes > self.max_bytes:
+            self._rechazar(cache, clave, nbytes)
+            self._ejecutar([_Entrada(cache, clave, nbytes, expulsar)])
+            return False
+        with self._lock:
+            anterior = self._entradas.get((cache, clave))
+            if anterior is not None:
+                self._quitar(anterior)
+            e = _Entrada(cache, clave, nbytes, expulsar)
+            self._entradas[(cache, clave)] = e
+            self.bytes += e.nbytes
+            stats = self._cache(cache)
+            stats["entradas"] += 1
+            stats["bytes"] += e.nbytes
+            self._priorizar(e)
+            expulsadas = self._seleccionar_expulsiones()
+        self._ejecutar(expulsadas)
+        return True
+
+    def _rechazar(self, cache: str, clave, nbytes: int):
+        """Cuenta como expulsada una entrada que no cabe en el presupuesto."""
+        with self._lock:
+            stats = self._cache(cache)
+            stats["expulsiones"] += 1
+            stats["bytes_expulsados"] += int(nbytes)
+            self._log.append({"cache": cache, "clave": str(clave), "bytes": int(nbytes),
+                              "accesos": 0, "expulsada": pd.Timestamp.now()})
+
+    def acierto(self, cache: str, clave):
+        """Acceso a una entrada cacheada: sube su prioridad."""
+        with self._lock:
+            self._cache(cache)["aciertos"] += 1
+            e = self._entradas.get((cache, clave))
+            if e is not None:
+                e.accesos += 1
+                self._priorizar(e)
+
+    def fallo(self, cache: str):
+        with self._lock:
+            self._cache(cache)["fallos"] += 1
+
+    def baja(self, cache: str, clave):
+        """El caché descartó la entrada por su cuenta (TTL, reemplazo, tope de entradas)."""
+        with self._lock:
+            e = self._entradas.get((cache, clave))
+            if e is not None:
+                self._quitar(e)
+
+    # ── Consultas ──
+
+    def resumen(self) -> pd.DataFrame:
+        """Por caché: entradas, MB, aciertos, fallos, tasa de acierto y expulsiones."""
+        with self._lock:
+            filas = [{"cache": c, **s} for c, s in self._por_cache.items()]
+        df = pd.DataFrame(filas, columns=["cache", "entradas", "bytes", "aciertos", "fallos",
+                                          "expulsiones", "bytes_expulsados"])
+        accesos = df["aciertos"] + df["fallos"]
+        df["tasa_acierto"] = (df["aciertos"] / accesos.where(accesos > 0)).round(3)
+        df["MB"] = (df["bytes"] / MB).round(2)
+        df["MB_expulsados"] = (df["bytes_expulsados"] / MB).round(2)
+        return df[["cache", "entradas", "MB", "aciertos", "fallos", "tasa_acierto", "expulsiones", "MB_expulsados"]]
+
+    def entradas(self, limite: int = 50) -> pd.DataFrame:
+        """Entradas más grandes con sus accesos y prioridad."""
+        with self._lock:
+            filas = [
+                {"cache": e.cache, "clave": str(e.clave), "MB": e.nbytes / MB, "accesos": e.accesos,
+                 "prioridad": e.prioridad, "edad_s": time.monotonic() - e.alta}
+                for e in heapq.nlargest(limite, self._entradas.values(), key=lambda e: e.nbytes)
+            ]
+        return pd.DataFrame(filas, columns=["cache", "clave", "MB", "accesos", "prioridad", "edad_s"]).round(3)
+
+    def expulsiones(self, limite: int = 50) -> pd.DataFrame:
+        """Últimas expulsiones, la más reciente primero."""
+        with self._lock:
+            filas = list(self._log)[-limite:][::-1]
+        return pd.DataFrame(filas, columns=["cache", "clave", "bytes", "accesos", "expulsada"])
+
+    def metricas(self) -> dict:
+        """Métricas para register_collector."""
+        metricas = {"mvp_cache_budget_bytes": self.max_bytes, "mvp_cache_used_bytes": self.bytes}
+        with self._lock:
+            por_cache = {c: dict(s) for c, s in self._por_cache.items()}
+        for cache, s in por_cache.items():
+            metricas[f'mvp_cache_entries{{cache="{cache}"}}'] = s["entradas"]
+            metricas[f'mvp_cache_bytes{{cache="{cache}"}}'] = s["bytes"]
+            metricas[f'mvp_cache_hits_total{{cache="{cache}"}}'] = s["aciertos"]
+            metricas[f'mvp_cache_misses_total{{cache="{cache}"}}'] = s["fallos"]
+            metricas[f'mvp_cache_evictions_total{{cache="{cache}"}}'] = s["expulsiones"]
+        return metricas
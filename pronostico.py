@@ -0,0 +1,263 @@
+"""
+Pronóstico horario de humedad y temperatura para toda la flota.
+
+Cada serie tiene un modelo Holt-Winters aditivo (nivel, tendencia amortiguada
+y estacionalidad diaria de 24 horas) sobre medias horarias. Los puntos
+llegan por el bus de deltas y se promedian por hora; al cerrarse una hora
+se actualiza el modelo. El estado de todas las series vive en arrays NumPy
+y se actualiza por pasos (una hora por serie y paso, como el detector de
+anomalías), así que ajustar la flota entera son unas pocas operaciones
+vectorizadas por hora nueva y no un bucle por dispositivo.
+
+El pronóstico de todas las series se obtiene de una vez: una matriz
+series × horizonte a partir del estado guardado, con una banda aproximada
+a partir del error de predicción a un paso.
+"""
+import threading
+
+import numpy as np
+import pandas as pd
+
+from deltas import pasos_por_serie
+from instrumentation import span
+from sensores import ALIAS_KEYS
+
+HORA_MS = 60 * 60 * 1000
+MAGNITUDES_PRONOSTICO = ("humedad", "temperatura")
+COLUMNAS_PRONOSTICO = ["device_id", "key", "fecha", "value", "inferior", "superior"]
+# Cuantil normal de la banda del 95 %
+_Z_BANDA = 1.96
+
+
+class Pronosticador:
+    """
+    Modelos de toda la flota, compartidos entre sesiones (st.cache_resource).
+    Suscribir `procesar` a un DeltaBus.
+    """
+
+    def __init__(self, alpha: float = 0.1, beta: float = 0.01, gamma: float = 0.3, phi: float = 0.98,
+                 periodo: int = 24, min_horas: int = 48, max_hueco: int = 24 * 7,
+                 magnitudes=MAGNITUDES_PRONOSTICO, capacidad: int = 1024):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.phi = phi
+        self.periodo = periodo
+        # Horas observadas antes de pronosticar (dos ciclos para la estacionalidad)
+        self.min_horas = min_horas
+        # Un hueco mayor reinicia el modelo de la serie
+        self.max_hueco = max_hueco
+        self.magnitudes = magnitudes
+        self._lock = threading.Lock()
+        self._claves = {}
+        self._estado = {
+            "activa": np.zeros(capacidad, dtype=bool),
+            "vista": np.zeros(capacidad, dtype=bool),
+            "nivel": np.zeros(capacidad),
+            "tendencia": np.zeros(capacidad),
+            "var_error": np.zeros(capacidad),
+            "n": np.zeros(capacidad, dtype=np.int64),
+            "ultima_hora": np.full(capacidad, -1, dtype=np.int64),
+            "ultimo_valor": np.full(capacidad, np.nan),
+            # Hora aún abierta: se acumula hasta que llega un punto de una hora posterior
+            "hora_abierta": np.full(capacidad, -1, dtype=np.int64),
+            "suma": np.zeros(capacidad),
+            "cuenta": np.zeros(capacidad, dtype=np.int64),
+        }
+        self._estacion = np.zeros((capacidad, periodo))
+        self._stats = {"puntos": 0, "horas": 0}
+
+    # ── Estado por serie ──
+
+    def _registrar(self, delta: pd.DataFrame) -> np.ndarray:
+        """Número de serie de cada punto; marca como activas las de MAGNITUDES_PRONOSTICO."""
+        series = delta["serie"].to_numpy(dtype=np.int64)
+        capacidad = len(self._estado["n"])
+        if series.max() >= capacidad:
+            nueva = max(int(series.max()) + 1, 2 * capacidad)
+            for nombre, arr in self._estado.items():
+                relleno = {"ultima_hora": -1, "hora_abierta": -1, "ultimo_valor": np.nan}.get(nombre, 0)
+                self._estado[nombre] = np.concatenate([arr, np.full(nueva - capacidad, relleno, dtype=arr.dtype)])
+            self._estacion = np.concatenate([self._estacion, np.zeros((nueva - capacidad, self.periodo))])
+        sin_ver = np.flatnonzero(~self._estado["vista"][series])
+        if len(sin_ver):
+            nuevas, primera = np.unique(series[sin_ver], return_index=True)
+            filas = sin_ver[primera]
+            claves = zip(delta["device_id"].to_numpy()[filas].tolist(), delta["key"].to_numpy()[filas].tolist())
+            for serie, clave in zip(nuevas.tolist(), claves):
+                self._claves[serie] = clave
+                self._estado["activa"][serie] = ALIAS_KEYS.get(clave[1]) in self.magnitudes
+            self._estado["vista"][nuevas] = True
+        return series
+
+    def _horas_cerradas(self, series: np.ndarray, ts: np.ndarray, valores: np.ndarray) -> tuple:
+        """
+        Agrupa los puntos (ordenados por serie y ts) en medias horarias. La
+        última hora de cada serie queda abierta; las anteriores, y la que
+        estaba abierta si el delta ya trae una hora posterior, se cierran.
+        Retorna (series, horas, medias) de las horas cerradas.
+        """
+        e = self._estado
+        horas = ts // HORA_MS
+        cambio = np.r_[True, (series[1:] != series[:-1]) | (horas[1:] != horas[:-1])]
+        inicios = np.flatnonzero(cambio)
+        g_serie, g_hora = series[inicios], horas[inicios]
+        g_suma = np.add.reduceat(valores, inicios)
+        g_cuenta = np.diff(np.r_[inicios, len(series)])
+
+        primero = np.r_[True, g_serie[1:] != g_serie[:-1]]
+        ultimo = np.r_[g_serie[1:] != g_serie[:-1], True]
+
+        # Hora abierta de una entrega anterior: se suma a su grupo o se cierra sola
+        abierta = e["hora_abierta"][g_serie]
+        continua = primero & (g_hora == abierta)
+        g_suma[continua] += e["suma"][g_serie[continua]]
+        g_cuenta[continua] += e["cuenta"][g_serie[continua]]
+        cierra = primero & (abierta >= 0) & (g_hora > abierta)
+        previas = g_serie[cierra]
+
+        cerradas = ~ultimo
+        c_serie = np.r_[previas, g_serie[cerradas]]
+        c_hora = np.r_[e["hora_abierta"][previas], g_hora[cerradas]]
+        c_media = np.r_[e["suma"][previas] / e["cuenta"][previas], g_suma[cerradas] / g_cuenta[cerradas]]
+
+        fin = g_serie[ultimo]
+        e["hora_abierta"][fin] = g_hora[ultimo]
+        e["suma"][fin] = g_suma[ultimo]
+        e["cuenta"][fin] = g_cuenta[ultimo]
+        return c_serie, c_hora, c_media
+
+    def _paso(self, f: np.ndarray, hora: np.ndarray, y: np.ndarray):
+        """Una hora cerrada por serie (filas `f` sin repetir): actualiza Holt-Winters."""
+        e = self._estado
+        n = e["n"][f]
+        hueco = hora - e["ultima_hora"][f] - 1
+        reinicio = (n == 0) | (hueco > self.max_hueco)
+        nivel, tendencia = e["nivel"][f], e["tendencia"][f]
+        # Las horas sin datos avanzan el nivel con la tendencia amortiguada
+        previo = nivel + tendencia * np.where(reinicio, 0, hueco)
+        fase = hora % self.periodo
+        estacion = self._estacion[f, fase]
+
+        prediccion = previo + self.phi * tendencia + estacion
+        error = y - prediccion
+        nivel_nuevo = self.alpha * (y - estacion) + (1 - self.alpha) * (previo + self.phi * tendencia)
+        tendencia_nueva = self.beta * (nivel_nuevo - previo) + (1 - self.beta) * self.phi * tendencia
+        estacion_nueva = self.gamma * (y - nivel_nuevo) + (1 - self.gamma) * estacion
+        calentando = n < self.periodo
+
+        e["nivel"][f] = np.where(reinicio, y, nivel_nuevo)
+        e["tendencia"][f] = np.where(reinicio, 0.0, tendencia_nueva)
+        self._estacion[f, fase] = np.where(reinicio, 0.0, estacion_nueva)
+        self._estacion[f[reinicio]] = 0.0
+        e["var_error"][f] = np.where(
+            reinicio, 0.0, np.where(calentando, e["var_error"][f], (1 - self.alpha) * e["var_error"][f] + self.alpha * error ** 2)
+        )
+        e["n"][f] = np.where(reinicio, 1, n + 1)
+        e["ultima_hora"][f] = hora
+        e["ultimo_valor"][f] = y
+
+    # ── Procesamiento ──
+
+    def procesar(self, delta: pd.DataFrame):
+        """Incorpora un delta (device_id, key, serie, ts, value) ordenado por serie y ts."""
+        if delta.empty:
+            return
+        with self._lock, span("pronostico.delta", points=len(delta)) as sp:
+            series = self._registrar(delta)
+            valores = delta["value"].to_numpy(dtype="float64")
+            utiles = self._estado["activa"][series] & np.isfinite(valores)
+            self._stats["puntos"] += int(utiles.sum())
+            if not utiles.any():
+                return
+            c_serie, c_hora, c_media = self._horas_cerradas(
+                series[utiles], delta["ts"].to_numpy(dtype="int64")[utiles], valores[utiles]
+            )
+            for sel in pasos_por_serie(c_serie, c_hora):
+                self._paso(c_serie[sel], c_hora[sel], c_media[sel])
+            sp["hours"] = len(c_serie)
+            self._stats["horas"] += len(c_serie)
+
+    # ── Pronóstico ──
+
+    def _listas(self, device_id: str = None) -> np.ndarray:
+        """Series con modelo listo (al menos `min_horas`), opcionalmente de un dispositivo."""
+        e = self._estado
+        listas = e["activa"] & (e["n"] >= self.min_horas)
+        if device_id is not None:
+            propias = [s for s, c in self._claves.items() if c[0] == device_id]
+            listas &= np.isin(np.arange(len(listas)), propias)
+        return np.flatnonzero(listas)
+
+    def _matriz(self, sel: np.ndarray, horizonte: int) -> tuple:
+        """(horas, predicción, semiancho de banda) como matrices series × horizonte."""
+        e = self._estado
+        k = np.arange(1, horizonte + 1)
+        amortiguada = np.cumsum(self.phi ** k)
+        horas = e["ultima_hora"][sel, None] + k
+        prediccion = (e["nivel"][sel, None] + amortiguada * e["tendencia"][sel, None]
+                      + self._estacion[sel[:, None], horas % self.periodo])
+        # Aproximación de suavizado simple: var_k = σ²·(1 + (k−1)·α²)
+        semiancho = _Z_BANDA * np.sqrt(e["var_error"][sel, None] * (1 + (k - 1) * self.alpha ** 2))
+        return horas, prediccion, semiancho
+
+    def pronosticar(self, device_id: str = None, horizonte: int = 24) -> pd.DataFrame:
+        """
+        Pronóstico horario de las próximas `horizonte` horas tras la última
+        hora cerrada de cada serie (de un dispositivo o de toda la flota).
+        """
+        with self._lock:
+            sel = self._listas(device_id)
+            if not len(sel):
+                return pd.DataFrame(columns=COLUMNAS_PRONOSTICO)
+            horas, prediccion, semiancho = self._matriz(sel, horizonte)
+            claves = [self._claves[s] for s in sel.tolist()]
+        return pd.DataFrame({
+            "device_id": np.repeat(np.array([c[0] for c in claves], dtype=object), horizonte),
+            "key": np.repeat(np.array([c[1] for c in claves], dtype=object), horizonte),
+            "fecha": (horas.ravel() * HORA_MS).astype("datetime64[ms]"),
+            "value": prediccion.ravel(),
+            "inferior": (prediccion - semiancho).ravel(),
+            "superior": (prediccion + semiancho).ravel(),
+        })
+
+    def extremos(self, magnitud: str = "humedad", horizonte: int = 24) -> pd.DataFrame:
+        """
+        Por serie de la magnitud: último valor horario y mínimo y máximo
+        previstos en el horizonte, con la hora del mínimo. Toda la flota en
+        una pasada.
+        """
+        with self._lock:
+            sel = self._listas()
+            claves = [self._claves[s] for s in sel.tolist()]
+            propias = np.array([ALIAS_KEYS.get(c[1]) == magnitud for c in claves], dtype=bool)
+            sel = sel[propias]
+            claves = [c for c, p in zip(claves, propias.tolist()) if p]
+            if not len(sel):
+                return pd.DataFrame(columns=["device_id", "key", "actual", "minimo", "hora_minimo", "maximo"])
+            horas, prediccion, _ = self._matriz(sel, horizonte)
+            actual = self._estado["ultimo_valor"][sel]
+        posicion = prediccion.argmin(axis=1)
+        return pd.DataFrame({
+            "device_id": [c[0] for c in claves],
+            "key": [c[1] for c in claves],
+            "actual": actual,
+            "minimo": prediccion[np.arange(len(sel)), posicion],
+            "hora_minimo": (horas[np.arange(len(sel)), posicion] * HORA_MS).astype("datetime64[ms]"),
+            "maximo": prediccion.max(axis=1),
+        })
+
+    def stats(self) -> dict:
+        with self._lock:
+            e = self._estado
+            return {**self._stats, "series": int(e["activa"].sum()),
+                    "listas": int((e["activa"] & (e["n"] >= self.min_horas)).sum())}
+
+    def metricas(self) -> dict:
+        """Métricas para register_collector."""
+        stats = self.stats()
+        return {
+            "mvp_pronostico_puntos_total": stats["puntos"],
+            "mvp_pronostico_horas_total": stats["horas"],
+            "mvp_pronostico_series_listas": stats["listas"],
+        }
@@ -0,0 +1,193 @@
+"""
+Pirámide multirresolución de series temporales por dispositivo y key.
+
+Cada serie guarda los puntos crudos y niveles agregados de 5 minutos,
+1 hora y 1 día (min, max, media y conteo). Cada nivel se calcula a partir
+del anterior, y al añadir puntos nuevos solo se recalculan los buckets
+afectados. Las consultas eligen el nivel más grueso que aún da al menos
+un bucket por píxel de la ventana pedida, así que dibujar un año cuesta
+lo mismo que dibujar un día.
+"""
+import numpy as np
+import pandas as pd
+
+NS = 1_000_000_000
+
+# Niveles agregados, de más fino a más grueso (ancho del bucket en ns)
+NIVELES = {
+    "5min": 5 * 60 * NS,
+    "1h": 60 * 60 * NS,
+    "1d": 24 * 60 * 60 * NS,
+}
+
+
+def _a_ns(fechas) -> np.ndarray:
+    """Fechas (Series, DatetimeIndex o array) a int64 en nanosegundos."""
+    return np.asarray(fechas, dtype="datetime64[ns]").view("int64")
+
+
+def _reducir(nivel: dict, paso: int) -> dict:
+    """Agrupa buckets ordenados (o puntos crudos) en buckets de ancho `paso`."""
+    t = nivel["t"]
+    if not len(t):
+        return {c: a[:0] for c, a in nivel.items()}
+    buckets = t - t % paso
+    inicio = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    return {
+        "t": buckets[inicio],
+        "sum": np.add.reduceat(nivel["sum"], inicio),
+        "min": np.minimum.reduceat(nivel["min"], inicio),
+        "max": np.maximum.reduceat(nivel["max"], inicio),
+        "count": np.add.reduceat(nivel["count"], inicio),
+    }
+
+
+def _cabeza(nivel: dict, hasta: int) -> dict:
+    i = np.searchsorted(nivel["t"], hasta, side="left")
+    return {c: a[:i] for c, a in nivel.items()}
+
+
+def _unir(a: dict, b: dict) -> dict:
+    return {c: np.concatenate([a[c], b[c]]) for c in a}
+
+
+class SeriePiramide:
+    """Pirámide de una sola serie (un dispositivo, una key)."""
+
+    def __init__(self, fechas=(), valores=()):
+        self._t = np.empty(0, dtype="int64")
+        self._v = np.empty(0, dtype="float64")
+        self.niveles = {}
+        self.agregar(fechas, valores)
+
+    def __len__(self):
+        return len(self._t)
+
+    @property
+    def inicio(self):
+        return pd.Timestamp(self._t[0]) if len(self._t) else None
+
+    @property
+    def fin(self):
+        return pd.Timestamp(self._t[-1]) if len(self._t) else None
+
+    def _nivel_crudo(self, desde: int) -> dict:
+        i = np.searchsorted(self._t, desde, side="left")
+        v = self._v[i:]
+        return {"t": self._t[i:], "sum": v, "min": v, "max": v, "count": np.ones(len(v), dtype="int64")}
+
+    def _recalcular(self, desde: int):
+        """
+        Recalcula todos los niveles desde el inicio del día de `desde`. Los
+        anchos de bucket son divisores del día, así que ningún bucket
+        anterior a ese corte cambia.
+        """
+        corte = desde - desde % max(NIVELES.values())
+        fuente = self._nivel_crudo(corte)
+        for nombre, paso in NIVELES.items():
+            nuevo = _reducir(fuente, paso)
+            previo = self.niveles.get(nombre)
+            self.niveles[nombre] = _unir(_cabeza(previo, corte), nuevo) if previo is not None else nuevo
+            fuente = nuevo
+
+    def agregar(self, fechas, valores):
+        """
+        Añade puntos a la serie. Si todos son posteriores al último punto
+        solo se recalcula la cola de cada nivel; si no, se reconstruye.
+        """
+        t = _a_ns(fechas)
+        v = np.asarray(valores, dtype="float64")
+        validos = ~np.isnan(v)
+        t, v = t[validos], v[validos]
+        if not len(t):
+            return
+        orden = np.argsort(t, kind="stable")
+        t, v = t[orden], v[orden]
+
+        if len(self._t) and t[0] <= self._t[-1]:
+            t = np.concatenate([self._t, t])
+            v = np.concatenate([self._v, v])
+            # Ante timestamps repetidos se queda el último valor recibido
+            orden = np.argsort(t, kind="stable")
+            t, v = t[orden], v[orden]
+            ultimo = np.r_[t[1:] != t[:-1], True]
+            self._t, self._v = t[ultimo], v[ultimo]
+            self.niveles = {}
+            desde = int(self._t[0])
+        else:
+            self._t = np.concatenate([self._t, t])
+            self._v = np.concatenate([self._v, v])
+            desde = int(t[0])
+        self._recalcular(desde)
+
+    def nivel_para(self, inicio=None, fin=None, ancho_px: int = 1200) -> str:
+        """Nivel más grueso con al menos un bucket por píxel; 'raw' si ninguno."""
+        if not len(self._t):
+            return "raw"
+        t0 = _a_ns([inicio])[0] if inicio is not None else self._t[0]
+        t1 = _a_ns([fin])[0] if fin is not None else self._t[-1]
+        ventana = max(int(t1 - t0), 0)
+        for nombre, paso in reversed(NIVELES.items()):
+            if ventana // paso >= ancho_px:
+                return nombre
+        return "raw"
+
+    def consultar(self, inicio=None, fin=None, ancho_px: int = 1200, nivel: str = None) -> pd.DataFrame:
+        """
+        Serie en la ventana [inicio, fin] con columnas fecha, value (media),
+        min, max y count. `nivel` fuerza una resolución concreta.
+        """
+        nivel = nivel or self.nivel_para(inicio, fin, ancho_px)
+        datos = self._nivel_crudo(self._t[0] if len(self._t) else 0) if nivel == "raw" else self.niveles[nivel]
+
+        t = datos["t"]
+        i0 = np.searchsorted(t, _a_ns([inicio])[0], side="left") if inicio is not None else 0
+        i1 = np.searchsorted(t, _a_ns([fin])[0], side="right") if fin is not None else len(t)
+        conteo = datos["count"][i0:i1]
+        df = pd.DataFrame({
+            "fecha": t[i0:i1].view("datetime64[ns]"),
+            "value": datos["sum"][i0:i1] / conteo,
+            "min": datos["min"][i0:i1],
+            "max": datos["max"][i0:i1],
+            "count": conteo,
+        })
+        df.attrs["nivel"] = nivel
+        return df
+
+
+class Piramide:
+    """Pirámides de todas las keys de un dispositivo."""
+
+    def __init__(self):
+        self.series = {}
+
+    @classmethod
+    def desde_dataframe(cls, df: pd.DataFrame) -> "Piramide":
+        """Construye la pirámide desde un DataFrame con columnas fecha, key y value."""
+        piramide = cls()
+        piramide.agregar(df)
+        return piramide
+
+    def agregar(self, df: pd.DataFrame):
+        """Añade telemetría (fecha, key, value) a las series correspondientes."""
+        if df.empty:
+            return
+        for key, g in df.groupby("key", sort=False):
+            serie = self.series.get(key)
+            if serie is None:
+                self.series[key] = SeriePiramide(g["fecha"], g["value"])
+            else:
+                serie.agregar(g["fecha"], g["value"])
+
+    @property
+    def keys(self) -> list:
+        return list(self.series)
+
+    def get(self, key):
+        return self.series.get(key)
+
+    def consultar(self, key, inicio=None, fin=None, ancho_px: int = 1200, nivel: str = None) -> pd.DataFrame:
+        serie = self.series.get(key)
+        if serie is None:
+            return pd.DataFrame(columns=["fecha", "value", "min", "max", "count"])
+        return serie.consultar(inicio, fin, ancho_px, nivel)
@@ -0,0 +1,373 @@
+"""
+Capa de resiliencia para las peticiones a ThingsBoard.
+
+- Concurrencia adaptativa (AIMD): un límite de peticiones simultáneas
+  compartido por todas las sesiones y hilos del proceso. Sube +1 por
+  "ronda" de respuestas rápidas y se reduce a la mitad con 429, 5xx,
+  timeouts o latencia por encima del objetivo.
+- Retry-After: un 429/503 con esa cabecera pausa todas las peticiones
+  nuevas el tiempo indicado (acotado) y la petición se reintenta.
+- Circuito por endpoint: si la tasa de error de las últimas llamadas
+  supera el umbral, el endpoint se abre y las llamadas fallan al instante
+  durante `espera` segundos; después pasa una sola sonda (semiabierto).
+- Respaldo: la última respuesta JSON buena de cada petición se guarda y se
+  sirve (marcada en el log y en las métricas) mientras el endpoint falla o
+  tiene el circuito abierto.
+- Todas las peticiones llevan timeout (conexión, lectura).
+- Casete opcional (ver casete): graba las respuestas o las reproduce sin
+  contactar a ThingsBoard.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+# Respuestas que indican sobrecarga: reducen la concurrencia y se reintentan
+_CONGESTION = {429, 502, 503, 504}
+# Errores al leer el cuerpo de una respuesta ya recibida
+_ERRORES_CUERPO = (
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ContentDecodingError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+class CircuitoAbierto(requests.exceptions.ConnectionError):
+    """El circuito del endpoint está abierto: la petición no se envió."""
+
+
+def segundos_retry_after(valor: str):
+    """Segundos de una cabecera Retry-After (entero o fecha HTTP), o None."""
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class LimitadorAIMD:
+    """
+    Límite de concurrencia con aumento aditivo y disminución multiplicativa.
+    Como en TCP, se recorta como mucho una vez por ronda: solo cuenta la
+    congestión de peticiones enviadas después del último recorte, para que
+    los errores de las que ya estaban en curso no lleven el límite al
+    mínimo de golpe.
+    `registrar` se llama con la ranura de la petición aún tomada.
+    """
+
+    def __init__(self, inicial: int = 8, minimo: int = 1, maximo: int = 32,
+                 latencia_objetivo: float = 2.0, factor: float = 0.5):
+        self.limite = float(inicial)
+        self.minimo = minimo
+        self.maximo = maximo
+        self.latencia_objetivo = latencia_objetivo
+        self.factor = factor
+        self.en_curso = 0
+        self._pausa_hasta = 0.0
+        self._ultimo_recorte = 0.0
+        self._cond = threading.Condition()
+        self._stats = {"aumentos": 0, "recortes": 0, "esperas": 0}
+
+    def adquirir(self):
+        with self._cond:
+            esperando = False
+            while True:
+                pausa = self._pausa_hasta - time.monotonic()
+                if pausa <= 0 and self.en_curso < int(self.limite):
+                    break
+                if not esperando:
+                    self._stats["esperas"] += 1
+                    esperando = True
+                self._cond.wait(timeout=pausa if pausa > 0 else None)
+            self.en_curso += 1
+
+    def liberar(self):
+        with self._cond:
+            self.en_curso -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def ranura(self):
+        self.adquirir()
+        try:
+            yield
+        finally:
+            self.liberar()
+
+    def registrar(self, inicio: float, congestion: bool):
+        """Ajusta el límite con el resultado de una petición enviada en `inicio` (monotonic)."""
+        with self._cond:
+            ahora = time.monotonic()
+            if congestion or ahora - inicio > self.latencia_objetivo:
+                if inicio >= self._ultimo_recorte:
+                    self.limite = max(float(self.minimo), self.limite * self.factor)
+                    self._ultimo_recorte = ahora
+                    self._stats["recortes"] += 1
+            elif self.limite < self.maximo and self.en_curso >= int(self.limite):
+                # +1 por cada `limite` respuestas: +1 por ronda completa. Solo
+                # crece si el límite se está usando; si no, no se ha probado
+                self.limite = min(float(self.maximo), self.limite + 1.0 / self.limite)
+                self._stats["aumentos"] += 1
+                self._cond.notify_all()
+
+    def pausar(self, segundos: float):
+        """Detiene las peticiones nuevas `segundos` (Retry-After)."""
+        with self._cond:
+            self._pausa_hasta = max(self._pausa_hasta, time.monotonic() + segundos)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {**self._stats, "limite": self.limite, "en_curso": self.en_curso,
+                    "pausa_s": max(0.0, self._pausa_hasta - time.monotonic())}
+
+
+class Circuito:
+    """Circuito de un endpoint: cerrado → abierto → semiabierto → cerrado."""
+
+    def __init__(self, umbral_error: float = 0.5, min_llamadas: int = 10, ventana: int = 20,
+                 espera: float = 30.0):
+        self.umbral_error = umbral_error
+        self.min_llamadas = min_llamadas
+        self.espera = espera
+        self.estado = "cerrado"
+        self._resultados = deque(maxlen=ventana)
+        self._abierto_desde = 0.0
+        self._sonda = False
+        self._lock = threading.Lock()
+        self.aperturas = 0
+
+    def permitir(self) -> bool:
+        with self._lock:
+            if self.estado == "abierto":
+                if time.monotonic() - self._abierto_desde < self.espera:
+                    return False
+                self.estado = "semiabierto"
+                self._sonda = False
+            if self.estado == "semiabierto":
+                if self._sonda:
+                    return False
+                self._sonda = True
+            return True
+
+    def registrar(self, ok: bool):
+        with self._lock:
+            if self.estado == "semiabierto":
+                self._sonda = False
+                if ok:
+                    self.estado = "cerrado"
+                    self._resultados.clear()
+                else:
+                    self._abrir()
+                return
+            self._resultados.append(ok)
+            errores = self._resultados.count(False)
+            if len(self._resultados) >= self.min_llamadas and errores / len(self._resultados) >= self.umbral_error:
+                self._abrir()
+
+    def _abrir(self):
+        self.estado = "abierto"
+        self._abierto_desde = time.monotonic()
+        self._resultados.clear()
+        self.aperturas += 1
+
+
+class ClienteTB:
+    """
+    Cliente HTTP compartido por todo el proceso: límite AIMD global,
+    circuito por endpoint, timeouts, Retry-After y respaldo de respuestas.
+    Con `casete` en modo replay las respuestas salen del casete (con la
+    misma ranura de concurrencia) y en modo record se graban.
+    """
+
+    def __init__(self, timeout=(3.05, 30.0), max_reintentos: int = 2, max_retry_after: float = 30.0,
+                 limitador: LimitadorAIMD = None, max_respaldos: int = 512, casete=None, **opciones_circuito):
+        self.casete = casete
+        self.timeout = timeout
+        self.max_reintentos = max_reintentos
+        self.max_retry_after = max_retry_after
+        self.limitador = limitador or LimitadorAIMD()
+        self.max_respaldos = max_respaldos
+        self._opciones_circuito = opciones_circuito
+        self._lock = threading.Lock()
+        self._circuitos = {}
+        self._respaldos = OrderedDict()
+        self._stats = {}
+        self._sesion = requests.Session()
+        # Tantas conexiones por host como peticiones admite el limitador: con el
+        # pool por defecto (10) las sobrantes se abrirían y descartarían en cada uso
+        adaptador = HTTPAdapter(pool_maxsize=self.limitador.maximo)
+        self._sesion.mount("http://", adaptador)
+        self._sesion.mount("https://", adaptador)
+
+    def circuito(self, endpoint: str) -> Circuito:
+        with self._lock:
+            if endpoint not in self._circuitos:
+                self._circuitos[endpoint] = Circuito(**self._opciones_circuito)
+                self._stats[endpoint] = {"llamadas": 0, "errores": 0, "reintentos": 0,
+                                         "rechazadas": 0, "respaldos": 0}
+            return self._circuitos[endpoint]
+
+    def _contar(self, endpoint: str, campo: str):
+        with self._lock:
+            self._stats[endpoint][campo] += 1
+
+    def _resultado(self, endpoint: str, inicio: float, ok: bool, congestion: bool):
+        self.limitador.registrar(inicio, congestion)
+        self._resultado_circuito(endpoint, ok)
+
+    def _resultado_circuito(self, endpoint: str, ok: bool):
+        self.circuito(endpoint).registrar(ok)
+        self._contar(endpoint, "llamadas")
+        if not ok:
+            self._contar(endpoint, "errores")
+
+    @contextmanager
+    def peticion(self, endpoint: str, metodo: str, url: str, **kwargs):
+        """
+        Envía la petición y entrega la respuesta; la ranura de concurrencia
+        se mantiene hasta salir del bloque (para respuestas en streaming).
+        Reintenta errores de red y respuestas de sobrecarga; los demás
+        códigos se entregan tal cual para que el llamador haga
+        raise_for_status(). Cualquier excepción libera la ranura y cuenta
+        como fallo en el circuito, también las de leer el cuerpo dentro del
+        bloque.
+        """
+        circuito = self.circuito(endpoint)
+        if self.casete is not None and self.casete.reproduciendo:
+            with self.limitador.ranura():
+                response = self.casete.reproducir(metodo, url, kwargs.get("json"))
+                self._contar(endpoint, "llamadas")
+                yield response
+            return
+        if not circuito.permitir():
+            self._contar(endpoint, "rechazadas")
+            raise CircuitoAbierto(f"Circuito abierto para '{endpoint}'")
+        kwargs.setdefault("timeout", self.timeout)
+
+        for intento in range(self.max_reintentos + 1):
+            ultimo = intento == self.max_reintentos
+            self.limitador.adquirir()
+            inicio = time.monotonic()
+            try:
+                response = self._sesion.request(metodo, url, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as err:
+                self._resultado(endpoint, inicio, ok=False, congestion=True)
+                self.limitador.liberar()
+                if ultimo or not circuito.permitir():
+                    raise
+                self._contar(endpoint, "reintentos")
+                logging.warning(f"Reintentando '{endpoint}' tras error de red: {err}")
+                time.sleep(min(2.0 ** intento * 0.25, 4.0))
+                continue
+            except BaseException:
+                # Redirecciones, cabeceras inválidas...: sin reintento, pero la
+                # ranura vuelve al limitador y la sonda del circuito se resuelve
+                self._resultado(endpoint, inicio, ok=False, congestion=False)
+                self.limitador.liberar()
+                raise
+
+            congestion = response.status_code in _CONGESTION
+            ok = response.status_code < 500
+            # Las de congestión se registran ya: el reintento depende del circuito
+            registrado = congestion
+            if congestion:
+                self._resultado(endpoint, inicio, ok=ok, congestion=True)
+                espera = segundos_retry_after(response.headers.get("Retry-After"))
+                if espera is not None:
+                    self.limitador.pausar(min(espera, self.max_retry_after))
+                if not ultimo and circuito.permitir():
+                    response.close()
+                    self.limitador.liberar()
+                    self._contar(endpoint, "reintentos")
+                    if espera is None:
+                        time.sleep(min(2.0 ** intento * 0.25, 4.0))
+                    continue
+            else:
+                self.limitador.registrar(inicio, congestion=False)
+            break
+
+        # El circuito registra la respuesta entregada al salir del bloque: un
+        # error al leer el cuerpo también es un fallo
+        try:
+            if self.casete is not None:
+                self.casete.grabar(metodo, url, kwargs.get("json"), response, time.monotonic() - inicio)
+            yield response
+        except _ERRORES_CUERPO:
+            ok = False
+            raise
+        finally:
+            if not registrado:
+                self._resultado_circuito(endpoint, ok)
+            response.close()
+            self.limitador.liberar()
+
+    def obtener_json(self, endpoint: str, metodo: str, url: str, respaldo: bool = True, **kwargs) -> tuple:
+        """
+        (json, bytes) de la respuesta. Si la petición falla y hay una
+        respuesta buena anterior para la misma petición, se sirve esa.
+        """
+        clave = (metodo, url, json.dumps(kwargs.get("json"), sort_keys=True)) if respaldo else None
+        try:
+            with self.peticion(endpoint, metodo, url, **kwargs) as response:
+                response.raise_for_status()
+                datos, nbytes = response.json(), len(response.content)
+        except requests.exceptions.RequestException as err:
+            with self._lock:
+                guardado = self._respaldos.get(clave) if clave else None
+            if guardado is None:
+                raise
+            self._contar(endpoint, "respaldos")
+            logging.warning(f"'{endpoint}' no disponible ({err}); se sirve la última respuesta válida")
+            return guardado
+
+        if clave:
+            with self._lock:
+                self._respaldos[clave] = (datos, nbytes)
+                self._respaldos.move_to_end(clave)
+                while len(self._respaldos) > self.max_respaldos:
+                    self._respaldos.popitem(last=False)
+        return datos, nbytes
+
+    def estado(self) -> pd.DataFrame:
+        """Estado por endpoint: circuito y contadores."""
+        with self._lock:
+            filas = [
+                {"endpoint": endpoint, "circuito": circuito.estado, "aperturas": circuito.aperturas,
+                 **self._stats[endpoint]}
+                for endpoint, circuito in self._circuitos.items()
+            ]
+        return pd.DataFrame(filas)
+
+    def metricas(self) -> dict:
+        """Métricas para register_collector."""
+        limitador = self.limitador.stats()
+        metricas = {
+            "mvp_tb_concurrency_limit": limitador["limite"],
+            "mvp_tb_in_flight": limitador["en_curso"],
+            "mvp_tb_limit_decreases_total": limitador["recortes"],
+        }
+        if self.casete is not None:
+            casete = self.casete.stats()
+            metricas["mvp_tb_cassette_recorded_total"] = casete["grabadas"]
+            metricas["mvp_tb_cassette_replayed_total"] = casete["reproducidas"]
+            metricas["mvp_tb_cassette_missing_total"] = casete["no_grabadas"]
+        for fila in self.estado().to_dict("records"):
+            nombre = fila["endpoint"]
+            metricas[f'mvp_tb_requests_total{{endpoint="{nombre}"}}'] = fila["llamadas"]
+            metricas[f'mvp_tb_errors_total{{endpoint="{nombre}"}}'] = fila["errores"]
+            metricas[f'mvp_tb_fallbacks_total{{endpoint="{nombre}"}}'] = fila["respaldos"]
+            metricas[f'mvp_tb_circuit_open{{endpoint="{nombre}"}}'] = int(fila["circuito"] != "cerrado")
+        return metricas
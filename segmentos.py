@@ -0,0 +1,263 @@
+"""
+Caché de telemetría por segmentos de día UTC.
+
+Una ventana de fechas se descompone en días alineados a medianoche UTC y
+cada día se guarda por separado (dispositivo, keys, día); las keys son las
+del esquema del dashboard (por defecto TB_KEYS). Dos ventanas que
+se solapan reutilizan los días ya descargados y solo se piden a ThingsBoard
+los que faltan, agrupando los días faltantes consecutivos en una sola
+petición. Los días cerrados no caducan; el día en curso tiene un TTL corto
+porque sigue recibiendo datos. Si la re-descarga de un día caducado falla,
+se sirve la copia anterior.
+
+Con un DeltaBus, cada tramo descargado se publica para los consumidores
+incrementales (anomalías, alertas, acumuladores). Con un PresupuestoMemoria,
+cada segmento cuenta contra el presupuesto de bytes del proceso además del
+tope de `max_segmentos`.
+
+get_windows resuelve varios dispositivos a la vez: los tramos que faltan se
+descargan en paralelo y se decodifican en el pool de procesos de carga_flota.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import data_queries
+from carga_flota import descargar_procesos
+from instrumentation import span
+from presupuesto import tamano_bytes
+
+DIA_MS = 24 * 60 * 60 * 1000
+
+
+def a_ms(fecha) -> int:
+    """Fecha (date, str o Timestamp; sin zona = UTC) a ms epoch."""
+    ts = pd.Timestamp(fecha)
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert("UTC").tz_localize(None)
+    return ts.value // 1_000_000
+
+
+def ventana_desde_fechas(fecha_inicio, fecha_fin) -> tuple:
+    """
+    Ventana [inicio, fin) en Timestamps UTC sin zona a partir de dos fechas
+    de calendario, ambas incluidas.
+    """
+    inicio = pd.Timestamp(fecha_inicio).normalize()
+    fin = pd.Timestamp(fecha_fin).normalize() + pd.Timedelta(days=1)
+    return inicio, fin
+
+
+def segmentos_dia(inicio_ms: int, fin_ms: int) -> list:
+    """Inicios (ms) de los días UTC que cubren [inicio_ms, fin_ms)."""
+    if fin_ms <= inicio_ms:
+        return []
+    primero = inicio_ms - inicio_ms % DIA_MS
+    return list(range(primero, fin_ms, DIA_MS))
+
+
+def _tramos(dias: list) -> list:
+    """Agrupa inicios de día ordenados en tramos consecutivos."""
+    tramos = []
+    for dia in dias:
+        if tramos and dia == tramos[-1][-1] + DIA_MS:
+            tramos[-1].append(dia)
+        else:
+            tramos.append([dia])
+    return tramos
+
+
+class _Segmento:
+    __slots__ = ("df", "cargado", "cerrado")
+
+    def __init__(self, df: pd.DataFrame, cerrado: bool):
+        self.df = df
+        self.cargado = time.monotonic()
+        self.cerrado = cerrado
+
+
+class SegmentCache:
+    """
+    Segmentos de día por (dispositivo, keys, día), compartidos entre
+    sesiones (st.cache_resource). Se expulsan por LRU al superar
+    `max_segmentos` o, con `presupuesto`, cuando este lo decide. Lo
+    descargado se publica en `bus` si se indica.
+    """
+
+    def __init__(self, ttl_abierto: float = 60, max_segmentos: int = 50_000, bus=None, presupuesto=None):
+        self.ttl_abierto = ttl_abierto
+        self.max_segmentos = max_segmentos
+        self.bus = bus
+        self.presupuesto = presupuesto
+        self._lock = threading.Lock()
+        self._segmentos = OrderedDict()
+        self._stats = {"hits": 0, "misses": 0, "requests": 0, "stale": 0}
+
+    def _vigente(self, seg: _Segmento) -> bool:
+        return seg.cerrado or time.monotonic() - seg.cargado < self.ttl_abierto
+
+    def _guardar(self, clave, seg: _Segmento):
+        with self._lock:
+            self._segmentos[clave] = seg
+            self._segmentos.move_to_end(clave)
+            sobrantes = []
+            while len(self._segmentos) > self.max_segmentos:
+                sobrantes.append(self._segmentos.popitem(last=False)[0])
+        if self.presupuesto is not None:
+            for sobrante in sobrantes:
+                self.presupuesto.baja("segmentos", sobrante)
+            self.presupuesto.alta("segmentos", clave, tamano_bytes(seg.df), lambda: self._expulsar(clave, seg))
+
+    def _expulsar(self, clave, seg: _Segmento):
+        """Expulsión por presupuesto: solo si la clave sigue en ese segmento."""
+        with self._lock:
+            if self._segmentos.get(clave) is seg:
+                del self._segmentos[clave]
+
+    def _descargar_tramo(self, device_id: str, jwt_token: str, tramo: list, ahora_ms: int, keys: str) -> dict:
+        """Pide un tramo de días consecutivos en una sola petición y lo reparte por día."""
+        inicio, fin = tramo[0], tramo[-1] + DIA_MS
+        limite = int(data_queries.TB_LIMIT) * len(tramo)
+        df = data_queries.get_device_range(device_id, jwt_token, inicio, fin - 1, limit=limite, keys=keys)
+        return self._repartir_tramo(device_id, tramo, df, limite, ahora_ms, keys)
+
+    def _repartir_tramo(self, device_id: str, tramo: list, df: pd.DataFrame, limite: int,
+                        ahora_ms: int, keys: str) -> dict:
+        """
+        Reparte por día la respuesta de un tramo. Solo se cachean los días
+        completos: si alguna key llegó al límite de puntos, los días
+        anteriores a su punto más antiguo pueden estar truncados y se
+        devuelven sin guardarse.
+        """
+        inicio, fin = tramo[0], tramo[-1] + DIA_MS
+        with self._lock:
+            self._stats["requests"] += 1
+        if self.bus is not None:
+            self.bus.publish_device(device_id, df)
+
+        corte = None
+        if not df.empty:
+            conteos = df.groupby("key", sort=False)["ts"].agg(["size", "min"])
+            truncadas = conteos[conteos["size"] >= limite]
+            if not truncadas.empty:
+                corte = int(truncadas["min"].max())
+                logging.warning(
+                    f"Telemetría truncada para {device_id} en "
+                    f"{pd.Timestamp(inicio, unit='ms').date()}–{pd.Timestamp(fin, unit='ms').date()}; "
+                    "no se cachean los días incompletos"
+                )
+
+        ts = df["ts"].to_numpy(dtype="int64") if not df.empty else np.empty(0, dtype="int64")
+        dia_de = ts - ts % DIA_MS
+        orden = np.argsort(dia_de, kind="stable")
+        bordes = np.searchsorted(dia_de[orden], tramo + [fin])
+
+        resultado = {}
+        for i, dia in enumerate(tramo):
+            df_dia = df.iloc[orden[bordes[i]:bordes[i + 1]]] if len(ts) else df
+            resultado[dia] = df_dia
+            if corte is not None and dia <= corte - corte % DIA_MS:
+                continue
+            self._guardar((device_id, keys, dia), _Segmento(df_dia, dia + DIA_MS <= ahora_ms))
+        return resultado
+
+    def _consultar(self, device_id: str, keys: str, dias: list) -> tuple:
+        """Días vigentes en caché, días que faltan y copias caducadas de estos."""
+        partes, faltantes, caducados = {}, [], {}
+        with self._lock:
+            for dia in dias:
+                seg = self._segmentos.get((device_id, keys, dia))
+                if seg is not None and self._vigente(seg):
+                    self._segmentos.move_to_end((device_id, keys, dia))
+                    partes[dia] = seg.df
+                else:
+                    if seg is not None:
+                        caducados[dia] = seg.df
+                    faltantes.append(dia)
+            self._stats["hits"] += len(dias) - len(faltantes)
+            self._stats["misses"] += len(faltantes)
+        if self.presupuesto is not None:
+            for dia in partes:
+                self.presupuesto.acierto("segmentos", (device_id, keys, dia))
+            for _ in faltantes:
+                self.presupuesto.fallo("segmentos")
+        return partes, faltantes, caducados
+
+    def _fallo_tramo(self, device_id: str, tramo: list, caducados: dict, partes: dict, err: Exception):
+        """Registra el fallo de un tramo y sirve las copias caducadas de sus días."""
+        logging.error(f"Error al obtener telemetría de {device_id} por segmentos: {err}")
+        servidos = [d for d in tramo if d in caducados]
+        partes.update((d, caducados[d]) for d in servidos)
+        with self._lock:
+            self._stats["stale"] += len(servidos)
+
+    @staticmethod
+    def _componer(partes: dict, dias: list, inicio_ms: int, fin_ms: int) -> pd.DataFrame:
+        frames = [partes[d] for d in dias if d in partes and not partes[d].empty]
+        if not frames:
+            return pd.DataFrame(columns=["ts", "value", "key", "fecha"])
+        df = pd.concat(frames, ignore_index=True)
+        df = df[(df["ts"] >= inicio_ms) & (df["ts"] < fin_ms)]
+        return df.sort_values("fecha", kind="stable").reset_index(drop=True)
+
+    def get_window(self, device_id: str, jwt_token: str, inicio, fin, keys: str = None) -> pd.DataFrame:
+        """
+        Telemetría del dispositivo en [inicio, fin) con columnas ts, value,
+        key y fecha, ordenada por fecha. `keys` separadas por comas. Un fallo de ThingsBoard en un tramo
+        se registra; sus días caducados se sirven de la copia anterior y los
+        que no estaban en caché quedan vacíos (y sin cachear).
+        """
+        keys = keys or data_queries.TB_KEYS
+        inicio_ms, fin_ms = a_ms(inicio), a_ms(fin)
+        ahora_ms = a_ms(pd.Timestamp.now(tz="UTC"))
+        dias = segmentos_dia(inicio_ms, fin_ms)
+        partes, faltantes, caducados = self._consultar(device_id, keys, dias)
+
+        with span("segments.window", device=device_id, days=len(dias), missing=len(faltantes)):
+            for tramo in _tramos(faltantes):
+                try:
+                    partes.update(self._descargar_tramo(device_id, jwt_token, tramo, ahora_ms, keys))
+                except Exception as err:
+                    self._fallo_tramo(device_id, tramo, caducados, partes, err)
+            return self._componer(partes, dias, inicio_ms, fin_ms)
+
+    def get_windows(self, device_ids, jwt_token: str, inicio, fin, keys: str = None,
+                    procesos: int = None) -> dict:
+        """
+        get_window para varios dispositivos: {device_id: DataFrame}. Los
+        tramos que faltan de todos los dispositivos se descargan a la vez y
+        se decodifican en el pool de procesos de carga_flota.
+        """
+        keys = keys or data_queries.TB_KEYS
+        inicio_ms, fin_ms = a_ms(inicio), a_ms(fin)
+        ahora_ms = a_ms(pd.Timestamp.now(tz="UTC"))
+        dias = segmentos_dia(inicio_ms, fin_ms)
+        estado = {did: self._consultar(did, keys, dias) for did in device_ids}
+
+        peticiones = {}
+        for did, (_, faltantes, _) in estado.items():
+            for tramo in _tramos(faltantes):
+                peticiones[(did, tramo[0], tramo[-1])] = {
+                    "device_id": did, "keys": keys, "start_ts": tramo[0], "end_ts": tramo[-1] + DIA_MS - 1,
+                    "limit": int(data_queries.TB_LIMIT) * len(tramo),
+                }
+
+        with span("segments.windows", devices=len(estado), days=len(dias), requests=len(peticiones)):
+            descargados = descargar_procesos(peticiones, jwt_token, procesos) if peticiones else {}
+            for (did, primero, ultimo), df in descargados.items():
+                partes, _, caducados = estado[did]
+                tramo = list(range(primero, ultimo + 1, DIA_MS))
+                if isinstance(df, Exception):
+                    self._fallo_tramo(did, tramo, caducados, partes, df)
+                else:
+                    limite = peticiones[(did, primero, ultimo)]["limit"]
+                    partes.update(self._repartir_tramo(did, tramo, df, limite, ahora_ms, keys))
+            return {did: self._componer(partes, dias, inicio_ms, fin_ms) for did, (partes, _, _) in estado.items()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "segments": len(self._segmentos)}
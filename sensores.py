@@ -0,0 +1,62 @@
+"""
+Esquemas de keys de ThingsBoard por magnitud. dashboard.py usa las keys
+soil_* y battery_level; dashboardnew.py usa el esquema corto y battery.
+Las secciones piden magnitudes y el planificador de descargas las traduce
+a las keys del esquema del dashboard.
+"""
+
+ESQUEMA_CLASICO = {
+    "temperatura": "soil_temperature",
+    "humedad": "soil_humidity",
+    "ce": "soil_ec",
+    "bateria": "battery_level",
+}
+
+ESQUEMA_NUEVO = {
+    "temperatura": "temperature",
+    "humedad": "humidity",
+    "ce": "soil_conductivity",
+    "bateria": "battery",
+}
+
+ESQUEMAS = {
+    "clasico": ESQUEMA_CLASICO,
+    "nuevo": ESQUEMA_NUEVO,
+}
+
+# Magnitudes con histórico (gráficos, heatmaps, KPIs); la batería solo se lee como último valor
+MAGNITUDES_HISTORICO = ("temperatura", "humedad", "ce")
+
+
+def keys_de(esquema: dict, magnitudes) -> list:
+    """Keys de ThingsBoard de `magnitudes` en el esquema, en el mismo orden."""
+    return [esquema[m] for m in magnitudes]
+
+
+# Nombre de key → magnitud, para cualquiera de los esquemas
+ALIAS_KEYS = {key: magnitud for esquema in ESQUEMAS.values() for magnitud, key in esquema.items()}
+
+# Factor para llevar la batería a porcentaje: el esquema nuevo la reporta en 0–1
+ESCALA_BATERIA = {
+    "clasico": 1,
+    "nuevo": 100,
+}
+
+# Rangos del semáforo por magnitud (los de `parametros` / `PARAMETROS`)
+RANGOS = {
+    "humedad": {
+        "verde": (25, 40),
+        "amarillo": [(18, 24), (41, 45)],
+        "rojo": [(0, 18), (45, 100)],
+    },
+    "temperatura": {
+        "verde": (18, 28),
+        "amarillo": [(12, 17), (29, 32)],
+        "rojo": [(0, 12), (32, 100)],
+    },
+    "ce": {
+        "verde": (0.2, 1.2),
+        "amarillo": [(1.3, 2.0)],
+        "rojo": [(2.0, 4.0), (4.0, 100)],
+    },
+}
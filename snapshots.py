@@ -0,0 +1,177 @@
+"""
+Snapshots de datos compartidos entre sesiones.
+
+@st.cache_data serializa y deserializa el DataFrame completo en cada rerun,
+y cada script lo modificaba después (Fecha, Periodo_Dia...). Aquí cada
+snapshot se carga una vez por TTL, sus columnas derivadas se calculan una
+sola vez y cada página recibe una vista superficial (sin copiar datos) en
+lugar de una copia deserializada.
+
+Con un PresupuestoMemoria, cada snapshot y cada resultado derivado (KPIs,
+resúmenes) cuentan contra el presupuesto de bytes del proceso y pueden
+expulsarse; la siguiente lectura los vuelve a cargar o calcular.
+"""
+import itertools
+import logging
+import threading
+import time
+
+import pandas as pd
+
+from instrumentation import span
+from presupuesto import tamano_bytes
+
+_versions = itertools.count(1)
+_FALTA = object()
+
+
+class Snapshot:
+    """Resultado inmutable de una carga, con versión única por proceso."""
+
+    def __init__(self, key, df: pd.DataFrame, ttl: float, presupuesto=None):
+        self.key = key
+        self.version = next(_versions)
+        self.created_at = time.monotonic()
+        self.loaded_at = pd.Timestamp.now()
+        self.ttl = ttl
+        self._df = df
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+        self._presupuesto = presupuesto
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() - self.created_at >= self.ttl
+
+    @property
+    def empty(self) -> bool:
+        return self._df.empty
+
+    def view(self) -> pd.DataFrame:
+        """
+        Vista superficial que comparte los arrays del snapshot sin copiarlos.
+        Añadir o reemplazar columnas en la página no afecta al snapshot
+        compartido; las páginas no deben modificar valores in situ.
+        """
+        return self._df.copy(deep=False)
+
+    def derived(self, name, fn):
+        """
+        Resultado de fn(df) calculado una sola vez para esta versión del
+        snapshot y compartido por todas las sesiones. El resultado es de
+        solo lectura para las páginas.
+        """
+        resultado = self._derived.get(name, _FALTA)
+        if resultado is not _FALTA:
+            if self._presupuesto is not None:
+                self._presupuesto.acierto("kpis", (self.key, self.version, name))
+            return resultado
+        with self._derived_lock:
+            resultado = self._derived.get(name, _FALTA)
+            if resultado is _FALTA:
+                with span("derived.compute", kpi=str(name), points=len(self._df)):
+                    resultado = self._derived[name] = fn(self._df)
+                if self._presupuesto is not None:
+                    self._presupuesto.fallo("kpis")
+                    self._presupuesto.alta(
+                        "kpis", (self.key, self.version, name), tamano_bytes(resultado),
+                        lambda: self._descartar_derivado(name, resultado),
+                    )
+            return resultado
+
+    def _descartar_derivado(self, name, resultado):
+        """Expulsión por presupuesto: solo si sigue siendo el mismo resultado."""
+        with self._derived_lock:
+            if self._derived.get(name) is resultado:
+                del self._derived[name]
+
+    def liberar(self):
+        """Retira del presupuesto los derivados de un snapshot descartado."""
+        if self._presupuesto is None:
+            return
+        with self._derived_lock:
+            nombres = list(self._derived)
+            self._derived.clear()
+        for name in nombres:
+            self._presupuesto.baja("kpis", (self.key, self.version, name))
+
+    def __len__(self):
+        return len(self._df)
+
+
+class SnapshotStore:
+    """
+    Almacén de snapshots por clave. Pensado para vivir en st.cache_resource:
+    todas las sesiones del proceso comparten los mismos objetos. Con
+    `presupuesto`, los snapshots se expulsan al superarlo.
+    """
+
+    def __init__(self, presupuesto=None):
+        self.presupuesto = presupuesto
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._key_locks = {}
+
+    def _key_lock(self, key) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key, loader, ttl: float, derive=None) -> Snapshot:
+        """
+        Retorna el snapshot vigente de `key`, cargándolo con loader() si no
+        existe o venció. `derive(df)` añade columnas derivadas una sola vez
+        por snapshot. Una sola sesión carga cada clave a la vez.
+        """
+        snap = self._entries.get(key)
+        if snap is not None and not snap.expired:
+            if self.presupuesto is not None:
+                self.presupuesto.acierto("snapshots", key)
+            return snap
+
+        with self._key_lock(key):
+            snap = self._entries.get(key)
+            if snap is not None and not snap.expired:
+                return snap
+
+            df = loader()
+            if df.empty and snap is not None and not snap.empty:
+                logging.warning(f"Carga vacía para {key}; se mantiene el snapshot anterior")
+                snap.created_at = time.monotonic()
+                return snap
+
+            if derive is not None and not df.empty:
+                with span("features.snapshot", points=len(df)):
+                    df = derive(df)
+
+            new = Snapshot(key, df, ttl, self.presupuesto)
+            with self._lock:
+                self._entries[key] = new
+            if snap is not None:
+                snap.liberar()
+            if self.presupuesto is not None:
+                self.presupuesto.fallo("snapshots")
+                self.presupuesto.alta("snapshots", key, tamano_bytes(df), lambda: self._expulsar(key, new))
+            return new
+
+    def _expulsar(self, key, snap: Snapshot):
+        """Expulsión por presupuesto: solo si la clave sigue en ese snapshot."""
+        with self._lock:
+            if self._entries.get(key) is not snap:
+                return
+            del self._entries[key]
+        snap.liberar()
+
+    def stats(self) -> list:
+        with self._lock:
+            entries = list(self._entries.values())
+        return [
+            {
+                "key": str(s.key),
+                "version": s.version,
+                "rows": len(s),
+                "bytes": int(s._df.memory_usage(deep=False).sum()),
+                "loaded_at": s.loaded_at,
+                "expired": s.expired,
+            }
+            for s in entries
+        ]
@@ -0,0 +1,235 @@
+"""
+Generador sintético de telemetría de flota, a partir de los datos de ejemplo
+de app2.py. Vectorizado con NumPy y reproducible por semilla: produce series
+de N dispositivos × M días con ciclos diurnos de temperatura, riegos que
+elevan la humedad y luego se secan, deriva de la CE, descarga de batería y
+cortes de comunicación.
+
+La salida puede obtenerse como DataFrame largo (mismas columnas que
+parse_telemetry_to_dataframe más device_id) o como JSON con la forma que
+devuelve /values/timeseries de ThingsBoard.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+from sensores import ALIAS_KEYS, ESQUEMA_CLASICO
+
+MINUTE_MS = 60 * 1000
+DAY_MS = 24 * 60 * MINUTE_MS
+
+
+class FlotaSintetica:
+    """
+    Telemetría generada para toda la flota. `valores[magnitud]` es una matriz
+    (dispositivos × instantes) con NaN donde el dispositivo no reportó.
+    """
+
+    def __init__(self, device_ids: list, ts: np.ndarray, valores: dict):
+        self.device_ids = list(device_ids)
+        self.device_index = {did: i for i, did in enumerate(self.device_ids)}
+        self.ts = ts
+        self.valores = valores
+
+    @property
+    def n_puntos(self) -> int:
+        return int(sum(np.count_nonzero(~np.isnan(m)) for m in self.valores.values()))
+
+    def _serie(self, idx: int, key: str, start_ts=None, end_ts=None):
+        magnitud = ALIAS_KEYS.get(key)
+        if magnitud is None:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        fila = self.valores[magnitud][idx]
+        lo = 0 if start_ts is None else np.searchsorted(self.ts, start_ts, side="left")
+        hi = len(self.ts) if end_ts is None else np.searchsorted(self.ts, end_ts, side="right")
+        ts, values = self.ts[lo:hi], fila[lo:hi]
+        ok = ~np.isnan(values)
+        return ts[ok], values[ok]
+
+    def thingsboard_json(self, device_id: str, keys: list, start_ts: int = None,
+                         end_ts: int = None, limit: int = 100) -> dict:
+        """
+        Respuesta de /values/timeseries: por key, los `limit` puntos más
+        recientes de la ventana, en orden descendente y con valores string.
+        Sin start_ts se comporta como la consulta de últimos valores.
+        """
+        idx = self.device_index[device_id]
+        if start_ts is None:
+            limit = 1
+        out = {}
+        for key in keys:
+            ts, values = self._serie(idx, key, start_ts, end_ts)
+            if len(ts) == 0:
+                continue
+            ts, values = ts[::-1][:limit], values[::-1][:limit]
+            out[key] = [{"ts": int(t), "value": f"{v:.2f}"} for t, v in zip(ts.tolist(), values.tolist())]
+        return out
+
+    def thingsboard_bytes(self, device_id: str, keys: list, start_ts: int = None,
+                          end_ts: int = None, limit: int = 100) -> bytes:
+        """Igual que thingsboard_json pero ya serializado, sin dicts intermedios."""
+        idx = self.device_index[device_id]
+        if start_ts is None:
+            limit = 1
+        partes = []
+        for key in keys:
+            ts, values = self._serie(idx, key, start_ts, end_ts)
+            if len(ts) == 0:
+                continue
+            ts, values = ts[::-1][:limit], values[::-1][:limit]
+            puntos = ",".join(
+                f'{{"ts":{t},"value":"{v:.2f}"}}' for t, v in zip(ts.tolist(), values.tolist())
+            )
+            partes.append(f"{json.dumps(key)}:[{puntos}]")
+        return ("{" + ",".join(partes) + "}").encode("utf-8")
+
+    def dataframe(self, keys: dict = None, device_ids: list = None) -> pd.DataFrame:
+        """
+        DataFrame largo con columnas device_id, ts, value, key, fecha.
+        `keys` traduce magnitud → nombre de key (por defecto esquema soil_*).
+        """
+        keys = keys or ESQUEMA_CLASICO
+        indices = (
+            np.arange(len(self.device_ids)) if device_ids is None
+            else np.array([self.device_index[d] for d in device_ids])
+        )
+        ids = np.array(self.device_ids, dtype=object)
+        frames = []
+        for magnitud, key in keys.items():
+            matriz = self.valores[magnitud][indices]
+            filas, cols = np.nonzero(~np.isnan(matriz))
+            frames.append(pd.DataFrame({
+                "device_id": ids[indices[filas]],
+                "ts": self.ts[cols],
+                "value": matriz[filas, cols],
+                "key": key,
+            }))
+        df = pd.concat(frames, ignore_index=True)
+        df["fecha"] = pd.to_datetime(df["ts"], unit="ms")
+        return df
+
+
+def _cortes(rng, n: int, t: int, prob_punto: float, cortes_por_dispositivo: float,
+            duracion_max: int) -> np.ndarray:
+    """Máscara (n × t) de puntos perdidos: pérdidas sueltas más cortes contiguos."""
+    perdidos = rng.random((n, t)) < prob_punto
+    n_cortes = rng.poisson(cortes_por_dispositivo, n)
+    total = int(n_cortes.sum())
+    if total:
+        filas = np.repeat(np.arange(n), n_cortes)
+        inicios = rng.integers(0, t, total)
+        largos = rng.integers(1, max(duracion_max, 2), total)
+        # Marca inicio (+1) y fin (−1) y acumula para rellenar cada corte
+        marcas = np.zeros((n, t + 1), dtype=np.int32)
+        np.add.at(marcas, (filas, inicios), 1)
+        np.add.at(marcas, (filas, np.minimum(inicios + largos, t)), -1)
+        perdidos |= np.cumsum(marcas[:, :t], axis=1) > 0
+    return perdidos
+
+
+def _generar_bloque(rng, n: int, ts: np.ndarray, intervalo_min: float,
+                    prob_perdida: float, cortes_por_dispositivo: float) -> dict:
+    """Genera las matrices (n × t) de un bloque de dispositivos."""
+    t = len(ts)
+    paso_ms = intervalo_min * MINUTE_MS
+    horas = (ts % DAY_MS) / (60 * MINUTE_MS)
+    dias_transcurridos = (ts - ts[0]) / DAY_MS
+
+    # ── Temperatura del suelo (°C) ──
+    base_t = rng.uniform(16, 24, (n, 1))
+    amplitud_t = rng.uniform(2, 6, (n, 1))
+    diurno = np.sin(2 * np.pi * (horas - 9) / 24)  # máximo hacia las 15 h
+    estacional = 2 * np.sin(2 * np.pi * dias_transcurridos / 365)
+    temperatura = base_t + amplitud_t * diurno + estacional + rng.normal(0, 0.3, (n, t))
+
+    # ── Humedad volumétrica (%) con riegos a primera hora ──
+    muestras_dia = DAY_MS / paso_ms
+    # Un riego cada 2–5 días, dentro de la franja de 3 h de las 6 a las 9
+    prob_riego = 1 / (rng.uniform(2, 5, (n, 1)) * muestras_dia * 3 / 24)
+    riego = (rng.random((n, t)) < prob_riego) & ((horas >= 6) & (horas < 9))
+    idx = np.broadcast_to(np.arange(t), (n, t))
+    ultimo_riego = np.maximum.accumulate(np.where(riego, idx, -1), axis=1)
+    horas_desde_riego = np.where(ultimo_riego >= 0, (idx - ultimo_riego) * (intervalo_min / 60), 96.0)
+    base_h = rng.uniform(15, 22, (n, 1))
+    pico_h = rng.uniform(12, 22, (n, 1))
+    tau_h = rng.uniform(18, 48, (n, 1))
+    humedad = base_h + pico_h * np.exp(-horas_desde_riego / tau_h) + rng.normal(0, 0.4, (n, t))
+    humedad = np.clip(humedad, 0, 100)
+
+    # ── Conductividad eléctrica aparente (dS/m) ──
+    base_ce = rng.uniform(0.4, 1.6, (n, 1))
+    deriva = np.cumsum(rng.normal(0, 0.002, (n, t)), axis=1)
+    dilucion = 0.15 * np.exp(-horas_desde_riego / 12)
+    ce = (base_ce + deriva - dilucion) * (1 + 0.02 * (temperatura - 25)) + rng.normal(0, 0.02, (n, t))
+    ce = np.clip(ce, 0.05, None)
+
+    # ── Batería (%) ──
+    inicio_b = rng.uniform(40, 100, (n, 1))
+    descarga_dia = rng.uniform(0.2, 1.5, (n, 1))
+    bateria = inicio_b - descarga_dia * dias_transcurridos
+    bateria = np.where(bateria < 5, bateria % 95 + 5, bateria)  # cambio de batería
+    bateria = np.clip(np.round(bateria, 0), 0, 100)
+
+    perdidos = _cortes(rng, n, t, prob_perdida, cortes_por_dispositivo, int(muestras_dia))
+    bloque = {}
+    for magnitud, matriz in (("temperatura", temperatura), ("humedad", humedad),
+                             ("ce", ce), ("bateria", bateria)):
+        matriz = matriz.astype(np.float32)
+        matriz[perdidos] = np.nan
+        bloque[magnitud] = matriz
+    return bloque
+
+
+def generar_flota(n_dispositivos: int, dias: float, intervalo_min: float = 15,
+                  seed: int = 123, fin: pd.Timestamp = None,
+                  prob_perdida: float = 0.01, cortes_por_dispositivo: float = 1.0,
+                  device_ids: list = None, bloque: int = 256) -> FlotaSintetica:
+    """
+    Genera la telemetría de la flota de forma vectorizada, por bloques de
+    `bloque` dispositivos para acotar la memoria intermedia.
+
+    - temperatura: base por dispositivo + ciclo diurno (máximo a media tarde)
+    - humedad (VWC %): riegos aleatorios a primera hora con secado exponencial
+    - ce (dS/m): deriva lenta, sube con la temperatura y se diluye tras el riego
+    - bateria (%): descarga lineal con cambios de batería ocasionales
+    - cortes: pérdidas sueltas y periodos sin comunicación
+    """
+    fin = pd.Timestamp.now() if fin is None else pd.Timestamp(fin)
+    paso_ms = int(intervalo_min * MINUTE_MS)
+    t = max(int(dias * DAY_MS // paso_ms), 1)
+    fin_ms = int(fin.value // 1_000_000)
+    ts = fin_ms - paso_ms * np.arange(t - 1, -1, -1, dtype=np.int64)
+
+    bloques = []
+    for i, inicio in enumerate(range(0, n_dispositivos, bloque)):
+        rng = np.random.default_rng([seed, i])
+        n = min(bloque, n_dispositivos - inicio)
+        bloques.append(_generar_bloque(rng, n, ts, intervalo_min, prob_perdida, cortes_por_dispositivo))
+
+    valores = {
+        magnitud: np.concatenate([b[magnitud] for b in bloques]) if bloques
+        else np.empty((0, t), dtype=np.float32)
+        for magnitud in ("temperatura", "humedad", "ce", "bateria")
+    }
+    device_ids = device_ids or [f"dev-{i:05d}" for i in range(n_dispositivos)]
+    return FlotaSintetica(device_ids, ts, valores)
+
+
+def ultimos_reportes_bateria(n: int, ahora: pd.Timestamp = None, seed: int = 123,
+                             fraccion_reciente: float = 0.95) -> pd.DataFrame:
+    """
+    Último reporte de batería por dispositivo, como en la demo de app2.py:
+    la mayoría en las últimas 24 h (sesgado a < 1 h) y el resto hasta 7 días.
+    """
+    rng = np.random.default_rng(seed)
+    ahora = pd.Timestamp.now() if ahora is None else ahora
+    n_recent = int(n * fraccion_reciente)
+    deltas_recent = np.clip(rng.exponential(scale=3 * 3600, size=n_recent), 0, 24 * 3600)
+    deltas_old = rng.uniform(24 * 3600, 7 * 24 * 3600, size=n - n_recent)
+    deltas = np.concatenate([deltas_recent, deltas_old])
+    return pd.DataFrame({
+        "fecha_hora": ahora - pd.to_timedelta(deltas, unit="s"),
+        "bateria": np.round(rng.uniform(0, 1, n), 2),
+        "identificador": [f"P{i}" for i in range(n)],
+    })
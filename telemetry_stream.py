@@ -0,0 +1,208 @@
+"""
+Decodificación incremental de respuestas de /values/timeseries.
+
+response.json() construye un dict por punto y parse_telemetry_to_dataframe
+vuelve a recorrerlos, así que el pico de memoria es varias veces el
+DataFrame final. Aquí la respuesta se lee por bloques: cada bloque completo
+se escanea con expresiones regulares y sus ts/value se escriben directamente
+en buffers NumPy preasignados por key (del tamaño de `limit`). Nunca existe
+la respuesta entera ni un objeto Python por punto.
+
+Formato esperado (el de ThingsBoard):
+
+    {"key":[{"ts":1700000000000,"value":"21.5"}, ...], "otra_key":[...]}
+
+Los puntos se aceptan con "ts" y "value" en cualquier orden. Si en un tramo
+hay objetos que la expresión regular no reconoce (campos extra, por
+ejemplo), ese tramo se decodifica con json.loads; los que tampoco así
+tienen ts se cuentan y se avisa al terminar.
+"""
+import json
+import logging
+import re
+
+import numpy as np
+import pandas as pd
+
+# Separador entre el nombre de una key y su '[' ("nombre" : [)
+_SEP_RE = re.compile(rb'\s*:\s*')
+# Un punto: {"ts":123,"value":"1.5"} (value con o sin comillas, o null)
+_PUNTO_RE = re.compile(rb'"ts"\s*:\s*(\d+)\s*,\s*"value"\s*:\s*"?([^",}]*)"?\s*\}')
+# El mismo punto con los campos al revés: {"value":"1.5","ts":123}
+_PUNTO_INVERSO_RE = re.compile(rb'"value"\s*:\s*"?([^",}]*)"?\s*,\s*"ts"\s*:\s*(\d+)\s*\}')
+# Un objeto sin objetos anidados, para decodificarlo con json.loads
+_OBJETO_RE = re.compile(rb'\{[^{}]*\}')
+
+
+def _key_antes_de(bloque: bytes, i: int):
+    """Nombre de la key cuya lista empieza en bloque[i] ('"nombre":['), o None."""
+    fin = bloque.rfind(b'"', 0, i)
+    inicio = bloque.rfind(b'"', 0, fin) if fin > 0 else -1
+    if inicio < 0 or not _SEP_RE.fullmatch(bloque, fin + 1, i):
+        return None
+    return bloque[inicio + 1:fin].decode("utf-8")
+
+
+class _Buffer:
+    """Arrays de ts/value de una key que crecen por duplicación si hace falta."""
+
+    def __init__(self, capacidad: int):
+        capacidad = max(int(capacidad), 16)
+        self.ts = np.empty(capacidad, dtype=np.int64)
+        self.value = np.empty(capacidad, dtype=np.float64)
+        self.n = 0
+
+    def extend(self, ts: np.ndarray, value: np.ndarray):
+        fin = self.n + len(ts)
+        if fin > len(self.ts):
+            capacidad = max(fin, 2 * len(self.ts))
+            self.ts = np.resize(self.ts, capacidad)
+            self.value = np.resize(self.value, capacidad)
+        self.ts[self.n:fin] = ts
+        self.value[self.n:fin] = value
+        self.n = fin
+
+
+def _a_float(valores: np.ndarray) -> np.ndarray:
+    """bytes → float64; valores no numéricos (null, texto) quedan como NaN."""
+    try:
+        return valores.astype(np.float64)
+    except ValueError:
+        salida = np.full(len(valores), np.nan)
+        for i, v in enumerate(valores):
+            try:
+                salida[i] = float(v)
+            except ValueError:
+                pass
+        return salida
+
+
+class TelemetryDecoder:
+    """
+    Decodificador incremental: feed(bloque) con los bytes según llegan y
+    finish() para obtener {key: (ts, value)} en orden ascendente de ts.
+    """
+
+    def __init__(self, capacidad: int = 1024):
+        self.capacidad = capacidad
+        self.buffers = {}
+        self.bytes = 0
+        self._pendiente = b""
+        self._key = None
+        # Puntos leídos con json.loads y objetos descartados por no ser puntos
+        self.rescatados = 0
+        self.descartados = 0
+
+    def _con_json(self, bloque: bytes, inicio: int, fin: int) -> list:
+        """Puntos (ts, value) del tramo decodificados uno a uno con json.loads."""
+        pares = []
+        for objeto in _OBJETO_RE.findall(bloque, inicio, fin):
+            try:
+                punto = json.loads(objeto)
+                ts = int(punto["ts"])
+            except (ValueError, KeyError, TypeError):
+                self.descartados += 1
+                continue
+            valor = punto.get("value")
+            pares.append((str(ts).encode(), b"null" if valor is None else str(valor).encode()))
+        self.rescatados += len(pares)
+        return pares
+
+    def _escanear(self, bloque: bytes, inicio: int, fin: int):
+        if self._key is None:
+            return
+        pares = _PUNTO_RE.findall(bloque, inicio, fin)
+        objetos = bloque.count(b"{", inicio, fin)
+        if len(pares) < objetos:
+            pares += [(ts, valor) for valor, ts in _PUNTO_INVERSO_RE.findall(bloque, inicio, fin)]
+            if len(pares) != objetos:
+                pares = self._con_json(bloque, inicio, fin)
+        if not pares:
+            return
+        crudo = np.array(pares, dtype=bytes)
+        buf = self.buffers.get(self._key)
+        if buf is None:
+            buf = self.buffers[self._key] = _Buffer(self.capacidad)
+        buf.extend(crudo[:, 0].astype(np.int64), _a_float(crudo[:, 1]))
+
+    def feed(self, chunk: bytes):
+        self.bytes += len(chunk)
+        datos = self._pendiente + chunk
+        # Solo se procesa hasta el último '}': lo que sigue puede ser un punto a medias
+        corte = datos.rfind(b"}") + 1
+        if corte == 0:
+            self._pendiente = datos
+            return
+        bloque, self._pendiente = datos[:corte], datos[corte:]
+
+        # Los valores numéricos no contienen '[': cada '[' abre la lista de una key
+        pos = 0
+        i = bloque.find(b"[")
+        while i != -1:
+            key = _key_antes_de(bloque, i)
+            if key is not None:
+                self._escanear(bloque, pos, i)
+                self._key = key
+                pos = i + 1
+            i = bloque.find(b"[", i + 1)
+        self._escanear(bloque, pos, len(bloque))
+
+    def finish(self) -> dict:
+        if self._pendiente.strip():
+            self.feed(b"")
+        if self.rescatados:
+            logging.info(f"{self.rescatados} puntos con formato no esperado leídos con json.loads")
+        if self.descartados:
+            logging.warning(f"{self.descartados} objetos de la respuesta sin ts descartados")
+        resultado = {}
+        for key, buf in self.buffers.items():
+            ts, value = buf.ts[:buf.n], buf.value[:buf.n]
+            validos = ~np.isnan(value)
+            if not validos.all():
+                logging.warning(f"Key '{key}': {int((~validos).sum())} valores no numéricos descartados")
+                ts, value = ts[validos], value[validos]
+            resultado[key] = _ascendente(ts, value)
+        return resultado
+
+
+def _ascendente(ts: np.ndarray, value: np.ndarray) -> tuple:
+    """ThingsBoard responde en orden descendente: basta invertir, sin ordenar."""
+    if len(ts) < 2 or (ts[1:] >= ts[:-1]).all():
+        return ts, value
+    if (ts[1:] <= ts[:-1]).all():
+        return ts[::-1], value[::-1]
+    orden = np.argsort(ts, kind="stable")
+    return ts[orden], value[orden]
+
+
+def decode_stream(chunks, capacidad: int = 1024) -> tuple:
+    """Decodifica un iterable de bloques de bytes. Retorna (arrays, bytes leídos)."""
+    decoder = TelemetryDecoder(capacidad)
+    for chunk in chunks:
+        if chunk:
+            decoder.feed(chunk)
+    return decoder.finish(), decoder.bytes
+
+
+def arrays_to_dataframe(arrays: dict) -> pd.DataFrame:
+    """
+    DataFrame con las columnas de parse_telemetry_to_dataframe (ts, value,
+    key, fecha), ordenado por fecha, a partir de {key: (ts, value)}.
+    """
+    arrays = {k: v for k, v in arrays.items() if len(v[0])}
+    if not arrays:
+        return pd.DataFrame(columns=["ts", "value", "key", "fecha"])
+
+    keys = list(arrays)
+    ts = np.concatenate([arrays[k][0] for k in keys])
+    codigos = np.repeat(np.arange(len(keys)), [len(arrays[k][0]) for k in keys])
+    # Se ordenan los arrays antes de construir el DataFrame: sort_values
+    # copiaría todas las columnas, incluida la de keys
+    orden = np.argsort(ts, kind="stable")
+    ts = ts[orden]
+    return pd.DataFrame({
+        "ts": ts,
+        "value": np.concatenate([arrays[k][1] for k in keys])[orden],
+        "key": np.array(keys, dtype=object)[codigos[orden]],
+        "fecha": ts.astype("datetime64[ms]"),
+    }, copy=False)
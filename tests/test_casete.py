@@ -0,0 +1,63 @@
+"""
+Casete: cada ventana de días recibe su propia respuesta al reproducirse en
+otro día, con los ts desplazados al rango pedido.
+"""
+import json
+
+import pytest
+import requests
+
+import casete
+from casete import DIA_MS, Casete, PeticionNoGrabada
+
+GRABACION_MS = 1_760_000_000_000 - 1_760_000_000_000 % DIA_MS + 10 * 60 * 60 * 1000  # 10:00 UTC
+DIA0 = GRABACION_MS - GRABACION_MS % DIA_MS
+
+
+def _url(inicio: int, fin: int, limit: int = 500) -> str:
+    return (f"http://tb/api/plugins/telemetry/DEVICE/dev-1/values/timeseries"
+            f"?keys=humidity&startTs={inicio}&endTs={fin}&limit={limit}")
+
+
+def _respuesta(datos: dict) -> requests.Response:
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    response.encoding = "utf-8"
+    response._content = json.dumps(datos).encode()
+    return response
+
+
+@pytest.fixture
+def grabado(tmp_path, monkeypatch):
+    """Casete con dos días distintos del mismo dispositivo y keys."""
+    ruta = str(tmp_path / "casete.jsonl.gz")
+    monkeypatch.setattr(casete, "_ahora_ms", lambda: GRABACION_MS)
+    grabadora = Casete(ruta, "record")
+    for dia in (1, 2):
+        inicio = DIA0 - dia * DIA_MS
+        cuerpo = {"humidity": [{"ts": inicio + 3600_000, "value": str(dia)}]}
+        grabadora.grabar("GET", _url(inicio, inicio + DIA_MS - 1), None, _respuesta(cuerpo), 0.0)
+    return ruta
+
+
+def test_cada_dia_recibe_su_ventana_desplazada(grabado, monkeypatch):
+    desfase = 3 * DIA_MS
+    monkeypatch.setattr(casete, "_ahora_ms", lambda: GRABACION_MS + desfase)
+    reproductor = Casete(grabado, "replay", latencia_ms=0)
+    for dia in (2, 1, 2):
+        inicio = DIA0 + desfase - dia * DIA_MS
+        datos = reproductor.reproducir("GET", _url(inicio, inicio + DIA_MS - 1)).json()
+        assert datos["humidity"] == [{"ts": inicio + 3600_000, "value": str(dia)}]
+
+
+def test_ventana_o_limit_no_grabados_fallan(grabado, monkeypatch):
+    monkeypatch.setattr(casete, "_ahora_ms", lambda: GRABACION_MS)
+    reproductor = Casete(grabado, "replay", latencia_ms=0)
+    inicio = DIA0 - 5 * DIA_MS
+    with pytest.raises(PeticionNoGrabada):
+        reproductor.reproducir("GET", _url(inicio, inicio + DIA_MS - 1))
+    inicio = DIA0 - DIA_MS
+    with pytest.raises(PeticionNoGrabada):
+        reproductor.reproducir("GET", _url(inicio, inicio + DIA_MS - 1, limit=1000))
+    assert reproductor.stats()["no_grabadas"] == 2
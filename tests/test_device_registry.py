@@ -0,0 +1,86 @@
+"""
+DeviceRegistry.refresh: las descargas no bloquean a otras sesiones y un
+sondeo fallido no vuelve a listar el tenant.
+"""
+import os
+import threading
+import time
+
+import pandas as pd
+import pytest
+
+os.environ.setdefault("THINGSBOARD_HOST", "http://127.0.0.1:0")
+os.environ.setdefault("THINGSBOARD_USERNAME", "test")
+os.environ.setdefault("THINGSBOARD_PASSWORD", "test")
+
+import device_registry  # noqa: E402
+from device_registry import DeviceRegistry  # noqa: E402
+
+
+class _TB:
+    """ThingsBoard simulado: cuenta peticiones y puede retener o fallar el sondeo."""
+
+    def __init__(self, monkeypatch, n: int = 3):
+        self.devices = [{"id": {"id": f"dev-{i}"}, "name": f"Sensor {i}", "createdTime": i} for i in range(n)]
+        self.sondeos = 0
+        self.listados = 0
+        self.fallar = False
+        self.retener = threading.Event()
+        self.retener.set()
+        self.en_sondeo = threading.Event()
+        monkeypatch.setattr(device_registry, "get_device_page", self.pagina)
+        monkeypatch.setattr(device_registry, "list_all_tenant_devices", self.listar)
+        monkeypatch.setattr(device_registry, "get_device_attributes",
+                            lambda jwt: pd.DataFrame({"device_id": [d["id"]["id"] for d in self.devices]}))
+
+    def pagina(self, jwt, page, size, **kwargs):
+        self.sondeos += 1
+        self.en_sondeo.set()
+        self.retener.wait(5)
+        if self.fallar:
+            raise ConnectionError("ThingsBoard no responde")
+        return {"totalElements": len(self.devices), "data": self.devices[-1:]}
+
+    def listar(self, jwt):
+        self.listados += 1
+        return list(self.devices)
+
+
+def test_refresh_lento_no_bloquea_a_otras_sesiones(monkeypatch):
+    tb = _TB(monkeypatch)
+    registro = DeviceRegistry(probe_interval=0)
+    registro.refresh("token")
+    assert len(registro) == 3
+
+    tb.retener.clear()
+    tb.en_sondeo.clear()
+    hilo = threading.Thread(target=registro.refresh, args=("token",))
+    hilo.start()
+    assert tb.en_sondeo.wait(5)
+
+    inicio = time.monotonic()
+    assert registro.refresh("token") is False
+    assert registro.get("dev-1")["name"] == "Sensor 1"
+    assert time.monotonic() - inicio < 0.5
+
+    tb.retener.set()
+    hilo.join(5)
+
+
+def test_sondeo_fallido_no_lista_y_se_aplaza(monkeypatch):
+    tb = _TB(monkeypatch)
+    registro = DeviceRegistry(probe_interval=60, full_refresh_interval=0)
+    registro.refresh("token")
+    assert (tb.sondeos, tb.listados) == (1, 1)
+
+    tb.fallar = True
+    monkeypatch.setattr(registro, "_next_probe", 0.0)
+    assert registro.refresh("token") is False
+    # Aunque tocara el listado completo, no se pide con ThingsBoard fallando
+    assert (tb.sondeos, tb.listados) == (2, 1)
+    assert len(registro) == 3
+
+    # Las siguientes llamadas esperan al final del aplazamiento
+    assert registro.refresh("token") is False
+    assert tb.sondeos == 2
+    assert registro._next_probe - time.monotonic() == pytest.approx(60, abs=5)
@@ -0,0 +1,61 @@
+"""
+EstadisticasFlota: publicaciones parciales, repetidas o con puntos que
+llegan tarde acaban en las mismas estadísticas que el día completo.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from estadisticas import DIA_MS, EstadisticasFlota
+
+DIA = 1_760_000_000_000 - 1_760_000_000_000 % DIA_MS
+TS = DIA + np.arange(144) * 600_000
+VALORES = 20 + 5 * np.sin(np.arange(144) / 10)
+
+
+def _delta(indices, device_id="dev-1", serie=0) -> pd.DataFrame:
+    indices = np.sort(np.asarray(indices))
+    return pd.DataFrame({"device_id": device_id, "key": "humidity", "serie": serie,
+                         "ts": TS[indices], "value": VALORES[indices]})
+
+
+def _esperado(indices) -> pd.Series:
+    v = pd.Series(VALORES[np.unique(indices)])
+    return pd.Series({"n": len(v), "media": v.mean(), "var": v.var(), "min": v.min(), "max": v.max()})
+
+
+@pytest.mark.parametrize("publicaciones", [
+    # Primer punto, último punto y luego el día completo
+    [[0], [143], range(144)],
+    # Día con huecos (subida diferida) y después completo, dos veces
+    [range(0, 144, 2), range(144), range(144)],
+    # Solo rellenos parciales: cada publicación amplía el intervalo
+    [range(50, 60), range(40, 70), range(0, 144)],
+    # Publicación parcial dentro del intervalo ya cubierto: no se cuenta dos veces
+    [range(144), range(10, 20)],
+    # Extremos primero y el interior después (subida diferida)
+    [[0, 143], range(1, 143)],
+    # Publicación con más puntos que no contiene todos los ya vistos
+    [range(0, 10), range(0, 144, 2)],
+])
+def test_estadisticas_igual_que_el_dia_completo(publicaciones):
+    est = EstadisticasFlota()
+    for indices in publicaciones:
+        est.procesar(_delta(indices))
+    vistos = np.unique(np.concatenate([np.asarray(i) for i in publicaciones]))
+
+    for resumen in (est.resumen(), est.resumen(por_dispositivo=True), est.resumen_zonas()):
+        fila = resumen.iloc[0]
+        esperado = _esperado(vistos)
+        assert fila["n"] == esperado["n"]
+        assert fila[["media", "var", "min", "max"]].astype(float).to_numpy() == pytest.approx(
+            esperado[["media", "var", "min", "max"]].to_numpy())
+
+
+def test_flota_combina_dispositivos_con_publicaciones_distintas():
+    est = EstadisticasFlota()
+    est.procesar(pd.concat([_delta([0]), _delta([143], "dev-2", 1)], ignore_index=True))
+    est.procesar(pd.concat([_delta(range(144)), _delta(range(144), "dev-2", 1)], ignore_index=True))
+    fila = est.resumen().iloc[0]
+    assert fila["n"] == 288
+    assert fila["media"] == pytest.approx(VALORES.mean())
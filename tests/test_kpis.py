@@ -0,0 +1,28 @@
+"""
+frescura_bateria: misma clasificación que la versión con comparaciones.
+"""
+import pandas as pd
+
+from kpis import frescura_bateria
+
+
+def _asignar_color(td):
+    # Clasificación original, punto a punto
+    if td >= pd.Timedelta(days=1):
+        return "red"
+    elif td >= pd.Timedelta(hours=12):
+        return "orange"
+    elif td >= pd.Timedelta(hours=1):
+        return "yellow"
+    return "green"
+
+
+def test_frescura_igual_que_la_original_incluidos_sin_timestamp():
+    now = pd.Timestamp("2026-01-10 12:00")
+    df = pd.DataFrame({"timestamp": [
+        now, now - pd.Timedelta(minutes=59), now - pd.Timedelta(hours=1), now - pd.Timedelta(hours=12),
+        now - pd.Timedelta(days=1), now - pd.Timedelta(days=30), now + pd.Timedelta(hours=2), pd.NaT,
+    ]})
+    resultado = frescura_bateria(df, now)
+    assert resultado["color"].tolist() == [_asignar_color(td) for td in now - df["timestamp"]]
+    assert resultado["color"].iloc[-1] == "green"
@@ -0,0 +1,115 @@
+"""
+ClienteTB con una sesión simulada: apertura del circuito, sonda
+semiabierta, Retry-After y ranuras del limitador tras cualquier error.
+"""
+import io
+import time
+
+import pytest
+import requests
+
+from resiliencia import CircuitoAbierto, ClienteTB, LimitadorAIMD
+
+URL = "http://tb/api/plugins/telemetry/DEVICE/dev-1/values/timeseries"
+
+
+def _respuesta(status: int = 200, cabeceras: dict = None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(cabeceras or {})
+    response._content = b"{}"
+    response.raw = io.BytesIO(b"{}")
+    return response
+
+
+class _Sesion:
+    """Sustituye a requests.Session: cada petición consume la siguiente respuesta o excepción del guion."""
+
+    def __init__(self, *guion):
+        self.guion = list(guion)
+        self.enviadas = []
+
+    def request(self, metodo, url, **kwargs):
+        self.enviadas.append(time.monotonic())
+        siguiente = self.guion.pop(0) if len(self.guion) > 1 else self.guion[0]
+        if isinstance(siguiente, BaseException):
+            raise siguiente
+        return siguiente
+
+
+def _cliente(sesion: _Sesion, **opciones) -> ClienteTB:
+    opciones = {"max_reintentos": 0, "min_llamadas": 4, "ventana": 4, "umbral_error": 0.5, "espera": 0.1, **opciones}
+    cliente = ClienteTB(limitador=LimitadorAIMD(inicial=4, maximo=4), **opciones)
+    cliente._sesion = sesion
+    return cliente
+
+
+def _pedir(cliente: ClienteTB) -> int:
+    with cliente.peticion("telemetry", "GET", URL) as response:
+        return response.status_code
+
+
+def test_circuito_se_abre_al_llegar_al_umbral():
+    sesion = _Sesion(_respuesta(200), _respuesta(200), _respuesta(500))
+    cliente = _cliente(sesion)
+    assert [_pedir(cliente) for _ in range(4)] == [200, 200, 500, 500]
+    assert cliente.circuito("telemetry").estado == "abierto"
+    with pytest.raises(CircuitoAbierto):
+        _pedir(cliente)
+    assert len(sesion.enviadas) == 4
+
+
+@pytest.mark.parametrize("respuesta_sonda, estado", [
+    (_respuesta(200), "cerrado"),
+    (_respuesta(500), "abierto"),
+    (requests.exceptions.TooManyRedirects("bucle"), "abierto"),
+])
+def test_una_sola_sonda_semiabierta(respuesta_sonda, estado):
+    sesion = _Sesion(_respuesta(500))
+    cliente = _cliente(sesion)
+    for _ in range(4):
+        _pedir(cliente)
+    time.sleep(0.15)
+
+    sesion.guion = [respuesta_sonda]
+    try:
+        with cliente.peticion("telemetry", "GET", URL):
+            # Mientras la sonda sigue abierta no sale ninguna otra petición
+            with pytest.raises(CircuitoAbierto):
+                _pedir(cliente)
+    except requests.exceptions.TooManyRedirects:
+        pass
+    assert cliente.circuito("telemetry").estado == estado
+    assert cliente.limitador.stats()["en_curso"] == 0
+
+
+def test_respeta_retry_after():
+    sesion = _Sesion(_respuesta(429, {"Retry-After": "0.3"}), _respuesta(200))
+    cliente = _cliente(sesion, max_reintentos=1)
+    assert _pedir(cliente) == 200
+    assert sesion.enviadas[1] - sesion.enviadas[0] >= 0.3
+
+
+@pytest.mark.parametrize("error", [
+    requests.exceptions.ConnectionError("caído"),
+    requests.exceptions.ReadTimeout("lento"),
+    requests.exceptions.TooManyRedirects("bucle"),
+    requests.exceptions.InvalidHeader("cabecera"),
+])
+def test_ranuras_vuelven_a_cero_tras_errores(error):
+    cliente = _cliente(_Sesion(error))
+    for _ in range(4):
+        with pytest.raises(type(error)):
+            _pedir(cliente)
+        assert cliente.limitador.stats()["en_curso"] == 0
+    # Los errores cuentan en el circuito: se abre en lugar de quedarse esperando
+    assert cliente.circuito("telemetry").estado == "abierto"
+
+
+def test_error_al_leer_el_cuerpo_cuenta_como_fallo():
+    cliente = _cliente(_Sesion(_respuesta(200)), min_llamadas=1, ventana=1)
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        with cliente.peticion("telemetry", "GET", URL):
+            raise requests.exceptions.ChunkedEncodingError("conexión cortada")
+    assert cliente.limitador.stats()["en_curso"] == 0
+    assert cliente.circuito("telemetry").estado == "abierto"
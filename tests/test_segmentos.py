@@ -0,0 +1,41 @@
+"""
+SegmentCache.get_windows: la carga de flota en el pool de procesos sirve lo
+mismo que get_window dispositivo a dispositivo y deja los días en caché.
+"""
+import os
+
+import pandas as pd
+import pytest
+
+os.environ.setdefault("THINGSBOARD_HOST", "http://127.0.0.1:0")
+os.environ.setdefault("THINGSBOARD_USERNAME", "test")
+os.environ.setdefault("THINGSBOARD_PASSWORD", "test")
+
+import data_queries  # noqa: E402
+from benchmarks.tb_stub import StubConfig, ThingsBoardStub  # noqa: E402
+from segmentos import SegmentCache  # noqa: E402
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    with ThingsBoardStub(StubConfig(devices=4, points_per_key=300, days=10)) as stub:
+        monkeypatch.setattr(data_queries, "TB_URL", stub.url)
+        yield stub
+
+
+def test_get_windows_en_procesos_igual_a_get_window(stub):
+    fin = pd.Timestamp.now(tz="UTC").tz_localize(None).normalize() + pd.Timedelta(days=1)
+    inicio = fin - pd.Timedelta(days=5)
+    ids = stub.device_ids
+
+    esperado = {did: SegmentCache().get_window(did, "token", inicio, fin) for did in ids}
+    cache = SegmentCache()
+    obtenido = cache.get_windows(ids, "token", inicio, fin, procesos=2)
+
+    assert list(obtenido) == ids
+    for did in ids:
+        pd.testing.assert_frame_equal(obtenido[did], esperado[did], check_dtype=False)
+    # Un tramo de 5 días por dispositivo, y después todo sale de la caché
+    assert cache.stats()["requests"] == len(ids)
+    cache.get_windows(ids, "token", inicio, fin, procesos=2)
+    assert cache.stats()["requests"] == len(ids)
@@ -0,0 +1,107 @@
+"""
+Single-flight de data_queries: un seguidor que sigue esperando mientras el
+primer llamador modifica su resultado no debe recibir datos modificados.
+"""
+import os
+import threading
+import time
+
+import pandas as pd
+
+# data_queries lee la configuración al importarse: valores ficticios
+os.environ.setdefault("THINGSBOARD_HOST", "http://127.0.0.1:0")
+os.environ.setdefault("THINGSBOARD_USERNAME", "test")
+os.environ.setdefault("THINGSBOARD_PASSWORD", "test")
+
+import data_queries  # noqa: E402
+
+
+class _EventoRetenido(threading.Event):
+    """Evento cuyo wait() vuelve solo cuando además se abre `compuerta`."""
+
+    compuerta = threading.Event()
+
+    def wait(self, timeout=None):
+        resultado = super().wait(timeout)
+        _EventoRetenido.compuerta.wait(5)
+        return resultado
+
+
+class _LlamadaRetenida(data_queries._InflightCall):
+    def __init__(self):
+        super().__init__()
+        self.done = _EventoRetenido()
+
+
+def _esperar(condicion, limite: float = 5.0):
+    fin = time.monotonic() + limite
+    while not condicion():
+        assert time.monotonic() < fin, "tiempo de espera agotado"
+        time.sleep(0.005)
+
+
+def test_seguidor_no_ve_las_modificaciones_del_lider(monkeypatch):
+    monkeypatch.setattr(data_queries, "_InflightCall", _LlamadaRetenida)
+    _EventoRetenido.compuerta.clear()
+    original = pd.DataFrame({"ts": [1, 2, 3], "value": [10.0, 20.0, 30.0], "key": ["t", "t", "t"]})
+    liberar_fetch = threading.Event()
+    coalescidas = data_queries.get_singleflight_stats()["coalesced"]
+
+    def fetch():
+        liberar_fetch.wait(5)
+        return original.copy()
+
+    resultados = {}
+
+    def lider():
+        df = data_queries._single_flight(("test", "lider"), fetch)
+        # El llamador añade columnas y modifica valores in situ, como las páginas
+        df["fecha"] = pd.to_datetime(df["ts"], unit="ms")
+        df["value"] *= 0
+        resultados["lider"] = df
+
+    def seguidor():
+        resultados["seguidor"] = data_queries._single_flight(("test", "lider"), fetch)
+
+    hilo_lider = threading.Thread(target=lider)
+    hilo_lider.start()
+    _esperar(lambda: data_queries.get_singleflight_stats()["in_flight"] > 0)
+    hilo_seguidor = threading.Thread(target=seguidor)
+    hilo_seguidor.start()
+    _esperar(lambda: data_queries.get_singleflight_stats()["coalesced"] > coalescidas)
+
+    # El líder termina y modifica su resultado mientras el seguidor sigue retenido
+    liberar_fetch.set()
+    hilo_lider.join(5)
+    assert "lider" in resultados
+    _EventoRetenido.compuerta.set()
+    hilo_seguidor.join(5)
+
+    pd.testing.assert_frame_equal(resultados["seguidor"], original)
+    assert (resultados["lider"]["value"] == 0).all()
+
+
+def test_seguidor_recibe_el_error_del_lider():
+    liberar_fetch = threading.Event()
+
+    def fetch():
+        liberar_fetch.wait(5)
+        raise RuntimeError("ThingsBoard caído")
+
+    errores = []
+
+    def llamar():
+        try:
+            data_queries._single_flight(("test", "error"), fetch)
+        except RuntimeError as err:
+            errores.append(err)
+
+    hilos = [threading.Thread(target=llamar) for _ in range(3)]
+    for hilo in hilos:
+        hilo.start()
+    _esperar(lambda: data_queries.get_singleflight_stats()["in_flight"] > 0)
+    time.sleep(0.05)
+    liberar_fetch.set()
+    for hilo in hilos:
+        hilo.join(5)
+    assert len(errores) == 3
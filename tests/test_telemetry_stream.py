@@ -0,0 +1,45 @@
+"""
+Decodificación por bloques: el resultado coincide con json.loads aunque los
+puntos traigan los campos en otro orden o con campos extra.
+"""
+import json
+
+import numpy as np
+import pytest
+
+from telemetry_stream import TelemetryDecoder, decode_stream
+
+
+def _referencia(cuerpo: bytes) -> dict:
+    resultado = {}
+    for key, puntos in json.loads(cuerpo).items():
+        pares = sorted((int(p["ts"]), float(p["value"])) for p in puntos if p.get("value") is not None)
+        resultado[key] = pares
+    return resultado
+
+
+def _decodificar(cuerpo: bytes, tamano: int) -> dict:
+    arrays, leidos = decode_stream(cuerpo[i:i + tamano] for i in range(0, len(cuerpo), tamano))
+    assert leidos == len(cuerpo)
+    return {k: list(zip(ts.tolist(), v.tolist())) for k, (ts, v) in arrays.items()}
+
+
+CUERPO = json.dumps({
+    "humidity": [{"ts": 1_700_000_003_000, "value": "21.5"}, {"value": "20.1", "ts": 1_700_000_002_000},
+                 {"value": 19.75, "ts": 1_700_000_001_000}, {"ts": 1_700_000_000_000, "value": None}],
+    "temperature": [{"ts": 1_700_000_001_000, "value": "15.0", "extra": "x"},
+                    {"ts": 1_700_000_000_000, "value": "14.5"}],
+}).encode()
+
+
+@pytest.mark.parametrize("tamano", [1, 7, 64, len(CUERPO)])
+def test_cualquier_orden_de_campos_como_json_loads(tamano):
+    assert _decodificar(CUERPO, tamano) == _referencia(CUERPO)
+
+
+def test_objetos_sin_ts_se_cuentan():
+    decoder = TelemetryDecoder()
+    decoder.feed(b'{"humidity":[{"ts":1,"value":"2"},{"value":"3"},{"ts":4,"value":"5"}]}')
+    arrays = decoder.finish()
+    np.testing.assert_array_equal(arrays["humidity"][0], [1, 4])
+    assert decoder.descartados == 1
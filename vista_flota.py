@@ -0,0 +1,153 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import data_queries
+from data_queries import init_connection, get_latest_values_page, count_entities, numeric_key_filter
+from instrumentation import span, render_debug_panel
+from kpis import ESTADOS, ESTADO_ICONOS, estado_semaforo
+from sensores import ESQUEMAS, ESCALA_BATERIA, RANGOS, keys_de
+
+# Configuración de página
+st.set_page_config(
+    page_title="Vista de Flota - Permacultura Tech",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+st.title("🗺️ Vista de Flota")
+
+# ===== INICIALIZAR CONEXIÓN =====
+try:
+    jwt_token, refresh_token = init_connection()
+except Exception as e:
+    st.error(f"Error de conexión a ThingsBoard: {e}")
+    st.stop()
+
+MAGNITUDES = {
+    "humedad": "Humedad (%)",
+    "temperatura": "Temperatura (°C)",
+    "ce": "CE (dS/m)",
+}
+# Filtro "fuera de rango" → magnitud
+FUERA_DE_RANGO = {f"{etiqueta.split(' (')[0]} fuera de rango": m for m, etiqueta in MAGNITUDES.items()}
+TAMANOS_PAGINA = [50, 100, 250, 500]
+
+
+def filtro_fuera_de_rango(esquema: dict, magnitud: str) -> dict:
+    """keyFilter: último valor fuera del rango verde de la magnitud."""
+    verde_min, verde_max = RANGOS[magnitud]["verde"]
+    return numeric_key_filter(esquema[magnitud], ("LESS", verde_min), ("GREATER", verde_max))
+
+# ===== CONTROLES (todo se resuelve en ThingsBoard: búsqueda, filtro, orden y página) =====
+esquema_defecto = "clasico" if "soil_humidity" in data_queries.TB_KEYS else "nuevo"
+nombre_esquema = st.sidebar.radio(
+    "Esquema de keys", list(ESQUEMAS),
+    index=list(ESQUEMAS).index(esquema_defecto),
+    format_func=lambda e: "Clásico (soil_*)" if e == "clasico" else "Nuevo",
+    horizontal=True
+)
+esquema = ESQUEMAS[nombre_esquema]
+escala_bateria = ESCALA_BATERIA[nombre_esquema]
+keys = keys_de(esquema, (*MAGNITUDES, "bateria"))
+
+busqueda = st.sidebar.text_input("🔎 Buscar por nombre", key="busqueda_flota").strip()
+
+filtro = st.sidebar.selectbox(
+    "Filtrar",
+    ["Todos", *FUERA_DE_RANGO, "Batería baja"],
+    key="filtro_flota"
+)
+key_filters = []
+if filtro == "Batería baja":
+    umbral = st.sidebar.slider("Umbral de batería (%)", 0, 100, 20, key="umbral_flota")
+    key_filters = [numeric_key_filter(esquema["bateria"], ("LESS", umbral / escala_bateria))]
+elif filtro != "Todos":
+    key_filters = [filtro_fuera_de_rango(esquema, FUERA_DE_RANGO[filtro])]
+
+columnas_orden = {"Nombre": "name", **{e: esquema[m] for m, e in MAGNITUDES.items()}, "Batería (%)": esquema["bateria"]}
+orden = st.sidebar.selectbox("Ordenar por", list(columnas_orden), key="orden_flota")
+descendente = st.sidebar.toggle("Descendente", key="desc_flota")
+tamano = st.sidebar.selectbox("Filas por página", TAMANOS_PAGINA, index=1, key="tamano_flota")
+
+# Al cambiar búsqueda, filtro, orden o tamaño se vuelve a la primera página
+consulta = (nombre_esquema, busqueda, filtro, st.session_state.get("umbral_flota"), orden, descendente, tamano)
+if st.session_state.get("consulta_flota") != consulta:
+    st.session_state["consulta_flota"] = consulta
+    st.session_state["pagina_flota"] = 1
+
+# ===== CARGA =====
+@st.cache_data(ttl=30, max_entries=256, show_spinner=False)
+def cargar_pagina(_jwt, keys, page, page_size, text_search, sort_key, sort_direction, key_filters):
+    """Una página de últimos valores; el JWT no forma parte de la clave de caché."""
+    return get_latest_values_page(
+        _jwt, list(keys), page=page, page_size=page_size, text_search=text_search,
+        sort_key=sort_key, sort_direction=sort_direction, key_filters=key_filters
+    )
+
+@st.cache_data(ttl=60, max_entries=64, show_spinner=False)
+def contar(_jwt, key_filters):
+    return count_entities(_jwt, key_filters)
+
+pagina = int(st.session_state.get("pagina_flota", 1))
+try:
+    with span("fleet.overview_page", page=pagina, size=tamano):
+        df, total = cargar_pagina(
+            jwt_token, tuple(keys), pagina - 1, tamano, busqueda,
+            columnas_orden[orden], "DESC" if descendente else "ASC", key_filters
+        )
+        total_paginas = max(1, -(-total // tamano))
+        if pagina > total_paginas:
+            # La flota cambió entre reruns: se muestra la última página disponible
+            pagina = st.session_state["pagina_flota"] = total_paginas
+            df, total = cargar_pagina(
+                jwt_token, tuple(keys), pagina - 1, tamano, busqueda,
+                columnas_orden[orden], "DESC" if descendente else "ASC", key_filters
+            )
+except Exception as e:
+    st.error(f"Error al consultar la flota: {e}")
+    st.stop()
+
+# ===== RESUMEN DE LA FLOTA (conteos en ThingsBoard, sin descargar filas) =====
+try:
+    resumen = {"Dispositivos": contar(jwt_token, [])}
+    for titulo, magnitud in FUERA_DE_RANGO.items():
+        resumen[titulo] = contar(jwt_token, [filtro_fuera_de_rango(esquema, magnitud)])
+    for col, (titulo, valor) in zip(st.columns(len(resumen)), resumen.items()):
+        col.metric(titulo, f"{valor:,}")
+except Exception as e:
+    st.warning(f"No se pudo calcular el resumen de la flota: {e}")
+
+# ===== TABLA =====
+st.caption(f"{total:,} dispositivos · página {pagina} de {total_paginas}")
+
+if df.empty:
+    st.info("Ningún dispositivo coincide con la búsqueda o el filtro")
+else:
+    tabla = pd.DataFrame({"Dispositivo": df["name"]})
+    for magnitud, etiqueta in MAGNITUDES.items():
+        valores = df[esquema[magnitud]].to_numpy()
+        codigos = estado_semaforo(valores, RANGOS[magnitud])
+        tabla[etiqueta] = valores
+        tabla[f"Estado {etiqueta.split(' (')[0].lower()}"] = ESTADO_ICONOS[codigos] + " " + np.array(ESTADOS, dtype=object)[codigos]
+    tabla["Batería (%)"] = df[esquema["bateria"]] * escala_bateria
+    tabla["Último reporte"] = df["last_seen"]
+
+    st.dataframe(
+        tabla,
+        hide_index=True,
+        width="stretch",
+        height=min(35 * (len(tabla) + 1) + 3, 700),
+        column_config={
+            "Humedad (%)": st.column_config.NumberColumn(format="%.1f"),
+            "Temperatura (°C)": st.column_config.NumberColumn(format="%.1f"),
+            "CE (dS/m)": st.column_config.NumberColumn(format="%.2f"),
+            "Batería (%)": st.column_config.ProgressColumn(format="%.0f%%", min_value=0, max_value=100),
+            "Último reporte": st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm"),
+        }
+    )
+
+st.number_input("Página", min_value=1, max_value=total_paginas, step=1, key="pagina_flota")
+
+# ===== PANEL DE DEPURACIÓN =====
+render_debug_panel()